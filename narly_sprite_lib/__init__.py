@@ -0,0 +1,12 @@
+"""
+Implementation modules for the narly_sprite gimp plugin.
+
+This lives in a sub-directory of the plug-ins folder so that gimp doesn't
+try to query the modules as plugins of their own.
+
+core, composite, export, importers, frames and ui hold the procedures
+registered by narly_sprite.py and talk to gimp (constants holds their
+parameter values). The rest (png, sheet, palette, scale, collision, blend, filters, texarray, ...)
+work on raw pixels only and must not import gimpfu, since they also run
+in the background worker.
+"""
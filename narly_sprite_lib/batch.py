@@ -0,0 +1,111 @@
+"""
+The gimp side of the export daemon (see daemon.py). Each daemon worker is
+a gimp batch process running serve(), so gimp, python-fu and the plugin
+modules are only loaded once per worker instead of once per job:
+
+	gimp -i --batch-interpreter=python-fu-eval \
+		-b "from narly_sprite_lib.batch import serve; serve('/tmp/sock')" \
+		-b "pdb.gimp_quit(1)"
+
+serve() connects back to the daemon's socket and runs the export jobs it
+sends, one json object per line, answering each with one line:
+
+	{"ok": true, "paths": [...], "seconds": 1.2}
+	{"ok": false, "error": "some message", "seconds": 0.1}
+"""
+
+from gimpfu import *
+
+import os
+import json
+import time
+import socket
+import hashlib
+import traceback
+
+from narly_sprite_lib.constants import *
+from narly_sprite_lib.core import *
+from narly_sprite_lib.composite import get_frame_cache_root, set_frame_cache_dir
+from narly_sprite_lib.export import export_sprite_sheet, find_animation, get_animation_frame_nums
+from narly_sprite_lib.daemon import JOB_DEFAULTS
+
+SHEET_TYPES = {
+	"horizontal": HORIZONTAL,
+	"grid": GRID,
+}
+
+def get_job_frames(img, animation_name):
+	"""
+	@returns the frames of the named animation, or all of the frames
+	"""
+	frames = get_frames(img)
+	if not animation_name:
+		return frames
+
+	animation = find_animation(get_config(img)["animations"], animation_name)
+	if animation is None:
+		raise ValueError("there's no animation named %s" % animation_name)
+	frames_by_num = dict((get_frame_num(frame), frame) for frame in frames)
+	return [frames_by_num[num] for num in get_animation_frame_nums(img, animation) if num in frames_by_num]
+
+def run_export_job(job):
+	"""
+	Loads job["xcf"], exports it as a sprite sheet with the job's options
+	(see daemon.JOB_DEFAULTS) and closes it again.
+
+	@returns the paths of the files that were written
+	"""
+	options = dict(JOB_DEFAULTS)
+	options.update(job)
+	if options["sheet_type"] not in SHEET_TYPES:
+		raise ValueError("unknown sheet type %s" % options["sheet_type"])
+
+	path = os.path.abspath(options["xcf"])
+	img = pdb.gimp_file_load(path, path)
+	try:
+		frames = get_job_frames(img, options["animation"])
+		if len(frames) == 0:
+			raise ValueError("%s has no frames" % path)
+		layer = img.active_layer or frames[0]
+
+		paths = export_sprite_sheet(img, layer, frames, SHEET_TYPES[options["sheet_type"]],
+			options["max_width"], options["max_height"], options["power_of_two"],
+			options["fixed_cols"], options["padding"], options["extrude"],
+			options["write_metadata"], options["export_path"], False,
+			options["palette_colors"], options["dither"], options["palette_file"],
+			options["collision"], display=False, variants_file=options["variants_file"])
+	finally:
+		pdb.gimp_image_delete(img)
+
+	# export_sprite_sheet only reports why it gave up with gimp.message
+	if len(paths) == 0:
+		raise RuntimeError("nothing was exported, see the worker's output")
+	return paths
+
+def serve(socket_path):
+	"""
+	Runs export jobs from the daemon until it closes the connection.
+	"""
+	# the workers all load the same images, so each one gets frame caches
+	# of its own. The socket path is unique to the worker while it runs,
+	# and the same for it across restarts of the daemon.
+	set_frame_cache_dir(os.path.join(get_frame_cache_root(),
+		"worker_" + hashlib.sha1(socket_path).hexdigest()[:12]))
+
+	conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	conn.connect(socket_path)
+	f = conn.makefile("r+", 1)
+	try:
+		for line in iter(f.readline, ""):
+			start = time.time()
+			try:
+				res = {"ok": True, "paths": run_export_job(json.loads(line))}
+			except Exception as e:
+				traceback.print_exc()
+				res = {"ok": False, "error": str(e) or e.__class__.__name__}
+			res["seconds"] = time.time() - start
+			f.write(json.dumps(res) + "\n")
+			f.flush()
+	finally:
+		f.close()
+		conn.close()
@@ -0,0 +1,183 @@
+"""
+Compositing of layer trees with numpy, following gimp 2.8's layer modes,
+so frames can be composited without showing them in the image (and in
+other processes than gimp's).
+
+A layer is a dict like the ones in a worker snapshot:
+
+	x, y, width, height	position in the image and size
+	visible, opacity	opacity is 0 - 100
+	mode			gimp's layer mode (the values below)
+	children		only for groups, their layers (top layer first)
+
+The pixels of a layer (RGBA) and of its layer mask (one byte per pixel,
+or None) are fetched with a read(layer) callback.
+"""
+
+# the same values as gimp's layer modes
+NORMAL = 0
+MULTIPLY = 3
+SCREEN = 4
+OVERLAY = 5
+DIFFERENCE = 6
+ADDITION = 7
+SUBTRACT = 8
+DARKEN_ONLY = 9
+LIGHTEN_ONLY = 10
+DIVIDE = 15
+DODGE = 16
+BURN = 17
+HARDLIGHT = 18
+SOFTLIGHT = 19
+GRAIN_EXTRACT = 20
+GRAIN_MERGE = 21
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def has_numpy():
+	return _import_numpy() is not None
+
+# mode -> function(numpy, base, layer) of the color channels (0 - 255)
+_BLEND_FUNCS = {
+	MULTIPLY: lambda numpy, a, b: a * b / 255.0,
+	SCREEN: lambda numpy, a, b: 255.0 - (255.0 - a) * (255.0 - b) / 255.0,
+	# gimp 2.8's overlay is really a soft light
+	OVERLAY: lambda numpy, a, b: a * (a + 2.0 * b * (255.0 - a) / 255.0) / 255.0,
+	DIFFERENCE: lambda numpy, a, b: numpy.abs(a - b),
+	ADDITION: lambda numpy, a, b: numpy.minimum(a + b, 255.0),
+	SUBTRACT: lambda numpy, a, b: numpy.maximum(a - b, 0.0),
+	DARKEN_ONLY: lambda numpy, a, b: numpy.minimum(a, b),
+	LIGHTEN_ONLY: lambda numpy, a, b: numpy.maximum(a, b),
+	DIVIDE: lambda numpy, a, b: numpy.minimum(a * 256.0 / (b + 1.0), 255.0),
+	DODGE: lambda numpy, a, b: numpy.minimum(a * 256.0 / (256.0 - b), 255.0),
+	BURN: lambda numpy, a, b: 255.0 - numpy.minimum((255.0 - a) * 256.0 / (b + 1.0), 255.0),
+	HARDLIGHT: lambda numpy, a, b: numpy.where(
+		b > 128.0,
+		255.0 - (255.0 - a) * (255.0 - 2.0 * (b - 128.0)) / 256.0,
+		numpy.minimum(a * 2.0 * b / 256.0, 255.0)
+	),
+	SOFTLIGHT: lambda numpy, a, b: (
+		(255.0 - a) * (a * b / 255.0) / 255.0
+		+ a * (255.0 - (255.0 - a) * (255.0 - b) / 255.0) / 255.0
+	),
+	GRAIN_EXTRACT: lambda numpy, a, b: numpy.clip(a - b + 128.0, 0.0, 255.0),
+	GRAIN_MERGE: lambda numpy, a, b: numpy.clip(a + b - 128.0, 0.0, 255.0),
+}
+
+SUPPORTED_MODES = frozenset([NORMAL] + _BLEND_FUNCS.keys())
+
+def can_composite(layers):
+	"""
+	Whether composite_layers can handle the layers (numpy is available
+	and every visible layer uses a supported mode)
+	"""
+	if not has_numpy():
+		return False
+	for layer in layers:
+		if not layer["visible"]:
+			continue
+		if layer["mode"] not in SUPPORTED_MODES:
+			return False
+		if "children" in layer and not can_composite(layer["children"]):
+			return False
+	return True
+
+def _blend_onto(numpy, dest, src, mask, mode, opacity):
+	"""
+	Composites src onto dest (both float arrays of the same shape, with
+	0 - 255 channels) the way gimp 2.8 does. For modes other than normal
+	the layer is only as opaque as what's below it.
+	"""
+	dest_rgb = dest[..., :3]
+	dest_a = dest[..., 3:4] / 255.0
+	src_rgb = src[..., :3]
+	src_a = src[..., 3:4] / 255.0
+	if mode != NORMAL:
+		src_rgb = _BLEND_FUNCS[mode](numpy, dest_rgb, src_rgb)
+		src_a = numpy.minimum(src_a, dest_a)
+
+	src_a = src_a * opacity
+	if mask is not None:
+		src_a = src_a * (mask[..., None] / 255.0)
+
+	out_a = dest_a + (1.0 - dest_a) * src_a
+	ratio = src_a / numpy.where(out_a > 0, out_a, 1.0)
+	dest[..., :3] = src_rgb * ratio + dest_rgb * (1.0 - ratio)
+	dest[..., 3:4] = out_a * 255.0
+
+def _composite_into(numpy, canvas, layers, read):
+	height, width = canvas.shape[:2]
+
+	# gimp lists the top layer first
+	for layer in reversed(layers):
+		if not layer["visible"]:
+			continue
+
+		if "children" in layer:
+			# groups are composited on their own, then onto what's below
+			group = numpy.zeros_like(canvas)
+			_composite_into(numpy, group, layer["children"], read)
+			_blend_onto(numpy, canvas, group, None, layer["mode"], layer["opacity"] / 100.0)
+			continue
+
+		x0 = max(layer["x"], 0)
+		y0 = max(layer["y"], 0)
+		x1 = min(layer["x"] + layer["width"], width)
+		y1 = min(layer["y"] + layer["height"], height)
+		if x1 <= x0 or y1 <= y0:
+			continue
+
+		data, mask = read(layer)
+		src_y = slice(y0 - layer["y"], y1 - layer["y"])
+		src_x = slice(x0 - layer["x"], x1 - layer["x"])
+		src = numpy.frombuffer(data, numpy.uint8).reshape(layer["height"], layer["width"], 4)[src_y, src_x]
+		if mask is not None:
+			mask = numpy.frombuffer(mask, numpy.uint8).reshape(layer["height"], layer["width"])[src_y, src_x]
+		_blend_onto(numpy, canvas[y0:y1, x0:x1], src.astype(numpy.float32), mask, layer["mode"], layer["opacity"] / 100.0)
+
+def composite_layers(width, height, layers, read):
+	"""
+	Composites the layers (see the module docs) onto a transparent
+	width x height canvas. Check can_composite first.
+
+	@returns the raw RGBA pixels
+	"""
+	numpy = _import_numpy()
+	canvas = numpy.zeros((height, width, 4), numpy.float32)
+	_composite_into(numpy, canvas, layers, read)
+	return (canvas + 0.5).clip(0, 255).astype(numpy.uint8).tostring()
+
+def compare_pixels(a, b, tolerance):
+	"""
+	Compares two RGBA buffers, ignoring the color of pixels that are fully
+	transparent in both.
+
+	@returns (the largest difference in any channel, the number of pixels
+	that differ by more than tolerance)
+	"""
+	numpy = _import_numpy()
+	if numpy is None:
+		a = bytearray(a)
+		b = bytearray(b)
+		max_diff = 0
+		num_over = 0
+		for i in xrange(0, len(a), 4):
+			channels = xrange(i, i+4) if a[i+3] or b[i+3] else xrange(i+3, i+4)
+			diff = max(abs(a[c] - b[c]) for c in channels)
+			max_diff = max(max_diff, diff)
+			if diff > tolerance:
+				num_over += 1
+		return max_diff, num_over
+
+	a = numpy.frombuffer(a, numpy.uint8).reshape(-1, 4).astype(numpy.int16)
+	b = numpy.frombuffer(b, numpy.uint8).reshape(-1, 4).astype(numpy.int16)
+	diff = numpy.abs(a - b)
+	transparent = (a[:, 3] == 0) & (b[:, 3] == 0)
+	diff[transparent, :3] = 0
+	diff = diff.max(axis=1)
+	return int(diff.max()) if len(diff) > 0 else 0, int((diff > tolerance).sum())
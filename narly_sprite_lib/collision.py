@@ -0,0 +1,129 @@
+"""
+Collision shapes from the alpha of a frame, so that games can load them
+instead of scanning the sprite's pixels:
+
+	bbox	[x, y, width, height] of the solid pixels
+	hull	convex hull of the solid pixels, as a list of [x, y] points
+		(pixel corners, clockwise in image coordinates)
+	mask	1 bit per pixel (1 = solid), base64 encoded. Each row starts
+		on a new byte, the most significant bit is the leftmost pixel.
+
+A pixel is solid if its alpha is at least COLLISION_ALPHA_THRESHOLD.
+"""
+
+import base64
+
+COLLISION_ALPHA_THRESHOLD = 128
+
+# hulls with more points than this are simplified
+COLLISION_MAX_HULL_POINTS = 16
+
+# alpha byte -> "1" if solid, "0" if not
+_SOLID_CHARS = "".join("1" if a >= COLLISION_ALPHA_THRESHOLD else "0" for a in xrange(256))
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def _scan_rows_python(data, width, height, bpp):
+	"""
+	@returns the packed mask and the (first, last) solid column of each
+	row (None for empty rows)
+	"""
+	data = str(data)
+	row_len = width * bpp
+	padding = "0" * (-width % 8)
+	mask = []
+	spans = []
+	for y in xrange(height):
+		bits = data[y*row_len+bpp-1:(y+1)*row_len:bpp].translate(_SOLID_CHARS)
+		first = bits.find("1")
+		spans.append(None if first == -1 else (first, bits.rfind("1")))
+		bits += padding
+		mask.append("".join(chr(int(bits[i:i+8], 2)) for i in xrange(0, len(bits), 8)))
+	return "".join(mask), spans
+
+def _scan_rows_numpy(numpy, data, width, height, bpp):
+	alpha = numpy.frombuffer(str(data), numpy.uint8).reshape(height, width, bpp)[..., bpp-1]
+	solid = alpha >= COLLISION_ALPHA_THRESHOLD
+	mask = numpy.packbits(solid, axis=1).tostring()
+
+	any_solid = solid.any(axis=1)
+	first = solid.argmax(axis=1)
+	last = width - 1 - solid[:, ::-1].argmax(axis=1)
+	spans = [(int(f), int(l)) if s else None for s, f, l in zip(any_solid, first, last)]
+	return mask, spans
+
+def _cross(o, a, b):
+	return (a[0] - o[0])*(b[1] - o[1]) - (a[1] - o[1])*(b[0] - o[0])
+
+def convex_hull(points):
+	"""
+	Andrew's monotone chain.
+
+	@returns the hull of the points, without collinear points
+	"""
+	points = sorted(set(points))
+	if len(points) < 3:
+		return points
+
+	lower = []
+	for p in points:
+		while len(lower) >= 2 and _cross(lower[-2], lower[-1], p) <= 0:
+			lower.pop()
+		lower.append(p)
+	upper = []
+	for p in reversed(points):
+		while len(upper) >= 2 and _cross(upper[-2], upper[-1], p) <= 0:
+			upper.pop()
+		upper.append(p)
+	return lower[:-1] + upper[:-1]
+
+def simplify_polygon(points, max_points):
+	"""
+	Repeatedly drops the point that adds the least area to the polygon
+	until it has at most max_points points.
+	"""
+	points = list(points)
+	while len(points) > max(max_points, 3):
+		areas = [
+			abs(_cross(points[i-1], points[i], points[(i+1) % len(points)]))
+			for i in xrange(len(points))
+		]
+		points.pop(areas.index(min(areas)))
+	return points
+
+def make_collision_shapes(data, width, height, bpp=4, max_hull_points=COLLISION_MAX_HULL_POINTS):
+	"""
+	@returns the collision shapes of the frame (see the module docs), with
+	a bbox of None and an empty hull if it has no solid pixels
+	"""
+	numpy = _import_numpy()
+	if numpy is None:
+		mask, spans = _scan_rows_python(data, width, height, bpp)
+	else:
+		mask, spans = _scan_rows_numpy(numpy, data, width, height, bpp)
+
+	# only the ends of each row can be on the hull
+	corners = []
+	for y, span in enumerate(spans):
+		if span is not None:
+			first, last = span
+			corners.extend([(first, y), (last+1, y), (first, y+1), (last+1, y+1)])
+
+	bbox = None
+	hull = []
+	if len(corners) > 0:
+		xs = [x for x, _ in corners]
+		ys = [y for _, y in corners]
+		bbox = [min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)]
+		hull = [list(p) for p in simplify_polygon(convex_hull(corners), max_hull_points)]
+
+	return {
+		"bbox": bbox,
+		"hull": hull,
+		"mask": base64.b64encode(mask),
+	}
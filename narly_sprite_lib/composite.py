@@ -0,0 +1,569 @@
+"""
+Compositing frames (with gimp or numpy, through the on-disk frame cache)
+and turning raw pixels back into layers.
+"""
+
+from gimpfu import *
+import os
+import hashlib
+
+from narly_sprite_lib.core import *
+from narly_sprite_lib.framecache import open_frame_cache, prune_cache_dir, CACHE_SUFFIX, CACHE_TOTAL_MAX_BYTES
+from narly_sprite_lib.sheet import get_rgba_alpha_bounds, to_rgba
+from narly_sprite_lib.blend import SUPPORTED_MODES, has_numpy, composite_layers, compare_pixels
+
+def _hash_pixels(h, drawable):
+	# a strip of tiles at a time, so memory doesn't grow with the layer size
+	rgn = drawable.get_pixel_rgn(0, 0, drawable.width, drawable.height, False, False)
+	strip_height = gimp.tile_height()
+	for y in xrange(0, drawable.height, strip_height):
+		h.update(rgn[0:drawable.width, y:min(y+strip_height, drawable.height)])
+
+def _hash_mask(h, item):
+	if item.mask is None:
+		h.update("no mask")
+		return
+	h.update(repr((bool(item.apply_mask), bool(item.show_mask))))
+	_hash_pixels(h, item.mask)
+
+def _hash_item(h, item):
+	h.update(repr((
+		item.name,
+		item.offsets,
+		item.width,
+		item.height,
+		item.bpp,
+		bool(item.visible),
+		item.opacity,
+		item.mode,
+	)))
+	_hash_mask(h, item)
+
+	if pdb.gimp_item_is_group(item):
+		for child in item.children:
+			_hash_item(h, child)
+		return
+
+	_hash_pixels(h, item)
+
+def get_frame_fingerprint_base(img):
+	"""
+	Hashes everything besides the frames that shows up when a frame is
+	composited (the image size and any top level layers that aren't
+	frames). Pass the result to get_frame_fingerprint.
+	"""
+	h = hashlib.sha1()
+	h.update(repr((img.width, img.height, img.base_type)))
+	for layer in img.layers:
+		if get_frame_num(layer) is None and layer.visible:
+			_hash_item(h, layer)
+	return h
+
+def get_frame_fingerprint(base, frame):
+	"""
+	@returns a digest that changes whenever anything that affects how the
+	frame looks when it's composited changes
+	"""
+	h = base.copy()
+	# frames are always composited visible at full opacity (see
+	# show_frame), so their own visibility and opacity don't matter
+	h.update(repr(frame.mode))
+	_hash_mask(h, frame)
+	for child in frame.children:
+		_hash_item(h, child)
+	return h.digest()
+
+# where this process keeps its frame caches, see set_frame_cache_dir
+_frame_cache_dir = None
+
+def get_frame_cache_root():
+	return os.path.join(gimp.directory, "narly_sprite_cache")
+
+def set_frame_cache_dir(cache_dir):
+	"""
+	Makes this process keep its frame caches in cache_dir (a sub directory
+	of get_frame_cache_root) instead of the shared one. A FrameCache only
+	reads its index when it's opened, so two processes must never have
+	the same cache file open.
+	"""
+	global _frame_cache_dir
+	_frame_cache_dir = cache_dir
+
+def _get_cache_name(img):
+	key = img.filename or ("unsaved image %d" % img.ID)
+	return hashlib.sha1(key).hexdigest() + CACHE_SUFFIX
+
+def open_image_frame_cache(img):
+	"""
+	Opens the on-disk cache of composited frames for the image (stored in
+	the user's gimp directory), if it's enabled in the image's config. The
+	least recently used caches of other images are deleted to leave room
+	for this one's frame_cache_max_mb in CACHE_TOTAL_MAX_BYTES.
+	"""
+	config = get_config(img)
+	if not config["frame_cache_enabled"] or img.base_type != RGB:
+		return None
+
+	cache_root = get_frame_cache_root()
+	path = os.path.join(_frame_cache_dir or cache_root, _get_cache_name(img))
+
+	# every process's caches share the total
+	max_bytes = min(int(config["frame_cache_max_mb"] * 1024 * 1024), CACHE_TOTAL_MAX_BYTES)
+	prune_cache_dir(cache_root, path, CACHE_TOTAL_MAX_BYTES - max_bytes)
+	return open_frame_cache(path, img.width, img.height, 4, max_bytes)
+
+def new_transparent_layer(dest_img, name, width, height, parent=None):
+	"""
+	Adds a new, fully transparent layer to the bottom of dest_img (or of
+	the parent group).
+	"""
+	new_layer = pdb.gimp_layer_new(
+		dest_img,
+		width,
+		height,
+		dest_img.base_type*2+1,
+		name,
+		100,	# opacity
+		NORMAL_MODE
+	)
+	if parent is None:
+		pdb.gimp_image_insert_layer(dest_img, new_layer, None, len(dest_img.layers))
+	else:
+		pdb.gimp_image_insert_layer(dest_img, new_layer, parent, len(parent.children))
+	pdb.gimp_drawable_fill(new_layer, TRANSPARENT_FILL)
+	return new_layer
+
+def new_layer_from_pixels(dest_img, name, width, height, data, x=0, y=0, parent=None):
+	"""
+	Adds a new layer to the bottom of dest_img (or of the parent group)
+	filled with the raw pixels (which must have the same bpp as the layer).
+	"""
+	new_layer = new_transparent_layer(dest_img, name, width, height, parent)
+	rgn = new_layer.get_pixel_rgn(0, 0, width, height, True, False)
+	rgn[0:width, 0:height] = str(data)
+	new_layer.flush()
+	new_layer.update(0, 0, width, height)
+	pdb.gimp_layer_set_offsets(new_layer, x, y)
+	return new_layer
+
+def new_indexed_image(width, height, indices, palette):
+	"""
+	@returns a new indexed image with a single layer of the palette
+	indices, with each pixel's alpha taken from its palette color
+	"""
+	new_img = gimp.Image(width, height, INDEXED)
+	colormap = [c for color in palette for c in color[:3]]
+	pdb.gimp_image_set_colormap(new_img, len(colormap), colormap)
+
+	alphas = "".join(chr(color[3]) for color in palette).ljust(256, "\x00")
+	data = bytearray(width * height * 2)
+	data[0::2] = indices
+	data[1::2] = indices.translate(alphas)
+	new_layer_from_pixels(new_img, "Sheet", width, height, data)
+	return new_img
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# frames with more pixels than this are exported one tile at a time,
+# straight from gimp into the sheet (see FrameCompositor.copy_tiled)
+TILED_FRAME_MIN_PIXELS = 1024 * 1024
+
+def iter_tiles(width, height):
+	"""
+	Generates the (x, y, width, height) of each of gimp's tiles of a
+	drawable, row by row. Reading a pixel region one tile at a time keeps
+	the memory used down to a single tile.
+	"""
+	tile_width = gimp.tile_width()
+	tile_height = gimp.tile_height()
+	for y in xrange(0, height, tile_height):
+		for x in xrange(0, width, tile_width):
+			yield (x, y, min(tile_width, width - x), min(tile_height, height - y))
+
+def _iter_visible_leaves(item):
+	if not item.visible or item.opacity == 0:
+		return
+	if pdb.gimp_item_is_group(item):
+		for child in item.children:
+			for leaf in _iter_visible_leaves(child):
+				yield leaf
+	else:
+		yield item
+
+def get_covered_tiles(items, x, y, width, height):
+	"""
+	Finds the tiles of a width x height drawable at (x, y) in the image
+	that any of the visible layers in items (or in their groups) overlap.
+	The other tiles are known to be fully transparent without reading any
+	of their pixels.
+
+	@returns a set of (x, y) tile positions, as generated by iter_tiles
+	"""
+	tile_width = gimp.tile_width()
+	tile_height = gimp.tile_height()
+	res = set()
+	for item in items:
+		for leaf in _iter_visible_leaves(item):
+			leaf_x, leaf_y = leaf.offsets
+			x0 = max(leaf_x - x, 0)
+			y0 = max(leaf_y - y, 0)
+			x1 = min(leaf_x - x + leaf.width, width)
+			y1 = min(leaf_y - y + leaf.height, height)
+			if x1 <= x0 or y1 <= y0:
+				continue
+			for tile_y in xrange(y0 - y0 % tile_height, y1, tile_height):
+				for tile_x in xrange(x0 - x0 % tile_width, x1, tile_width):
+					res.add((tile_x, tile_y))
+	return res
+
+def get_frame_covered_tiles(img, frame):
+	"""
+	@returns the covered tiles (see get_covered_tiles) of the frame when
+	it's composited with the rest of the image
+	"""
+	items = [frame] + [l for l in img.layers if get_frame_num(l) is None]
+	return get_covered_tiles(items, 0, 0, img.width, img.height)
+
+def get_tiled_alpha_bounds(drawable, covered=None):
+	"""
+	Finds the non-transparent pixels of the drawable one tile at a time,
+	skipping the tiles that can't change the result: tiles that aren't in
+	`covered` (if given) and tiles inside of the bounds found so far.
+
+	@returns (min_x, min_y, max_x, max_y) relative to the drawable, or
+	None if it's completely transparent
+	"""
+	if not drawable.has_alpha:
+		return (0, 0, drawable.width-1, drawable.height-1)
+
+	rgn = drawable.get_pixel_rgn(0, 0, drawable.width, drawable.height, False, False)
+	bounds = None
+	for x, y, width, height in iter_tiles(drawable.width, drawable.height):
+		if covered is not None and (x, y) not in covered:
+			continue
+		if bounds is not None and x >= bounds[0] and y >= bounds[1] \
+				and x+width-1 <= bounds[2] and y+height-1 <= bounds[3]:
+			continue
+
+		tile_bounds = get_rgba_alpha_bounds(rgn[x:x+width, y:y+height], width, height, drawable.bpp)
+		if tile_bounds is None:
+			continue
+		tile_x, tile_y, tile_width, tile_height = tile_bounds
+		tile_bounds = [x+tile_x, y+tile_y, x+tile_x+tile_width-1, y+tile_y+tile_height-1]
+		if bounds is None:
+			bounds = tile_bounds
+		else:
+			bounds = [
+				min(bounds[0], tile_bounds[0]),
+				min(bounds[1], tile_bounds[1]),
+				max(bounds[2], tile_bounds[2]),
+				max(bounds[3], tile_bounds[3]),
+			]
+
+	if bounds is None:
+		return None
+	return tuple(bounds)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+class FrameCompositor(object):
+	"""
+	Gets the composited pixels of frames (as they'd be seen when the
+	frame is the only visible frame), going through the frame cache so
+	that frames that haven't changed don't get composited by gimp again.
+
+	Compositing changes which frames are visible, the caller is
+	responsible for restoring that.
+	"""
+	def __init__(self, img):
+		self.img = img
+		self.bpp = 4 if img.base_type == RGB else 2
+		self.cache = open_image_frame_cache(img)
+		self._fingerprint_base = None
+		if self.cache is not None:
+			self._fingerprint_base = get_frame_fingerprint_base(img)
+		self._scratch_img = None
+		# the frames don't change while compositing, and the batch only
+		# writes the visibility of the frames that change between frames
+		self._frames = None
+		self._batch = None
+
+	def _composite_layer(self, frame_num):
+		"""
+		Composites the frame with gimp into a layer of the scratch image,
+		which the caller removes again.
+		"""
+		if self._scratch_img is None:
+			self._scratch_img = gimp.Image(self.img.width, self.img.height, self.img.base_type)
+			pdb.gimp_image_undo_disable(self._scratch_img)
+
+		if self._frames is None:
+			self._frames = get_numbered_frames(self.img)
+			self._batch = PropertyBatch(self.img, BATCH_UNDO_NONE)
+		show_frame(self._batch, self._frames, frame_num, set_active=False)
+		self._batch.apply()
+		flat = pdb.gimp_layer_new_from_visible(self.img, self._scratch_img, make_frame_name(frame_num))
+		pdb.gimp_image_insert_layer(self._scratch_img, flat, None, 0)
+		return flat
+
+	def composite(self, frame_num):
+		"""
+		Composites the frame with gimp, bypassing the cache.
+		"""
+		flat = self._composite_layer(frame_num)
+		rgn = flat.get_pixel_rgn(0, 0, flat.width, flat.height, False, False)
+		data = rgn[0:flat.width, 0:flat.height]
+		pdb.gimp_image_remove_layer(self._scratch_img, flat)
+		return data
+
+	def is_tiled(self):
+		"""
+		Whether the frames are big enough to be exported with copy_tiled
+		"""
+		return self.img.width * self.img.height > TILED_FRAME_MIN_PIXELS
+
+	def copy_tiled(self, frame, dest_layer, extrude=0):
+		"""
+		Composites the frame with gimp and copies it into dest_layer (which
+		must be fully transparent) at (extrude, extrude) one tile at a time,
+		repeating its edge pixels `extrude` pixels out on every side like
+		blit_frame. Tiles that no layer of the frame covers aren't read, and
+		fully transparent tiles aren't written. This bypasses the cache,
+		which holds whole frames.
+
+		@returns the alpha bounds of the frame (x, y, width, height), or
+		None if it's completely transparent
+		"""
+		flat = self._composite_layer(get_frame_num(frame))
+		width = flat.width
+		height = flat.height
+		bpp = flat.bpp
+		src = flat.get_pixel_rgn(0, 0, width, height, False, False)
+		dest = dest_layer.get_pixel_rgn(0, 0, dest_layer.width, dest_layer.height, True, False)
+
+		covered = get_frame_covered_tiles(self.img, frame)
+		bounds = None
+		for x, y, tile_width, tile_height in iter_tiles(width, height):
+			if (x, y) not in covered:
+				continue
+			data = src[x:x+tile_width, y:y+tile_height]
+			tile_bounds = get_rgba_alpha_bounds(data, tile_width, tile_height, bpp)
+			if tile_bounds is None:
+				continue
+			dest[extrude+x:extrude+x+tile_width, extrude+y:extrude+y+tile_height] = data
+
+			tile_x, tile_y, bounds_width, bounds_height = tile_bounds
+			tile_bounds = (x+tile_x, y+tile_y, x+tile_x+bounds_width, y+tile_y+bounds_height)
+			if bounds is None:
+				bounds = tile_bounds
+			else:
+				bounds = (
+					min(bounds[0], tile_bounds[0]),
+					min(bounds[1], tile_bounds[1]),
+					max(bounds[2], tile_bounds[2]),
+					max(bounds[3], tile_bounds[3]),
+				)
+
+		if extrude > 0:
+			# the left and right edges, a tile's height at a time
+			for y in xrange(0, height, gimp.tile_height()):
+				strip_height = min(gimp.tile_height(), height - y)
+				for src_x, dest_x in ((0, 0), (width-1, extrude+width)):
+					column = src[src_x:src_x+1, y:y+strip_height]
+					dest[dest_x:dest_x+extrude, extrude+y:extrude+y+strip_height] = "".join(
+						column[i:i+bpp] * extrude for i in xrange(0, len(column), bpp)
+					)
+			# the top and bottom rows, including the corners
+			for src_y, dest_y in ((0, 0), (height-1, extrude+height)):
+				row = src[0:width, src_y:src_y+1]
+				row = row[:bpp]*extrude + row + row[-bpp:]*extrude
+				dest[0:width+2*extrude, dest_y:dest_y+extrude] = row * extrude
+
+		dest_layer.flush()
+		dest_layer.update(0, 0, dest_layer.width, dest_layer.height)
+		pdb.gimp_image_remove_layer(self._scratch_img, flat)
+
+		if bounds is None:
+			return None
+		return (bounds[0], bounds[1], bounds[2] - bounds[0], bounds[3] - bounds[1])
+
+	def get_pixels(self, frame):
+		if self.cache is None:
+			return self.composite(get_frame_num(frame))
+
+		fingerprint = get_frame_fingerprint(self._fingerprint_base, frame)
+		data = self.cache.get(fingerprint)
+		if data is None:
+			data = self.composite(get_frame_num(frame))
+			self.cache.put(fingerprint, data)
+		return data
+
+	def close(self):
+		if self.cache is not None:
+			self.cache.close()
+			self.cache = None
+		if self._scratch_img is not None:
+			pdb.gimp_image_delete(self._scratch_img)
+			self._scratch_img = None
+
+def _get_blend_layer(item, visible=None, opacity=None):
+	"""
+	@returns the description of the layer (or group) for
+	blend.composite_layers, or None if it can't be composited that way
+	"""
+	x, y = item.offsets
+	res = {
+		"item": item,
+		"x": x,
+		"y": y,
+		"width": item.width,
+		"height": item.height,
+		"visible": bool(item.visible) if visible is None else visible,
+		"opacity": item.opacity if opacity is None else opacity,
+		"mode": item.mode,
+	}
+	if not res["visible"]:
+		return res
+	if item.mode not in SUPPORTED_MODES:
+		return None
+
+	if pdb.gimp_item_is_group(item):
+		if item.mask is not None and item.apply_mask:
+			return None
+		children = [_get_blend_layer(child) for child in item.children]
+		if None in children:
+			return None
+		res["children"] = children
+	return res
+
+def _read_blend_layer(layer):
+	item = layer["item"]
+	rgn = item.get_pixel_rgn(0, 0, item.width, item.height, False, False)
+	data = to_rgba(rgn[0:item.width, 0:item.height], item.bpp)
+	mask = None
+	if item.mask is not None and item.apply_mask:
+		rgn = item.mask.get_pixel_rgn(0, 0, item.width, item.height, False, False)
+		mask = rgn[0:item.width, 0:item.height]
+	return data, mask
+
+class LayerCompositor(FrameCompositor):
+	"""
+	A FrameCompositor that composites frames with numpy (see blend.py)
+	straight from the pixels of their layers, so no frame has to be shown
+	for gimp to composite it. Frames with layer modes that blend.py
+	doesn't know are still composited by gimp.
+	"""
+	def get_layers(self, frame_num):
+		"""
+		@returns the layers of the image as they'd be with only the frame
+		visible, for blend.composite_layers, or None if gimp has to
+		composite the frame
+		"""
+		layers = []
+		for item in self.img.layers:
+			curr_frame_num = get_frame_num(item)
+			if curr_frame_num is None:
+				layers.append(_get_blend_layer(item))
+			elif curr_frame_num == frame_num:
+				# like goto_frame
+				layers.append(_get_blend_layer(item, True, 100.0))
+		if None in layers:
+			return None
+		return layers
+
+	def composite(self, frame_num):
+		layers = self.get_layers(frame_num)
+		if layers is None:
+			return FrameCompositor.composite(self, frame_num)
+		return composite_layers(self.img.width, self.img.height, layers, _read_blend_layer)
+
+def make_frame_compositor(img):
+	"""
+	@returns a LayerCompositor if numpy is there and the image can use
+	one, otherwise a FrameCompositor
+	"""
+	if img.base_type == RGB and get_config(img)["numpy_compositor"] and has_numpy():
+		return LayerCompositor(img)
+	return FrameCompositor(img)
+
+def narly_sprite_check_compositor(img, layer, tolerance):
+	"""
+	Composites every frame both with gimp and with numpy, and reports the
+	frames where the two differ by more than tolerance (in any channel).
+	"""
+	if img.base_type != RGB:
+		gimp.message("Only RGB sprites can be composited with numpy")
+		return
+	if not has_numpy():
+		gimp.message("numpy isn't installed for gimp's python")
+		return
+
+	frames = get_frames(img)
+	gimp_compositor = FrameCompositor(img)
+	numpy_compositor = LayerCompositor(img)
+	lines = []
+	counts = {"checked": 0, "differ": 0}
+
+	def check_frames():
+		curr_count = 0
+		for frame in frames:
+			frame_num = get_frame_num(frame)
+			layers = numpy_compositor.get_layers(frame_num)
+			if layers is None:
+				lines.append("frame %d: composited by gimp (unsupported layer mode or group mask)" % frame_num)
+			else:
+				expected = gimp_compositor.composite(frame_num)
+				actual = composite_layers(img.width, img.height, layers, _read_blend_layer)
+				max_diff, num_over = compare_pixels(expected, actual, tolerance)
+				if num_over > 0:
+					lines.append("frame %d: %d pixels off by more than %d (at most %d)" % (
+						frame_num, num_over, tolerance, max_diff))
+					counts["differ"] += 1
+				counts["checked"] += 1
+			curr_count += 1
+			yield float(curr_count) / len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	try:
+		completed = run_chunked(img, check_frames(), "Checking the numpy compositor")
+	finally:
+		gimp_compositor.close()
+		numpy_compositor.close()
+		pdb.gimp_image_undo_thaw(img)
+
+	if not completed:
+		return
+	lines.insert(0, "%d of %d frames checked, %d differ" % (counts["checked"], len(frames), counts["differ"]))
+	gimp.message("\n".join(lines))
+
+def get_alpha_bounds(img, drawable):
+	"""
+	Finds the bounding box of all of the non-transparent pixels in the
+	drawable. This replaces the image's selection.
+
+	@returns (x, y, width, height) relative to the drawable's offsets, or
+	None if the drawable is completely transparent
+	"""
+	pdb.gimp_image_select_item(img, CHANNEL_OP_REPLACE, drawable)
+	non_empty, x1, y1, x2, y2 = pdb.gimp_selection_bounds(img)
+	pdb.gimp_selection_none(img)
+	if not non_empty:
+		return None
+
+	off_x, off_y = drawable.offsets
+	return (x1 - off_x, y1 - off_y, x2 - x1, y2 - y1)
+
+def get_export_base_path(img, export_path):
+	"""
+	@returns the path (without extension) that the sheet and its metadata
+	files should be written to, or None if there's nowhere to put them
+	"""
+	if export_path:
+		return os.path.splitext(export_path)[0]
+	if img.filename:
+		return os.path.splitext(img.filename)[0]
+	return None
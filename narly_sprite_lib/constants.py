@@ -0,0 +1,32 @@
+"""
+Values of the plugin's procedure parameters, shared by the registration
+module and the implementation modules.
+"""
+
+# how the bulk tools make their changes undoable
+UNDO_FULL = 0			# one undo group holding every change (uses lots of memory)
+# the low undo modes clear the undo history, a copy of the image made
+# before the change (the checkpoint) can be restored instead
+UNDO_CHECKPOINT_MEMORY = 1	# the checkpoint is a duplicate of the image
+UNDO_CHECKPOINT_XCF = 2		# the checkpoint is saved to disk as an xcf
+
+# where duplicated frames go
+INSERT = 0
+APPEND = 1
+
+# sprite sheet layouts
+HORIZONTAL = 0
+GRID = 1
+
+# where imported frames go on the sprite canvas
+ALIGN_KEEP = 0		# same position as in the source image
+ALIGN_CENTER = 1
+ALIGN_BOTTOM = 2	# centered horizontally, resting on the bottom edge
+
+# scaling filters
+FILTER_NEAREST = 0
+FILTER_BOX = 1
+
+# texture array containers
+TEXTURE_KTX2 = 0
+TEXTURE_RAW = 1
@@ -0,0 +1,862 @@
+"""
+Frame bookkeeping used by all of the plugin's procedures: frame folders
+and their numbers, the config parasite, batched layer property writes,
+long running operations, layer tracks and bulk edit checkpoints.
+"""
+
+from gimpfu import *
+import re
+import os
+import json
+import time
+import hashlib
+
+from narly_sprite_lib.constants import *
+
+def make_frame_name(frame_num):
+	return "Frame %d" % (frame_num) 
+
+def _shift_frames_helper(img, start_frame_num, delta):
+	# the batch renames through temporary names when the new names clash
+	batch = PropertyBatch(img, BATCH_UNDO_NONE)
+	for frame, curr_frame_num in get_numbered_frames(img):
+		if curr_frame_num >= start_frame_num:
+			batch.set(frame, "name", make_frame_name(curr_frame_num+delta))
+	batch.apply()
+
+def copy_layer_no_data(img, layer):
+	res = pdb.gimp_layer_new(
+		img,
+		layer.width,
+		layer.height,
+		layer.type,
+		layer.name,
+		100,		# opacity
+		NORMAL_MODE
+	)
+	# keep the new layer in the same track
+	track = layer.parasite_find(TRACK_PARASITE)
+	if track is not None:
+		res.parasite_attach(track)
+	return res
+
+narly_sprite_default_config = {
+	"new_frame_copy_image_data": False,
+	# crop the layers new frames copy pixels into to those pixels (see
+	# frames.compact_layer), empty and blank layers stay image sized
+	"compact_new_frames": False,
+
+	"always_show_prev_frame": False,
+	"show_prev_frame_on_new": True,
+	"prev_frame_alpha": 30.0,
+
+	"frame_cache_enabled": True,
+	"frame_cache_max_mb": 512,
+
+	# composite frames with numpy instead of gimp (see narly_sprite_lib/blend.py)
+	"numpy_compositor": True,
+	"compositor_workers": 0,	# background export processes, 0 = one per CPU
+
+	"timeline_thumb_size": 64,
+	"timeline_cache_max_mb": 16,
+
+	# named frame ranges, [{"name": ..., "start": ..., "end": ...}]
+	"animations": [],
+
+	# PNGs written by the plugin itself (see narly_sprite_lib/png.py)
+	"png_compression": 6,
+	"png_filter": "none",
+	"png_threads": 0,	# 0 = one per CPU
+}
+def get_config_parasite(img):
+	p = img.parasite_find("narly_sprite_config")
+	if p is None:
+		p = gimp.Parasite(
+			"narly_sprite_config",
+			1,	# 1 = Persistent
+			json.dumps(narly_sprite_default_config)
+		)
+		img.parasite_attach(p)
+	return p
+
+def get_config(img):
+	p = get_config_parasite(img)
+	# images saved with an older version of the plugin won't have all of
+	# the settings
+	config = dict(narly_sprite_default_config)
+	config.update(json.loads(p.data))
+	return config
+
+# TODO: this doesn't work, fix it!
+def save_config(img, config):
+	get_config_parasite(img)
+	img.parasite_detach("narly_sprite_config")
+	new_parasite = gimp.Parasite(
+		"narly_sprite_config",
+		1,	# 1 = Persistent
+		json.dumps(config)
+	)
+	img.parasite_attach(new_parasite)
+
+def shift_frames_up(img, start_frame_num):
+	"""
+	Shift frames "up" - number-wise a frame would go from
+	being frame 4 to frame 3
+	"""
+	_shift_frames_helper(img, start_frame_num, -1)
+
+def shift_frames_down(img, start_frame_num):
+	"""
+	Shift frames "down" - number-wise a frame would go from
+	being frame 3 to frame 4
+	"""
+	_shift_frames_helper(img, start_frame_num, 1)
+
+def get_frame_by_number(img, num):
+	for frame in get_frames(img):
+		if get_frame_num(frame) == num:
+			return frame
+	return None
+
+def get_frames(img):
+	res = []
+	for layer in img.layers:
+		if get_frame_num(layer) is not None:
+			res.append(layer)
+	return res
+
+def get_numbered_frames(img):
+	"""
+	@returns a (frame folder, frame num) tuple for each frame
+	"""
+	res = []
+	for layer in img.layers:
+		frame_num = get_frame_num(layer)
+		if frame_num is not None:
+			res.append((layer, frame_num))
+	return res
+
+def make_frame_visible(img, frame_num, opacity=100.0, batch=None):
+	"""
+	Shows the frame (on top of the current one) with the given opacity.
+	With a batch the writes are only recorded in it, for the caller to
+	apply.
+	"""
+	own_batch = batch is None
+	if own_batch:
+		batch = PropertyBatch(img, BATCH_UNDO_FREEZE)
+	for frame, curr_frame_num in get_numbered_frames(img):
+		if curr_frame_num == frame_num:
+			batch.set(frame, "opacity", opacity)
+			batch.set(frame, "visible", True)
+	if own_batch:
+		batch.apply()
+
+def show_frame(batch, frames, frame_num, layer_pos=0, set_active=True):
+	"""
+	Records the writes that make the frame the only visible frame in the
+	batch (frames as returned by get_numbered_frames).
+
+	@returns whether the frame was found
+	"""
+	found_frame = False
+	for frame, curr_frame_num in frames:
+		batch.set(frame, "opacity", 100.0)
+		if curr_frame_num == frame_num:
+			batch.set(frame, "visible", True)
+			found_frame = True
+			if set_active:
+				children = frame.children
+				if len(children) > 0:
+					batch.set_active(children[layer_pos])
+				else:
+					batch.set_active(frame)
+		else:
+			batch.set(frame, "visible", False)
+	return found_frame
+
+def goto_frame(img, frame_num, layer_pos=0, set_active=True, batch=None):
+	"""
+	Sets the desired frame folder to be visible and all
+	other frame folders to not be visible. With a batch the writes are
+	only recorded in it, for the caller to apply.
+
+	@returns whether or not it even found the frame you were
+	looking for
+	"""
+	frames = get_numbered_frames(img)
+	# means there's no frames left in the img
+	if len(frames) == 0:
+		return
+
+	frame_num = frame_num % (max(num for _, num in frames) + 1)
+
+	own_batch = batch is None
+	if own_batch:
+		batch = PropertyBatch(img, BATCH_UNDO_NONE)
+	found_frame = show_frame(batch, frames, frame_num, layer_pos, set_active)
+	if own_batch:
+		batch.apply()
+	return found_frame
+
+def get_last_frame_position(img):
+	last_pos = -1
+	curr_pos = 0
+	for layer in img.layers:
+		curr_frame_num = get_frame_num(layer)
+		if curr_frame_num is not None:
+			last_pos = pdb.gimp_image_get_layer_position(img, layer)
+
+	return last_pos
+
+def get_last_frame_num(img):
+	max_frame_num = -1
+	for layer in img.layers:
+		curr_frame_num = get_frame_num(layer)
+		if curr_frame_num is not None:
+			if curr_frame_num > max_frame_num:
+				max_frame_num = curr_frame_num
+
+	return max_frame_num
+
+def is_frame_root(layer):
+	return pdb.gimp_item_is_group(layer) and layer.parent is None
+
+def get_frame_root(layer):
+	"""
+	Assumes the layer is either a valid layer inside of a frame
+	folder, or that it's a frame folder itself
+	"""
+	if pdb.gimp_item_is_group(layer):
+		return layer
+	
+	return layer.parent
+
+def get_frame_num(layer):
+	if layer is None:
+		return None
+
+	match_string = None
+
+	# it's a folder, so match off the folder's name
+	if pdb.gimp_item_is_group(layer):
+		# all frame folders must be at top level
+		# (arbitrary, I know, but oh well)
+		if layer.parent is not None:
+			return None
+
+		match_string = layer.name
+
+	# it's a normal layer (not a folder), so check
+	# to see if it's in a frame folder
+	else:
+		if layer.parent is None:
+			return None
+		if not pdb.gimp_item_is_group(layer.parent):
+			return None
+
+		match_string = layer.parent.name
+	
+	match = re.match(r"Frame (\d+)", match_string)
+
+	if match is None:
+		return None
+
+	frame = int(match.groups()[0])
+	return frame
+
+def get_layers_in_frame(img, frame_num):
+	res = []
+
+	for layer in img.layers:
+		layer_frame_num = get_frame_num(layer.name)
+		if layer_frame_num == frame_num:
+			res.append(layer)
+	
+	return res
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# how a PropertyBatch makes its writes undoable
+BATCH_UNDO_NONE = 0	# up to the caller (eg inside of its own undo group)
+BATCH_UNDO_FREEZE = 1	# not undoable, like frame navigation
+BATCH_UNDO_GROUP = 2	# a single undo step
+
+class PropertyBatch(object):
+	"""
+	Records writes of the visible, opacity and name properties of layers
+	and of the image's active layer, and makes them all at once in apply().
+	Every write is a round trip to the gimp core (and visibility changes
+	also redraw the image), so only the last value written to each
+	property is kept, and values that a layer already has aren't written
+	at all.
+
+	The values read from gimp are remembered between apply() calls, so
+	a batch can be reused for a whole operation as long as nothing else
+	changes those properties in the meantime.
+	"""
+	PROPERTIES = ("name", "opacity", "visible")
+
+	def __init__(self, img, undo=BATCH_UNDO_FREEZE):
+		self.img = img
+		self.undo = undo
+		# item ID -> (item, {property: value})
+		self._pending = {}
+		self._active = None
+		# item ID -> {property: value in gimp}
+		self._known = {}
+		self.num_recorded = 0
+		self.num_written = 0
+
+	def set(self, item, prop, value):
+		if prop not in self.PROPERTIES:
+			raise ValueError("can't batch writes to %s" % prop)
+		self._pending.setdefault(item.ID, (item, {}))[1][prop] = value
+		self.num_recorded += 1
+
+	def set_active(self, layer):
+		self._active = layer
+		self.num_recorded += 1
+
+	def get(self, item, prop):
+		"""
+		@returns the property's value once the batch is applied
+		"""
+		pending = self._pending.get(item.ID)
+		if pending is not None and prop in pending[1]:
+			return pending[1][prop]
+		return self._get_known(item, prop)
+
+	def _get_known(self, item, prop):
+		known = self._known.setdefault(item.ID, {})
+		if prop not in known:
+			known[prop] = getattr(item, prop)
+		return known[prop]
+
+	def _write(self, item, prop, value):
+		setattr(item, prop, value)
+		self._known.setdefault(item.ID, {})[prop] = value
+		self.num_written += 1
+
+	def apply(self):
+		"""
+		Makes the recorded writes that change anything: names first,
+		then opacities, then hiding layers before showing others, and the
+		active layer last.
+		"""
+		writes = dict((prop, []) for prop in self.PROPERTIES)
+		for item, values in self._pending.itervalues():
+			for prop, value in values.iteritems():
+				if value != self._get_known(item, prop):
+					writes[prop].append((item, value))
+		active = self._active
+		if active is not None:
+			curr_active = self.img.active_layer
+			if curr_active is not None and curr_active.ID == active.ID:
+				active = None
+		self._pending = {}
+		self._active = None
+
+		if active is None and not any(writes.itervalues()):
+			return
+
+		if self.undo == BATCH_UNDO_FREEZE:
+			pdb.gimp_image_undo_freeze(self.img)
+		elif self.undo == BATCH_UNDO_GROUP:
+			pdb.gimp_undo_push_group_start(self.img)
+		try:
+			renames = writes["name"]
+			# gimp makes names unique, so when a layer is to get the name
+			# of another renamed layer, go through temporary names first
+			old_names = set(self._get_known(item, "name") for item, _ in renames)
+			if any(name in old_names for _, name in renames):
+				for item, name in renames:
+					self._write(item, "name", name + " RENAMETMP")
+			for item, name in renames:
+				self._write(item, "name", name)
+
+			for item, opacity in writes["opacity"]:
+				self._write(item, "opacity", opacity)
+			for item, visible in sorted(writes["visible"], key=lambda write: bool(write[1])):
+				self._write(item, "visible", visible)
+
+			if active is not None:
+				pdb.gimp_image_set_active_layer(self.img, active)
+				self.num_written += 1
+		finally:
+			if self.undo == BATCH_UNDO_FREEZE:
+				pdb.gimp_image_undo_thaw(self.img)
+			elif self.undo == BATCH_UNDO_GROUP:
+				pdb.gimp_undo_push_group_end(self.img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# long operations run in slices of about this many seconds, in between
+# which the cancel window gets a chance to handle its events
+CHUNK_TIME_SLICE = 0.05
+
+# minimum number of seconds between progress bar updates
+PROGRESS_UPDATE_INTERVAL = 0.1
+
+def save_frame_state(img):
+	"""
+	@returns the visibility of each frame and the active layer, so that
+	restore_frame_state can put them back
+	"""
+	active = img.active_layer
+	active_path = None
+	if active is not None and get_frame_num(active) is not None and not is_frame_root(active):
+		active_path = (active.parent.name, pdb.gimp_image_get_layer_position(img, active))
+
+	return {
+		"frames": [(frame.name, frame.visible, frame.opacity) for frame in get_frames(img)],
+		"active": active,
+		"active_path": active_path,
+	}
+
+def restore_frame_state(img, state):
+	batch = PropertyBatch(img, BATCH_UNDO_FREEZE)
+
+	# match frames by name - they may have been replaced by new layers
+	frames = dict((frame.name, frame) for frame in get_frames(img))
+	for name, visible, opacity in state["frames"]:
+		frame = frames.get(name)
+		if frame is not None:
+			batch.set(frame, "visible", visible)
+			batch.set(frame, "opacity", opacity)
+
+	active = state["active"]
+	if active is not None and not pdb.gimp_item_is_valid(active):
+		active = None
+		if state["active_path"] is not None:
+			frame_name, pos = state["active_path"]
+			frame = frames.get(frame_name)
+			if frame is not None and pos < len(frame.children):
+				active = frame.children[pos]
+	if active is not None:
+		batch.set_active(active)
+
+	batch.apply()
+	gimp.displays_flush()
+
+def can_show_windows():
+	"""
+	Whether the plugin was run from gimp's UI (and not in batch mode),
+	so it's ok to pop up windows
+	"""
+	try:
+		return pdb.gimp_progress_get_window_handle() != 0
+	except RuntimeError:
+		return False
+
+class CancelWindow(object):
+	"""
+	A small window with a cancel button that stays up while a long
+	operation runs. Call pump() every so often to let it handle clicks.
+	"""
+	def __init__(self, title):
+		import gtk
+		self._gtk = gtk
+		self.cancelled = False
+
+		self.window = gtk.Window()
+		self.window.set_title(title)
+		self.window.set_border_width(10)
+		self.window.connect("delete-event", self._cancel)
+
+		vbox = gtk.VBox(spacing=10, homogeneous=False)
+		vbox.add(gtk.Label(title))
+		cancel_btn = gtk.Button(stock=gtk.STOCK_CANCEL)
+		cancel_btn.connect("clicked", self._cancel)
+		vbox.add(cancel_btn)
+		self.window.add(vbox)
+		self.window.show_all()
+		self.pump()
+
+	def _cancel(self, *args):
+		self.cancelled = True
+		return True
+
+	def pump(self):
+		while self._gtk.events_pending():
+			self._gtk.main_iteration(False)
+
+	def destroy(self):
+		self.window.destroy()
+		self.pump()
+
+def run_chunked(img, steps, title, on_cancel=None):
+	"""
+	Runs the `steps` generator, which should do one small piece of work
+	(eg one frame) at a time and yield how far along it is (0.0 - 1.0).
+	The work is done in time slices of CHUNK_TIME_SLICE, and progress is
+	shown at most every PROGRESS_UPDATE_INTERVAL seconds.
+
+	When run from the UI the user can cancel in between slices, in which
+	case on_cancel is called and the frame visibility and active layer of
+	the image are put back the way they were before.
+
+	@returns True if all of the steps ran, False if it was cancelled
+	"""
+	state = save_frame_state(img)
+	cancel_window = None
+	if can_show_windows():
+		cancel_window = CancelWindow(title)
+
+	pdb.gimp_progress_set_text(title)
+	last_progress = 0.0
+	slice_start = time.time()
+	try:
+		for fraction in steps:
+			now = time.time()
+			if now - last_progress >= PROGRESS_UPDATE_INTERVAL:
+				pdb.gimp_progress_update(fraction)
+				last_progress = now
+
+			if cancel_window is not None and now - slice_start >= CHUNK_TIME_SLICE:
+				cancel_window.pump()
+				if cancel_window.cancelled:
+					steps.close()
+					if on_cancel is not None:
+						on_cancel()
+					restore_frame_state(img, state)
+					return False
+				slice_start = time.time()
+	finally:
+		if cancel_window is not None:
+			cancel_window.destroy()
+
+	pdb.gimp_progress_update(1.0)
+	return True
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# a layer with this parasite belongs to the track named by the parasite's
+# data. All other layers belong to the track with the same name as the layer.
+TRACK_PARASITE = "narly_sprite_track"
+TRACK_INDEX_PARASITE = "narly_sprite_track_index"
+
+def get_track_name(layer):
+	p = layer.parasite_find(TRACK_PARASITE)
+	if p is not None:
+		return p.data
+	return layer.name
+
+def set_track_name(layer, track_name):
+	if track_name == "":
+		layer.parasite_detach(TRACK_PARASITE)
+		return
+	layer.parasite_attach(gimp.Parasite(
+		TRACK_PARASITE,
+		1,	# 1 = Persistent
+		track_name
+	))
+
+class LayerTrackIndex(object):
+	"""
+	Maps each track to its layer in every frame. Frames and layers are
+	referenced by tattoo so that renumbering frames doesn't invalidate the
+	index, and the index is stored in a parasite on the image so it only
+	has to be built once.
+
+	Operations that add frames or layers keep an existing index up to
+	date. Anything else (layers added, removed or renamed by hand) is
+	noticed when the affected track is next looked up, and the index is
+	rebuilt.
+	"""
+	def __init__(self, img):
+		self.img = img
+		# frame tattoo -> number of layers in the frame
+		self.frames = {}
+		# track name -> {frame tattoo: layer tattoo}
+		self.tracks = {}
+
+	@classmethod
+	def load(cls, img):
+		"""
+		@returns the index stored in the image, building it if the image
+		doesn't have one yet
+		"""
+		index = cls(img)
+		p = img.parasite_find(TRACK_INDEX_PARASITE)
+		if p is None:
+			index.rebuild()
+			index.save()
+			return index
+
+		# json object keys are always strings
+		data = json.loads(p.data)
+		index.frames = dict((int(k), v) for k, v in data["frames"].iteritems())
+		for track_name, track in data["tracks"].iteritems():
+			index.tracks[track_name] = dict((int(k), v) for k, v in track.iteritems())
+		return index
+
+	def save(self):
+		self.img.parasite_attach(gimp.Parasite(
+			TRACK_INDEX_PARASITE,
+			1,	# 1 = Persistent
+			json.dumps({"frames": self.frames, "tracks": self.tracks})
+		))
+
+	def rebuild(self):
+		self.frames = {}
+		self.tracks = {}
+		for frame in get_frames(self.img):
+			self.add_frame(frame)
+
+	def add_frame(self, frame):
+		frame_tattoo = pdb.gimp_item_get_tattoo(frame)
+		self.frames[frame_tattoo] = 0
+		for layer in frame.children:
+			self.add_layer(layer)
+
+	def add_layer(self, layer):
+		frame_tattoo = pdb.gimp_item_get_tattoo(layer.parent)
+		self.frames[frame_tattoo] = self.frames.get(frame_tattoo, 0) + 1
+		track = self.tracks.setdefault(get_track_name(layer), {})
+		# if a frame has several layers in the same track, the top one wins
+		track.setdefault(frame_tattoo, pdb.gimp_item_get_tattoo(layer))
+
+	def remove_frame(self, frame):
+		frame_tattoo = pdb.gimp_item_get_tattoo(frame)
+		self.frames.pop(frame_tattoo, None)
+		for track in self.tracks.itervalues():
+			track.pop(frame_tattoo, None)
+
+	def remove_track(self, track_name):
+		track = self.tracks.pop(track_name, {})
+		for frame_tattoo in track:
+			if frame_tattoo in self.frames:
+				self.frames[frame_tattoo] -= 1
+
+	def _resolve(self, track_name):
+		"""
+		@returns the layers of the track, in frame order, or None if the
+		index is out of date
+		"""
+		track = self.tracks.get(track_name, {})
+		res = []
+		for frame in get_frames(self.img):
+			frame_tattoo = pdb.gimp_item_get_tattoo(frame)
+			if self.frames.get(frame_tattoo) != pdb.gimp_item_get_children(frame)[0]:
+				return None
+
+			layer_tattoo = track.get(frame_tattoo)
+			if layer_tattoo is None:
+				continue
+			layer = pdb.gimp_image_get_layer_by_tattoo(self.img, layer_tattoo)
+			if layer is None or layer.parent is None or \
+					pdb.gimp_item_get_tattoo(layer.parent) != frame_tattoo or \
+					get_track_name(layer) != track_name:
+				return None
+			res.append(layer)
+		return res
+
+	def get_layers(self, track_name):
+		"""
+		@returns the layers of the track, in frame order
+		"""
+		res = self._resolve(track_name)
+		if res is None:
+			self.rebuild()
+			self.save()
+			res = self._resolve(track_name)
+		return res
+
+def get_track_index(img):
+	"""
+	@returns the image's track index, or None if nothing has used one yet
+	(in which case there's nothing to keep up to date)
+	"""
+	if img.parasite_find(TRACK_INDEX_PARASITE) is None:
+		return None
+	return LayerTrackIndex.load(img)
+
+def get_track_layers(img, layer):
+	"""
+	@returns the layers in all frames that are in the same track as the
+	layer, or None if the layer isn't in a frame
+	"""
+	# a frame layer needs to be selected, not the frame folder layer
+	if get_frame_num(layer) is None or is_frame_root(layer):
+		return None
+	return LayerTrackIndex.load(img).get_layers(get_track_name(layer))
+
+CHECKPOINT_PARASITE = "narly_sprite_checkpoint"
+
+def get_checkpoint(img):
+	p = img.parasite_find(CHECKPOINT_PARASITE)
+	if p is None:
+		return None
+	return json.loads(p.data)
+
+def discard_checkpoint(img):
+	checkpoint = get_checkpoint(img)
+	if checkpoint is None:
+		return
+
+	if checkpoint["type"] == "xcf":
+		if os.path.exists(checkpoint["path"]):
+			os.remove(checkpoint["path"])
+	else:
+		for other in gimp.image_list():
+			if other.ID == checkpoint["image"]:
+				pdb.gimp_image_delete(other)
+				break
+
+	img.parasite_detach(CHECKPOINT_PARASITE)
+
+def save_checkpoint(img, undo_mode):
+	"""
+	Keeps a single copy of the image around that narly_sprite_restore_checkpoint
+	can go back to, replacing any previous checkpoint.
+	"""
+	discard_checkpoint(img)
+
+	if undo_mode == UNDO_CHECKPOINT_XCF:
+		key = img.filename or ("unsaved image %d" % img.ID)
+		checkpoint_dir = os.path.join(gimp.directory, "narly_sprite_checkpoints")
+		if not os.path.isdir(checkpoint_dir):
+			os.makedirs(checkpoint_dir)
+		path = os.path.join(checkpoint_dir, hashlib.sha1(key).hexdigest() + ".xcf")
+		pdb.gimp_xcf_save(0, img, img.active_drawable, path, path)
+		checkpoint = {"type": "xcf", "path": path}
+	else:
+		dup = pdb.gimp_image_duplicate(img)
+		pdb.gimp_image_undo_disable(dup)
+		checkpoint = {"type": "image", "image": dup.ID}
+
+	img.parasite_attach(gimp.Parasite(
+		CHECKPOINT_PARASITE,
+		0,	# 0 = not persistent, the checkpoint only lives as long as this session
+		json.dumps(checkpoint)
+	))
+
+def begin_bulk_edit(img, undo_mode):
+	"""
+	Starts a change to lots of layers. With one of the low undo modes,
+	the image is checkpointed and undo is disabled until end_bulk_edit, so
+	gimp doesn't keep a copy of every layer that gets added. Disabling
+	undo also clears the undo history: the steps from before the edit
+	would point at layers the edit removes or moves, so undo stops at the
+	checkpoint (see restore_checkpoint).
+	"""
+	if undo_mode == UNDO_FULL:
+		pdb.gimp_undo_push_group_start(img)
+		return
+
+	save_checkpoint(img, undo_mode)
+	pdb.gimp_image_undo_disable(img)
+
+def end_bulk_edit(img, undo_mode):
+	if undo_mode == UNDO_FULL:
+		pdb.gimp_undo_push_group_end(img)
+		return
+
+	pdb.gimp_image_undo_enable(img)
+
+def _copy_parasites(src, dest):
+	for name in src.parasite_list():
+		dest.parasite_attach(src.parasite_find(name))
+
+def _copy_mask(layer, new_layer):
+	new_mask = new_layer.mask
+	if new_mask is None:
+		new_mask = pdb.gimp_layer_create_mask(new_layer, ADD_WHITE_MASK)
+		pdb.gimp_layer_add_mask(new_layer, new_mask)
+	src = layer.mask.get_pixel_rgn(0, 0, layer.mask.width, layer.mask.height, False, False)
+	dest = new_mask.get_pixel_rgn(0, 0, new_mask.width, new_mask.height, True, False)
+	dest[0:new_mask.width, 0:new_mask.height] = src[0:layer.mask.width, 0:layer.mask.height]
+	new_mask.flush()
+	new_mask.update(0, 0, new_mask.width, new_mask.height)
+	new_layer.apply_mask = layer.apply_mask
+	new_layer.show_mask = layer.show_mask
+	new_layer.edit_mask = layer.edit_mask
+
+def _copy_layers_into(img, layers, parent):
+	"""
+	Copies the layers (from another image) into img under parent, with
+	their masks, parasites (like the tracks) and tattoos, so the track
+	index still points at the right layers.
+	"""
+	for layer in layers:
+		if pdb.gimp_item_is_group(layer):
+			new_layer = pdb.gimp_layer_group_new(img)
+			pdb.gimp_image_insert_layer(img, new_layer, parent, len(parent.children) if parent else len(img.layers))
+			_copy_layers_into(img, layer.children, new_layer)
+		else:
+			new_layer = pdb.gimp_layer_new_from_drawable(layer, img)
+			pdb.gimp_image_insert_layer(img, new_layer, parent, len(parent.children) if parent else len(img.layers))
+			new_layer.set_offsets(*layer.offsets)
+			if layer.mask is not None:
+				_copy_mask(layer, new_layer)
+		new_layer.name = layer.name
+		new_layer.visible = layer.visible
+		new_layer.opacity = layer.opacity
+		new_layer.mode = layer.mode
+		new_layer.linked = layer.linked
+		new_layer.lock_alpha = layer.lock_alpha
+		_copy_parasites(layer, new_layer)
+		pdb.gimp_item_set_tattoo(new_layer, pdb.gimp_item_get_tattoo(layer))
+
+def abort_bulk_edit(img, undo_mode):
+	"""
+	Ends a bulk edit that was cancelled part way through. In the low undo
+	modes the image is put back to its checkpoint, otherwise what was done
+	so far stays in the undo group.
+	"""
+	end_bulk_edit(img, undo_mode)
+	if undo_mode != UNDO_FULL:
+		restore_checkpoint(img)
+
+def restore_checkpoint(img):
+	"""
+	Puts the image back the way it was before the last bulk edit that was
+	done in one of the low undo modes. This replaces every layer, so it
+	clears the undo history too.
+
+	@returns whether or not there was a checkpoint to restore
+	"""
+	checkpoint = get_checkpoint(img)
+	if checkpoint is None:
+		return False
+
+	if checkpoint["type"] == "xcf":
+		saved = pdb.gimp_xcf_load(0, checkpoint["path"], checkpoint["path"])
+	else:
+		saved = None
+		for other in gimp.image_list():
+			if other.ID == checkpoint["image"]:
+				saved = other
+				break
+		if saved is None:
+			img.parasite_detach(CHECKPOINT_PARASITE)
+			return False
+
+	pdb.gimp_image_undo_disable(img)
+	try:
+		for old_layer in list(img.layers):
+			pdb.gimp_image_remove_layer(img, old_layer)
+		if (saved.width, saved.height) != (img.width, img.height):
+			pdb.gimp_image_resize(img, saved.width, saved.height, 0, 0)
+		_copy_layers_into(img, saved.layers, None)
+
+		# the image's own parasites (config, track index, ...), besides
+		# the checkpoint itself which is discarded below
+		for name in img.parasite_list():
+			if name != CHECKPOINT_PARASITE and saved.parasite_find(name) is None:
+				img.parasite_detach(name)
+		_copy_parasites(saved, img)
+	finally:
+		pdb.gimp_image_undo_enable(img)
+
+	if checkpoint["type"] == "xcf":
+		pdb.gimp_image_delete(saved)
+	discard_checkpoint(img)
+	return True
@@ -0,0 +1,383 @@
+"""
+A long running export service, so that asset builds don't pay for gimp's
+startup on every sprite sheet they export. The daemon keeps a few gimp
+batch processes running with the plugin already loaded (see batch.py) and
+hands the export jobs it's sent out to whichever of them is free:
+
+	python -m narly_sprite_lib.daemon serve [--workers 2] [--gimp gimp]
+	python -m narly_sprite_lib.daemon export walk.xcf --sheet-type grid --padding 2
+	python -m narly_sprite_lib.daemon status
+	python -m narly_sprite_lib.daemon stop
+
+Requests and replies are one json object per line over a unix socket:
+
+	{"cmd": "export", "job": {"xcf": "/art/walk.xcf", "sheet_type": "grid"}}
+		{"ok": true, "paths": [...], "worker": 0,
+		 "timing": {"queued": 0.01, "export": 0.8, "total": 0.81}}
+	{"cmd": "status"}
+		{"ok": true, "workers": [...], "queued": 3, "done": 10, "failed": 1}
+	{"cmd": "stop"}
+		{"ok": true}
+
+Failed requests get {"ok": false, "error": "some message"}. The options of
+an export job are the keys of JOB_DEFAULTS.
+
+Nothing in here talks to gimp, so it runs with any python 2.
+"""
+
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import SocketServer
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "narly_sprite_export_%d.sock" % os.getuid())
+
+# how long a new gimp worker gets to load and connect back
+GIMP_STARTUP_TIMEOUT = 120
+
+# options of an export job besides "xcf", and their defaults
+JOB_DEFAULTS = {
+	"sheet_type": "horizontal",	# or "grid"
+	"max_width": 0,
+	"max_height": 0,
+	"power_of_two": False,
+	"fixed_cols": 0,
+	"padding": 0,
+	"extrude": 0,
+	"write_metadata": True,
+	"export_path": "",	# blank = next to the xcf
+	"palette_colors": 0,
+	"dither": False,
+	"palette_file": "",
+	"collision": False,
+	"variants_file": "",	# color variants, see palette.load_color_variants
+	"animation": "",	# export only this animation's frames
+}
+
+class WorkerError(Exception):
+	pass
+
+class GimpWorker(object):
+	"""
+	One gimp batch process running batch.serve(), connected to the daemon
+	through a socket of its own.
+	"""
+	def __init__(self, idx, gimp, socket_path):
+		self.idx = idx
+		self.gimp = gimp
+		self.socket_path = "%s.worker%d" % (socket_path, idx)
+		self.proc = None
+		self._conn = None
+		self._file = None
+		self.jobs = 0
+		self.busy = False
+
+	def start(self):
+		if os.path.exists(self.socket_path):
+			os.unlink(self.socket_path)
+		listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		listener.bind(self.socket_path)
+		listener.listen(1)
+		listener.settimeout(GIMP_STARTUP_TIMEOUT)
+
+		lib_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		boot = "import sys; sys.path.insert(0, %r); from narly_sprite_lib.batch import serve; serve(%r)" % (
+			lib_parent, self.socket_path)
+		self.proc = subprocess.Popen([
+			self.gimp, "-i", "-d", "-f",
+			"--batch-interpreter=python-fu-eval",
+			"-b", boot,
+			"-b", "pdb.gimp_quit(1)",
+		])
+		try:
+			self._conn, _ = listener.accept()
+		except socket.timeout:
+			self.stop()
+			raise WorkerError("gimp worker %d didn't start within %d seconds" % (self.idx, GIMP_STARTUP_TIMEOUT))
+		finally:
+			listener.close()
+			os.unlink(self.socket_path)
+		self._conn.settimeout(None)
+		self._file = self._conn.makefile("r+", 1)
+
+	def run(self, job):
+		"""
+		@returns the worker's reply to the job
+		"""
+		if self._file is None:
+			raise WorkerError("gimp worker %d isn't running" % self.idx)
+		try:
+			self._file.write(json.dumps(job) + "\n")
+			self._file.flush()
+			line = self._file.readline()
+		except (IOError, socket.error) as e:
+			raise WorkerError("gimp worker %d: %s" % (self.idx, e))
+		if line == "":
+			raise WorkerError("gimp worker %d exited" % self.idx)
+		return json.loads(line)
+
+	def stop(self):
+		if self._file is not None:
+			try:
+				self._conn.shutdown(socket.SHUT_RDWR)
+			except socket.error:
+				pass
+			self._file.close()
+			self._conn.close()
+			self._file = None
+			self._conn = None
+		if self.proc is not None:
+			# closing the connection makes serve() return and gimp quit
+			if self.proc.poll() is None:
+				timer = threading.Timer(10, self._kill)
+				timer.start()
+				self.proc.wait()
+				timer.cancel()
+			self.proc = None
+
+	def _kill(self):
+		if self.proc is not None and self.proc.poll() is None:
+			self.proc.kill()
+
+class PendingJob(object):
+	def __init__(self, job):
+		self.job = job
+		self.queued_at = time.time()
+		self.reply = None
+		self.done = threading.Event()
+
+class ExportDaemon(object):
+	"""
+	Queues export jobs and runs each one on the first free gimp worker.
+	"""
+	def __init__(self, num_workers, gimp, socket_path):
+		self.socket_path = socket_path
+		self.workers = [GimpWorker(idx, gimp, socket_path) for idx in xrange(num_workers)]
+		self.queue = Queue.Queue()
+		self.done = 0
+		self.failed = 0
+		self._lock = threading.Lock()
+		self._threads = []
+
+	def start(self):
+		for worker in self.workers:
+			worker.start()
+		for worker in self.workers:
+			thread = threading.Thread(target=self._run_worker, args=(worker,))
+			thread.daemon = True
+			thread.start()
+			self._threads.append(thread)
+
+	def stop(self):
+		for _ in self.workers:
+			self.queue.put(None)
+		for thread in self._threads:
+			thread.join()
+		for worker in self.workers:
+			worker.stop()
+
+	def submit(self, job):
+		"""
+		Queues the job and waits for it to finish.
+
+		@returns the reply for the client
+		"""
+		if not job.get("xcf"):
+			return {"ok": False, "error": "the job has no xcf"}
+		unknown = set(job) - set(JOB_DEFAULTS) - set(["xcf"])
+		if len(unknown) > 0:
+			return {"ok": False, "error": "unknown job options: %s" % ", ".join(sorted(unknown))}
+
+		pending = PendingJob(job)
+		self.queue.put(pending)
+		pending.done.wait()
+		return pending.reply
+
+	def get_status(self):
+		return {
+			"ok": True,
+			"workers": [
+				{"worker": worker.idx, "busy": worker.busy, "jobs": worker.jobs}
+				for worker in self.workers
+			],
+			"queued": self.queue.qsize(),
+			"done": self.done,
+			"failed": self.failed,
+		}
+
+	def _run_worker(self, worker):
+		while True:
+			pending = self.queue.get()
+			if pending is None:
+				return
+
+			started_at = time.time()
+			worker.busy = True
+			try:
+				reply = worker.run(pending.job)
+			except WorkerError as e:
+				reply = {"ok": False, "error": str(e)}
+				self._restart(worker)
+			worker.busy = False
+			worker.jobs += 1
+
+			finished_at = time.time()
+			reply["worker"] = worker.idx
+			reply["timing"] = {
+				"queued": started_at - pending.queued_at,
+				"export": reply.pop("seconds", finished_at - started_at),
+				"total": finished_at - pending.queued_at,
+			}
+			with self._lock:
+				if reply["ok"]:
+					self.done += 1
+				else:
+					self.failed += 1
+			pending.reply = reply
+			pending.done.set()
+
+	def _restart(self, worker):
+		worker.stop()
+		try:
+			worker.start()
+		except (WorkerError, OSError) as e:
+			sys.stderr.write("couldn't restart gimp worker %d: %s\n" % (worker.idx, e))
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		for line in iter(self.rfile.readline, ""):
+			try:
+				reply = self._handle_request(json.loads(line))
+			except ValueError as e:
+				reply = {"ok": False, "error": "bad request: %s" % e}
+			self.wfile.write(json.dumps(reply) + "\n")
+			self.wfile.flush()
+
+	def _handle_request(self, request):
+		daemon = self.server.export_daemon
+		cmd = request.get("cmd")
+		if cmd == "export":
+			return daemon.submit(request.get("job", {}))
+		elif cmd == "status":
+			return daemon.get_status()
+		elif cmd == "stop":
+			# shutdown() waits for serve_forever(), which is waiting for us
+			threading.Thread(target=self.server.shutdown).start()
+			return {"ok": True}
+		return {"ok": False, "error": "unknown command %s" % cmd}
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+def serve(num_workers, gimp, socket_path=DEFAULT_SOCKET):
+	"""
+	Starts the gimp workers and serves requests until a stop request.
+	"""
+	if os.path.exists(socket_path):
+		try:
+			request({"cmd": "status"}, socket_path)
+		except socket.error:
+			# left behind by a daemon that died
+			os.unlink(socket_path)
+		else:
+			raise RuntimeError("an export daemon is already running on %s" % socket_path)
+
+	daemon = ExportDaemon(num_workers, gimp, socket_path)
+	daemon.start()
+	server = _Server(socket_path, _RequestHandler)
+	server.export_daemon = daemon
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+		os.unlink(socket_path)
+		daemon.stop()
+
+# -----------------------------------------------
+# client
+# -----------------------------------------------
+
+def request(message, socket_path=DEFAULT_SOCKET):
+	"""
+	Sends one request to the daemon.
+
+	@returns the daemon's reply
+	"""
+	conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	conn.connect(socket_path)
+	f = conn.makefile("r+", 1)
+	try:
+		f.write(json.dumps(message) + "\n")
+		f.flush()
+		line = f.readline()
+	finally:
+		f.close()
+		conn.close()
+	if line == "":
+		raise socket.error("the export daemon closed the connection")
+	return json.loads(line)
+
+def export(xcf_path, socket_path=DEFAULT_SOCKET, **options):
+	"""
+	Exports the xcf as a sprite sheet with the daemon (see JOB_DEFAULTS for
+	the options) and waits for it to finish.
+
+	@returns the daemon's reply
+	"""
+	job = dict(options, xcf=os.path.abspath(xcf_path))
+	return request({"cmd": "export", "job": job}, socket_path)
+
+def _add_job_options(parser):
+	for key, default in sorted(JOB_DEFAULTS.items()):
+		flag = "--" + key.replace("_", "-")
+		if isinstance(default, bool):
+			parser.add_argument(flag, dest=key, action="store_true", default=default)
+			parser.add_argument("--no-" + key.replace("_", "-"), dest=key, action="store_false")
+		else:
+			parser.add_argument(flag, dest=key, type=type(default), default=default)
+
+def main(argv):
+	parser = argparse.ArgumentParser(prog="python -m narly_sprite_lib.daemon")
+	parser.add_argument("--socket", default=DEFAULT_SOCKET)
+	commands = parser.add_subparsers(dest="cmd")
+
+	serve_parser = commands.add_parser("serve")
+	serve_parser.add_argument("--workers", type=int, default=2)
+	serve_parser.add_argument("--gimp", default="gimp")
+
+	export_parser = commands.add_parser("export")
+	export_parser.add_argument("xcf", nargs="+")
+	_add_job_options(export_parser)
+
+	commands.add_parser("status")
+	commands.add_parser("stop")
+
+	args = parser.parse_args(argv[1:])
+	if args.cmd == "serve":
+		serve(args.workers, args.gimp, args.socket)
+		return 0
+
+	if args.cmd != "export":
+		print json.dumps(request({"cmd": args.cmd}, args.socket), indent=1, sort_keys=True)
+		return 0
+
+	options = dict((key, getattr(args, key)) for key in JOB_DEFAULTS)
+	res = 0
+	for xcf_path in args.xcf:
+		reply = export(xcf_path, args.socket, **options)
+		if reply["ok"]:
+			print "%s: %s (%.2fs)" % (xcf_path, " ".join(reply["paths"]), reply["timing"]["total"])
+		else:
+			print "%s: FAILED %s" % (xcf_path, reply["error"])
+			res = 1
+	return res
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
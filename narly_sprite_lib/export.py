@@ -0,0 +1,970 @@
+"""
+The export procedures: flattening, sprite sheets (in the foreground or
+in a background worker), animation atlases, shared palettes, scaled
+sheets and tilesets.
+"""
+
+from gimpfu import *
+import os
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import subprocess
+
+from narly_sprite_lib.constants import *
+from narly_sprite_lib.core import *
+from narly_sprite_lib.composite import *
+from narly_sprite_lib.sheet import *
+from narly_sprite_lib.worker import SNAPSHOT_JOB_FILE, SNAPSHOT_PIXELS_FILE, write_sheet_variants
+from narly_sprite_lib.palette import (
+	PALETTE_MAX_SAMPLES,
+	sample_pixels,
+	build_palette,
+	save_palette,
+	get_shared_palette,
+	quantize,
+	load_color_variants,
+)
+from narly_sprite_lib.png import write_png, PngWriter
+from narly_sprite_lib.scale import get_scaled_size, scale_pixels, MipStream
+from narly_sprite_lib.collision import make_collision_shapes
+from narly_sprite_lib.tileset import TilesetBuilder, get_map_size
+from narly_sprite_lib.texarray import TextureArrayWriter, get_level_sizes
+from narly_sprite_lib.blend import SUPPORTED_MODES, has_numpy
+
+def narly_sprite_export_flatten(img, layer, reverse, display_image=True):
+	new_img = gimp.Image(img.width, img.height, img.base_type)
+
+	frames = get_frames(img)
+
+	if reverse:
+		frames.reverse()
+	
+	curr_frame = get_frame_num(layer)
+
+	def flatten_frames():
+		curr_count = 0
+		for frame in frames:
+			frame_num = get_frame_num(frame)
+			data = compositor.get_pixels(frame)
+			new_layer_from_pixels(new_img, make_frame_name(frame_num), img.width, img.height, data)
+			curr_count += 1
+
+			yield float(curr_count) / len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	completed = False
+	try:
+		compositor = make_frame_compositor(img)
+		try:
+			completed = run_chunked(img, flatten_frames(), "Flattening frames")
+		finally:
+			compositor.close()
+
+		if completed:
+			# make the current frame visible again
+			if curr_frame is not None:
+				goto_frame(img, curr_frame)
+
+			# set focus back to the active layer
+			pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		pdb.gimp_image_undo_thaw(img)
+		if not completed:
+			pdb.gimp_image_delete(new_img)
+
+	if not completed:
+		return None
+
+	if display_image:
+		gimp.Display(new_img)
+		gimp.displays_flush()
+	
+	return new_img
+
+def _dump_drawable(drawable, blob):
+	"""
+	Appends the raw pixels of the drawable to the blob file.
+
+	@returns the (offset, length) of the pixels in the blob
+	"""
+	rgn = drawable.get_pixel_rgn(0, 0, drawable.width, drawable.height, False, False)
+	offset = blob.tell()
+	# a row of tiles at a time, so memory doesn't grow with the layer size
+	strip_height = gimp.tile_height()
+	for y in xrange(0, drawable.height, strip_height):
+		blob.write(rgn[0:drawable.width, y:min(y+strip_height, drawable.height)])
+	return offset, blob.tell() - offset
+
+def _dump_layer(layer, blob):
+	"""
+	Appends the raw pixels of the layer (and of its mask, or of the layers
+	in it for groups) to the blob file.
+
+	@returns the snapshot description of the layer
+	"""
+	offsets = layer.offsets
+	info = {
+		"name": layer.name,
+		"x": offsets[0],
+		"y": offsets[1],
+		"width": layer.width,
+		"height": layer.height,
+		"opacity": layer.opacity,
+		"visible": bool(layer.visible),
+		"mode": layer.mode,
+	}
+	if pdb.gimp_item_is_group(layer):
+		info["children"] = [_dump_layer(child, blob) for child in layer.children]
+		return info
+
+	info["bpp"] = layer.bpp
+	info["offset"], info["length"] = _dump_drawable(layer, blob)
+	if layer.mask is not None and layer.apply_mask:
+		info["mask_offset"], info["mask_length"] = _dump_drawable(layer.mask, blob)
+	return info
+
+def _needs_flatten(layers):
+	"""
+	Whether the export worker can't composite the layers itself - with
+	numpy it knows the common layer modes (see blend.py), groups and
+	masks, without it only plain layers in normal mode. Anything else gets
+	flattened by gimp when taking the snapshot.
+	"""
+	for layer in layers:
+		if not layer.visible:
+			continue
+		if not has_numpy():
+			if pdb.gimp_item_is_group(layer) or layer.mode != NORMAL_MODE \
+					or (layer.mask is not None and layer.apply_mask):
+				return True
+		elif layer.mode not in SUPPORTED_MODES:
+			return True
+		elif pdb.gimp_item_is_group(layer):
+			if (layer.mask is not None and layer.apply_mask) or _needs_flatten(layer.children):
+				return True
+	return False
+
+def snapshot_frames(img, frames, snapshot_dir):
+	"""
+	Dumps the raw pixels of the layers in each frame (and of the visible
+	top level layers that aren't frames, like a background, which show up
+	in every frame) into the snapshot directory. This only reads from the
+	image - frames that have to be flattened are flattened in a duplicate
+	of the image, so the visibility of the frames in the image is never
+	touched.
+
+	@returns the snapshot description of each frame
+	"""
+	dup = None
+	frames_info = []
+	# the frames and visible other layers at the top level, in stack order
+	stack = []
+	for item in img.layers:
+		is_frame = get_frame_num(item) is not None
+		if is_frame or item.visible:
+			stack.append((item, is_frame))
+	others = [item for item, item_is_frame in stack if not item_is_frame]
+
+	with open(os.path.join(snapshot_dir, SNAPSHOT_PIXELS_FILE), "wb") as blob:
+		# the other layers' pixels are dumped once and shared by every frame
+		others_info = None
+		curr_count = 0
+		for frame in frames:
+			frame_num = get_frame_num(frame)
+			if _needs_flatten(others + frame.children):
+				if dup is None:
+					dup = pdb.gimp_image_duplicate(img)
+					pdb.gimp_image_undo_disable(dup)
+				goto_frame(dup, frame_num, set_active=False)
+				flat = pdb.gimp_layer_new_from_visible(dup, dup, make_frame_name(frame_num))
+				pdb.gimp_image_insert_layer(dup, flat, None, 0)
+				layers_info = [_dump_layer(flat, blob)]
+				pdb.gimp_image_remove_layer(dup, flat)
+			else:
+				if others_info is None:
+					others_info = dict((item.ID, _dump_layer(item, blob)) for item in others)
+				layers_info = []
+				for item, is_frame in stack:
+					if not is_frame:
+						layers_info.append(others_info[item.ID])
+					elif item.ID == frame.ID:
+						layers_info.extend(_dump_layer(child, blob) for child in frame.children)
+
+			frames_info.append({"frame": frame_num, "layers": layers_info})
+
+			curr_count += 1
+			pdb.gimp_progress_update(float(curr_count)/len(frames))
+
+	if dup is not None:
+		pdb.gimp_image_delete(dup)
+
+	return frames_info
+
+def get_png_options(img):
+	"""
+	@returns the keyword arguments for write_png from the image's config
+	"""
+	config = get_config(img)
+	return {
+		"level": config["png_compression"],
+		"filter_type": config["png_filter"],
+		"threads": config["png_threads"],
+	}
+
+def start_export_worker(snapshot_dir):
+	lib_parent = os.path.dirname(os.path.abspath(__file__))
+	env = dict(os.environ)
+	env["PYTHONPATH"] = os.pathsep.join(filter(None, [lib_parent, env.get("PYTHONPATH")]))
+	return subprocess.Popen(
+		[sys.executable, "-m", "narly_sprite_lib.worker", snapshot_dir],
+		stdout=subprocess.PIPE,
+		env=env,
+	)
+
+def wait_for_export_worker(proc):
+	"""
+	Passes the progress of the export worker on to gimp until it exits.
+
+	@returns the path of the exported sheet, or None if it failed
+	"""
+	res = None
+	for line in iter(proc.stdout.readline, ""):
+		kind, _, value = line.strip().partition(" ")
+		if kind == "progress":
+			pdb.gimp_progress_update(float(value))
+		elif kind == "done":
+			res = value
+		elif kind == "error":
+			gimp.message("Background export failed: " + value)
+	proc.wait()
+	return res
+
+def _export_sprite_sheet_in_background(img, frames, layout, export_base, write_metadata,
+		palette_colors, dither, palette_file, collision, extra, variants_file):
+	if img.base_type == INDEXED:
+		gimp.message("Background export doesn't support indexed images")
+		return
+
+	snapshot_dir = tempfile.mkdtemp(prefix="narly_sprite_")
+	try:
+		pdb.gimp_progress_set_text("Taking a snapshot of the frames")
+		frames_info = snapshot_frames(img, frames, snapshot_dir)
+		job = {
+			"width": img.width,
+			"height": img.height,
+			"layout": layout,
+			"export_base": export_base,
+			"write_metadata": write_metadata,
+			"palette_colors": palette_colors,
+			"dither": dither,
+			"palette_file": palette_file,
+			"collision": collision,
+			"variants_file": variants_file,
+			"extra": extra,
+			"png": get_png_options(img),
+			"workers": get_config(img)["compositor_workers"],
+			"frames": frames_info,
+		}
+		with open(os.path.join(snapshot_dir, SNAPSHOT_JOB_FILE), "w") as f:
+			json.dump(job, f)
+
+		pdb.gimp_progress_set_text("Exporting sprite sheet")
+		pdb.gimp_progress_update(0.0)
+		png_path = wait_for_export_worker(start_export_worker(snapshot_dir))
+	finally:
+		shutil.rmtree(snapshot_dir, True)
+
+	if png_path is not None:
+		sheet_img = pdb.file_png_load(png_path, png_path)
+		gimp.Display(sheet_img)
+		gimp.displays_flush()
+
+def export_sprite_sheet(img, layer, frames, sheet_type, max_width, max_height,
+		power_of_two, fixed_cols, padding, extrude, write_metadata, export_path, background,
+		palette_colors, dither, palette_file, collision, extra=None, display=True, variants_file=""):
+	"""
+	Lays the frames out on a sprite sheet, with `extra` added to the
+	sheet's metadata. With palette_colors set, the
+	sheet is quantized to an 8-bit palette and written as a paletted PNG.
+	If palette_file exists its palette is used as is, otherwise the
+	palette is built from the sheet and saved there, so that every sheet
+	exported with the same palette file shares one palette.
+
+	With variants_file set (see load_color_variants), a recolored copy of
+	the finished sheet is also written for each color variant, as
+	<sheet>_<variant>.png. The frames are only composited once and all of
+	the variants share the sheet's metadata.
+
+	With collision set, the metadata of each frame also gets its collision
+	shapes (see narly_sprite_lib/collision.py).
+
+	The sheet is opened in a new display, or with display off (batch
+	mode) it's always written to a PNG instead.
+
+	@returns the paths of the files that were written
+	"""
+	if len(frames) == 0:
+		return []
+	if extra is None:
+		extra = {}
+
+	export_base = get_export_base_path(img, export_path)
+	if export_base is None and (write_metadata or background or palette_colors > 0 or variants_file or not display):
+		gimp.message("Save the image or set an output path to write the sheet files")
+		return []
+
+	if palette_colors > 0 and img.base_type != RGB:
+		gimp.message("Only RGB sprites can be exported with a palette")
+		return []
+
+	variants = None
+	if variants_file:
+		if img.base_type != RGB:
+			gimp.message("Only RGB sprites can be exported with color variants")
+			return []
+		try:
+			variants = load_color_variants(variants_file)
+		except (IOError, ValueError) as e:
+			gimp.message("Couldn't load the color variants: %s" % e)
+			return []
+
+	if sheet_type == HORIZONTAL:
+		layout = solve_sheet_layout(
+			len(frames), img.width, img.height, padding, extrude,
+			max_width, max_height, power_of_two, fixed_rows=1
+		)
+	elif sheet_type == GRID:
+		layout = solve_sheet_layout(
+			len(frames), img.width, img.height, padding, extrude,
+			max_width, max_height, power_of_two, fixed_cols
+		)
+	else:
+		gimp.message("ERROR! Unknown sprite sheet type!")
+		return []
+
+	if layout is None:
+		gimp.message("No sprite sheet layout fits in %dx%d!" % (max_width, max_height))
+		return []
+
+	if background:
+		_export_sprite_sheet_in_background(img, frames, layout, export_base, write_metadata,
+			palette_colors, dither, palette_file, collision, extra, variants_file)
+		return []
+
+	new_img = None
+	sheet = None
+	# the variants are recolored copies of the whole sheet
+	if palette_colors > 0 or variants is not None:
+		sheet = bytearray(layout["width"] * layout["height"] * 4)
+	else:
+		new_img = gimp.Image(layout["width"], layout["height"], img.base_type)
+
+	cell_width = img.width + 2*extrude
+	cell_height = img.height + 2*extrude
+	frames_meta = []
+
+	def export_frames():
+		curr_count = 0
+		for idx, frame in enumerate(frames):
+			frame_num = get_frame_num(frame)
+			x, y = get_layout_cell_pos(layout, idx)
+
+			if tiled:
+				cell_layer = new_transparent_layer(new_img, make_frame_name(frame_num), cell_width, cell_height)
+				bounds = compositor.copy_tiled(frame, cell_layer, extrude)
+				pdb.gimp_layer_set_offsets(cell_layer, x-extrude, y-extrude)
+				frames_meta.append(make_frame_metadata(frame_num, x, y, img.width, img.height, bounds))
+				curr_count += 1
+				yield float(curr_count)/len(frames)
+				continue
+
+			data = compositor.get_pixels(frame)
+			if sheet is not None:
+				blit_frame(sheet, layout["width"], data, img.width, img.height, x, y, extrude)
+			else:
+				cell = bytearray(cell_width * cell_height * compositor.bpp)
+				blit_frame(cell, cell_width, data, img.width, img.height, extrude, extrude, extrude, compositor.bpp)
+				new_layer_from_pixels(new_img, make_frame_name(frame_num), cell_width, cell_height, cell, x-extrude, y-extrude)
+
+			bounds = get_rgba_alpha_bounds(data, img.width, img.height, compositor.bpp)
+			frames_meta.append(make_frame_metadata(frame_num, x, y, img.width, img.height, bounds))
+			if collision:
+				frames_meta[-1]["collision"] = make_collision_shapes(data, img.width, img.height, compositor.bpp)
+
+			curr_count += 1
+			yield float(curr_count)/len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	completed = False
+	try:
+		compositor = make_frame_compositor(img)
+		try:
+			# big frames go straight from gimp into the sheet a tile at a
+			# time, collision shapes and paletted sheets need the whole frame
+			tiled = sheet is None and not collision and compositor.is_tiled()
+			completed = run_chunked(img, export_frames(), "Exporting sprite sheet")
+		finally:
+			compositor.close()
+	finally:
+		pdb.gimp_image_undo_thaw(img)
+		if not completed and new_img is not None:
+			pdb.gimp_image_delete(new_img)
+
+	if not completed:
+		return []
+
+	extra = dict(extra, layout=layout)
+	written = []
+	palette = None
+	indices = None
+	if palette_colors > 0:
+		palette = get_shared_palette(palette_file, sheet, palette_colors)
+		indices = quantize(sheet, layout["width"], layout["height"], palette, dither)
+		write_png(export_base + ".png", layout["width"], layout["height"], indices, bpp=1, palette=palette,
+			**get_png_options(img))
+		extra["palette"] = [list(color) for color in palette]
+		new_img = new_indexed_image(layout["width"], layout["height"], indices, palette)
+	elif sheet is not None:
+		write_png(export_base + ".png", layout["width"], layout["height"], sheet, **get_png_options(img))
+		new_img = gimp.Image(layout["width"], layout["height"], RGB)
+		new_layer_from_pixels(new_img, "Sheet", layout["width"], layout["height"], sheet)
+	if sheet is not None:
+		written.append(export_base + ".png")
+
+	if variants is not None:
+		variant_paths = write_sheet_variants(export_base, layout["width"], layout["height"],
+			variants, sheet, palette, indices, get_png_options(img))
+		extra["variants"] = dict((name, os.path.basename(path)) for name, path in variant_paths.iteritems())
+		written.extend(variant_paths[name] for name, _ in variants)
+	if display:
+		gimp.Display(new_img)
+		gimp.displays_flush()
+	else:
+		if sheet is None:
+			merged = pdb.gimp_image_merge_visible_layers(new_img, CLIP_TO_IMAGE)
+			pdb.file_png_save_defaults(new_img, merged, export_base + ".png", export_base + ".png")
+			written.append(export_base + ".png")
+		pdb.gimp_image_delete(new_img)
+
+	if write_metadata:
+		write_sheet_metadata(
+			export_base,
+			layout["width"],
+			layout["height"],
+			img.width,
+			img.height,
+			frames_meta,
+			extra
+		)
+		written.extend([export_base + ".json", export_base + ".idx"])
+	
+	# if we were in a valid frame, make that frame visible again
+	curr_frame_num = get_frame_num(layer)
+	if curr_frame_num is not None:
+		pdb.gimp_image_undo_freeze(img)
+		try:
+			goto_frame(img, curr_frame_num)
+		finally:
+			pdb.gimp_image_undo_thaw(img)
+
+	# make the current layer the active layer again
+	pdb.gimp_image_set_active_layer(img, layer)
+
+	return written
+
+def narly_sprite_export_sprite_sheet(img, layer, sheet_type, max_width, max_height,
+		power_of_two, fixed_cols, padding, extrude, write_metadata, export_path, background,
+		palette_colors=0, dither=False, palette_file="", collision=False, variants_file=""):
+	export_sprite_sheet(img, layer, get_frames(img), sheet_type, max_width, max_height,
+		power_of_two, fixed_cols, padding, extrude, write_metadata, export_path, background,
+		palette_colors, dither, palette_file, collision, variants_file=variants_file)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def find_animation(animations, name):
+	for animation in animations:
+		if animation["name"] == name:
+			return animation
+	return None
+
+def get_animation_frame_nums(img, animation):
+	"""
+	@returns the numbers of the (existing) frames in the animation, where
+	an end of -1 means through the last frame
+	"""
+	last_frame_num = get_last_frame_num(img)
+	end = animation["end"]
+	if end < 0 or end > last_frame_num:
+		end = last_frame_num
+	return range(animation["start"], end+1)
+
+def narly_sprite_define_animation(img, layer, name, start_frame, end_frame):
+	"""
+	Names the range of frames [start_frame, end_frame] as an animation
+	(replacing any animation with the same name). A negative end_frame
+	means through the last frame.
+	"""
+	name = name.strip()
+	if name == "":
+		gimp.message("The animation needs a name!")
+		return
+	if start_frame < 0:
+		gimp.message("Start frame value must be >= 0!")
+		return
+	if end_frame >= 0 and start_frame > end_frame:
+		gimp.message("Start frame must be <= end frame!")
+		return
+
+	config = get_config(img)
+	animations = [a for a in config["animations"] if a["name"] != name]
+	animations.append({"name": name, "start": start_frame, "end": end_frame})
+	animations.sort(key=lambda a: a["start"])
+	config["animations"] = animations
+	save_config(img, config)
+
+def narly_sprite_delete_animation(img, layer, name):
+	config = get_config(img)
+	if find_animation(config["animations"], name) is None:
+		gimp.message("There's no animation named %s!" % name)
+		return
+	config["animations"] = [a for a in config["animations"] if a["name"] != name]
+	save_config(img, config)
+
+def narly_sprite_list_animations(img, layer):
+	animations = get_config(img)["animations"]
+	if len(animations) == 0:
+		gimp.message("No animations defined")
+		return
+	lines = []
+	for animation in animations:
+		end = "last" if animation["end"] < 0 else str(animation["end"])
+		lines.append("%s: frames %d - %s" % (animation["name"], animation["start"], end))
+	gimp.message("\n".join(lines))
+
+def narly_sprite_export_animation_atlas(img, layer, animation_name, sheet_type, max_width, max_height,
+		power_of_two, fixed_cols, padding, extrude, export_path, background, collision):
+	"""
+	Exports the named animations (or just one of them) into one sprite
+	sheet. A frame that's in several animations is only composited and
+	placed on the sheet once.
+
+	The metadata gets an "animations" list, with the indices into its
+	"frames" list of each animation's frames, in order.
+	"""
+	animations = get_config(img)["animations"]
+	if animation_name:
+		animation = find_animation(animations, animation_name)
+		if animation is None:
+			gimp.message("There's no animation named %s!" % animation_name)
+			return
+		animations = [animation]
+		# don't overwrite the atlas of all of the animations
+		if not export_path and img.filename:
+			export_path = "%s_%s.png" % (os.path.splitext(img.filename)[0], animation_name)
+	elif len(animations) == 0:
+		gimp.message("Define some animations first (Sprite/Animations/Define Animation)")
+		return
+
+	frames_by_num = {}
+	for frame in get_frames(img):
+		frames_by_num[get_frame_num(frame)] = frame
+
+	anim_frame_nums = [
+		[num for num in get_animation_frame_nums(img, animation) if num in frames_by_num]
+		for animation in animations
+	]
+	sheet_frame_nums = sorted(set(num for nums in anim_frame_nums for num in nums))
+	cells = dict((num, idx) for idx, num in enumerate(sheet_frame_nums))
+
+	extra = {"animations": []}
+	for animation, nums in zip(animations, anim_frame_nums):
+		extra["animations"].append({
+			"name": animation["name"],
+			"frames": [cells[num] for num in nums],
+		})
+
+	export_sprite_sheet(img, layer, [frames_by_num[num] for num in sheet_frame_nums],
+		sheet_type, max_width, max_height, power_of_two, fixed_cols, padding, extrude,
+		True, export_path, background, 0, False, "", collision, extra)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_build_shared_palette(img, layer, files, num_colors, palette_file):
+	"""
+	Builds one palette from a sample of the frames of several sprites (the
+	current one plus any .xcf files matching the pattern) and saves it to
+	palette_file, for use with the sprite sheet export.
+	"""
+	if not palette_file:
+		gimp.message("Set a palette file to save the palette to")
+		return
+
+	paths = sorted(glob.glob(files)) if files else []
+	samples = []
+
+	def sample_frames(sprite):
+		if sprite.base_type != RGB:
+			return
+		compositor = make_frame_compositor(sprite)
+		try:
+			sprite_frames = get_frames(sprite)
+			# give every frame of every sprite the same say in the palette
+			max_samples = max(PALETTE_MAX_SAMPLES // max(len(sprite_frames), 1), 1)
+			for frame in sprite_frames:
+				samples.extend(sample_pixels(compositor.get_pixels(frame), max_samples=max_samples))
+		finally:
+			compositor.close()
+
+	def sample_sprites():
+		state = save_frame_state(img)
+		pdb.gimp_image_undo_freeze(img)
+		try:
+			sample_frames(img)
+		finally:
+			restore_frame_state(img, state)
+			pdb.gimp_image_undo_thaw(img)
+		yield 1.0 / (len(paths) + 1)
+
+		for idx, path in enumerate(paths):
+			if img.filename and os.path.abspath(path) == os.path.abspath(img.filename):
+				continue
+			sprite = pdb.gimp_file_load(path, path)
+			pdb.gimp_image_undo_disable(sprite)
+			try:
+				sample_frames(sprite)
+			finally:
+				pdb.gimp_image_delete(sprite)
+			yield float(idx + 2) / (len(paths) + 1)
+
+	if not run_chunked(img, sample_sprites(), "Sampling frames"):
+		return
+
+	palette = build_palette(samples, num_colors)
+	save_palette(palette_file, palette)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def parse_scales(scales):
+	"""
+	@returns the scale factors in a string like "1, 2, 0.5", or None if
+	it isn't a list of positive numbers
+	"""
+	res = []
+	for part in scales.replace(",", " ").split():
+		try:
+			scale = float(part)
+		except ValueError:
+			return None
+		if scale <= 0:
+			return None
+		res.append(scale)
+	return res
+
+def get_tier_base_path(export_base, scale):
+	"""
+	@returns eg "walk" for 1x, "walk@2x" for 2x and "walk@0.5x" for 0.5x
+	"""
+	if scale == 1:
+		return export_base
+	return "%s@%gx" % (export_base, scale)
+
+def _open_sheet_tier(tier, mipmaps, png_options):
+	"""
+	Opens the png writers of a tier's sheet and mip levels, and the
+	SheetStream that feeds them as each row of cells is finished. Each
+	mip level is box filtered from the rows of the level above as they
+	come in, so no level is ever held whole.
+	"""
+	layout = tier["layout"]
+	tier["writers"] = []
+	tier["mipmaps"] = []
+	levels = get_level_sizes(layout["width"], layout["height"], mipmaps)
+	for level, (width, height) in enumerate(levels):
+		path = tier["base"] + (".mip%d.png" % level if level > 0 else ".png")
+		tier["writers"].append(PngWriter(path, width, height, 4, png_options["level"], png_options["filter_type"]))
+		if level > 0:
+			tier["mipmaps"].append({
+				"level": level,
+				"file": os.path.basename(path),
+				"width": width,
+				"height": height,
+			})
+
+	def feed(writer, mip):
+		def write_rows(data):
+			writer.write_rows(data)
+			mip.write_rows(data)
+		return write_rows
+
+	# chain the levels together, smallest first
+	write_rows = tier["writers"][-1].write_rows
+	for level in reversed(xrange(len(levels) - 1)):
+		width, height = levels[level]
+		write_rows = feed(tier["writers"][level], MipStream(width, height, write_rows))
+	tier["stream"] = SheetStream(layout, write_rows)
+
+def _finish_sheet_tier(tier, mipmaps):
+	layout = tier["layout"]
+	frame_width, frame_height = tier["frame_size"]
+	tier["stream"].close()
+	for writer in tier["writers"]:
+		writer.close()
+
+	extra = {"layout": layout, "scale": tier["scale"]}
+	if mipmaps:
+		extra["mipmaps"] = tier["mipmaps"]
+	write_sheet_metadata(
+		tier["base"],
+		layout["width"],
+		layout["height"],
+		frame_width,
+		frame_height,
+		tier["frames"],
+		extra
+	)
+
+def narly_sprite_export_scaled_sheets(img, layer, scales, filter_type, sheet_type, power_of_two,
+		fixed_cols, padding, extrude, mipmaps, export_path):
+	"""
+	Exports a sprite sheet and its metadata for each of the scale factors
+	(eg 1x, 2x and 0.5x asset tiers). Each frame is composited only once,
+	and scaled from that for every tier. The sheets are streamed to their
+	png files a row of cells at a time.
+	"""
+	if img.base_type != RGB:
+		gimp.message("Only RGB sprites can be exported at several scales")
+		return
+
+	scale_list = parse_scales(scales)
+	if not scale_list:
+		gimp.message("Scales should be a list of numbers, eg 1, 2, 0.5")
+		return
+
+	export_base = get_export_base_path(img, export_path)
+	if export_base is None:
+		gimp.message("Save the image or set an output path to write the sheet files")
+		return
+
+	frames = get_frames(img)
+	if len(frames) == 0:
+		return
+
+	tiers = []
+	for scale in scale_list:
+		frame_width, frame_height = get_scaled_size(img.width, img.height, scale)
+		layout = solve_sheet_layout(
+			len(frames), frame_width, frame_height, padding, extrude,
+			0, 0, power_of_two,
+			fixed_cols if sheet_type == GRID else 0,
+			1 if sheet_type == HORIZONTAL else 0
+		)
+		tiers.append({
+			"scale": scale,
+			"base": get_tier_base_path(export_base, scale),
+			"frame_size": (frame_width, frame_height),
+			"layout": layout,
+			"frames": [],
+		})
+
+	png_options = get_png_options(img)
+
+	def export_tiers():
+		for tier in tiers:
+			_open_sheet_tier(tier, mipmaps, png_options)
+		# frames go in layout order, so each tier's rows of cells are
+		# written out as soon as they're full
+		for idx, frame in enumerate(frames):
+			frame_num = get_frame_num(frame)
+			data = compositor.get_pixels(frame)
+			for tier in tiers:
+				width, height = tier["frame_size"]
+				scaled = scale_pixels(data, img.width, img.height, width, height, filter_type)
+				x, y = get_layout_cell_pos(tier["layout"], idx)
+				tier["stream"].add_frame(idx, scaled, width, height)
+				bounds = get_rgba_alpha_bounds(scaled, width, height)
+				tier["frames"].append(make_frame_metadata(frame_num, x, y, width, height, bounds))
+			yield float(idx+1) / len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	completed = False
+	try:
+		compositor = make_frame_compositor(img)
+		try:
+			if run_chunked(img, export_tiers(), "Exporting sprite sheets"):
+				for tier in tiers:
+					_finish_sheet_tier(tier, mipmaps)
+				completed = True
+		finally:
+			compositor.close()
+
+		# if we were in a valid frame, make that frame visible again
+		curr_frame_num = get_frame_num(layer)
+		if curr_frame_num is not None:
+			goto_frame(img, curr_frame_num)
+		pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		pdb.gimp_image_undo_thaw(img)
+		if not completed:
+			for tier in tiers:
+				for writer in tier.get("writers", []):
+					writer.abort()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_export_tileset(img, layer, tile_size, flips, power_of_two, padding, extrude, export_path):
+	"""
+	Cuts every frame into tile_size x tile_size tiles and writes each
+	distinct tile once to a tileset PNG, with the tilemap of every frame
+	in the json metadata (see narly_sprite_lib/tileset.py). Frames that
+	only differ in a few tiles then cost a few tiles each, instead of a
+	whole frame.
+	"""
+	if img.base_type != RGB:
+		gimp.message("Only RGB sprites can be exported as a tileset")
+		return
+	if tile_size <= 0:
+		gimp.message("The tile size should be at least 1")
+		return
+
+	export_base = get_export_base_path(img, export_path)
+	if export_base is None:
+		gimp.message("Save the image or set an output path to write the tileset files")
+		return
+
+	frames = get_frames(img)
+	if len(frames) == 0:
+		return
+
+	builder = TilesetBuilder(tile_size, flips)
+	tilemaps = []
+
+	def cut_frames():
+		for idx, frame in enumerate(frames):
+			data = compositor.get_pixels(frame)
+			tilemaps.append({
+				"frame": get_frame_num(frame),
+				"tiles": builder.add_frame(data, img.width, img.height),
+			})
+			yield float(idx+1) / len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	completed = False
+	try:
+		compositor = make_frame_compositor(img)
+		try:
+			completed = run_chunked(img, cut_frames(), "Cutting frames into tiles")
+		finally:
+			compositor.close()
+
+		# if we were in a valid frame, make that frame visible again
+		curr_frame_num = get_frame_num(layer)
+		if curr_frame_num is not None:
+			goto_frame(img, curr_frame_num)
+		pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		pdb.gimp_image_undo_thaw(img)
+
+	if not completed:
+		return
+
+	map_cols, map_rows = get_map_size(img.width, img.height, tile_size)
+	meta = {
+		"tile_size": tile_size,
+		"map_size": {"w": map_cols, "h": map_rows},
+		"frames": tilemaps,
+		"tiles_used": builder.num_tiles,
+		"unique_tiles": len(builder.tiles),
+	}
+
+	if len(builder.tiles) > 0:
+		layout = solve_sheet_layout(len(builder.tiles), tile_size, tile_size, padding, extrude,
+			power_of_two=power_of_two)
+		tileset = bytearray(layout["width"] * layout["height"] * 4)
+		for idx, tile in enumerate(builder.tiles):
+			x, y = get_layout_cell_pos(layout, idx)
+			blit_frame(tileset, layout["width"], tile, tile_size, tile_size, x, y, extrude)
+		write_png(export_base + ".png", layout["width"], layout["height"], tileset, **get_png_options(img))
+		meta["tileset"] = {
+			"file": os.path.basename(export_base + ".png"),
+			"w": layout["width"],
+			"h": layout["height"],
+		}
+		meta["layout"] = layout
+
+	with open(export_base + ".json", "w") as f:
+		json.dump(meta, f, indent=1, sort_keys=True)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_export_texture_array(img, layer, container, mipmaps, srgb, animation_name, export_path):
+	"""
+	Writes the frames (or one animation's frames) as the layers of a 2D
+	texture array, in a KTX2 file or a raw file with a small header (see
+	narly_sprite_lib/texarray.py). Each frame is written to its slice as
+	soon as it's composited, so only one frame is held in memory.
+	"""
+	if img.base_type != RGB:
+		gimp.message("Only RGB sprites can be exported as a texture array")
+		return
+
+	frames = get_frames(img)
+	if animation_name:
+		animation = find_animation(get_config(img)["animations"], animation_name)
+		if animation is None:
+			gimp.message("There's no animation named %s!" % animation_name)
+			return
+		frame_nums = set(get_animation_frame_nums(img, animation))
+		frames = [frame for frame in frames if get_frame_num(frame) in frame_nums]
+		# don't overwrite the texture array of all of the frames
+		if not export_path and img.filename:
+			export_path = "%s_%s" % (os.path.splitext(img.filename)[0], animation_name)
+	if len(frames) == 0:
+		return
+
+	export_base = get_export_base_path(img, export_path)
+	if export_base is None:
+		gimp.message("Save the image or set an output path to write the texture array")
+		return
+
+	ktx2 = container == TEXTURE_KTX2
+	writer = TextureArrayWriter(export_base + (".ktx2" if ktx2 else ".tex"), img.width, img.height,
+		len(frames), mipmaps, ktx2, srgb)
+
+	def write_frames():
+		for idx, frame in enumerate(frames):
+			writer.write_layer(idx, compositor.get_pixels(frame))
+			yield float(idx+1) / len(frames)
+
+	pdb.gimp_image_undo_freeze(img)
+	completed = False
+	try:
+		compositor = make_frame_compositor(img)
+		try:
+			completed = run_chunked(img, write_frames(), "Exporting texture array")
+		finally:
+			compositor.close()
+
+		# if we were in a valid frame, make that frame visible again
+		curr_frame_num = get_frame_num(layer)
+		if curr_frame_num is not None:
+			goto_frame(img, curr_frame_num)
+		pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		pdb.gimp_image_undo_thaw(img)
+		if completed:
+			writer.close()
+		else:
+			writer.abort()
@@ -0,0 +1,214 @@
+"""
+The steps of the Apply to All Frames pipeline. A pipeline is written as
+steps separated by ";", each a name followed by its arguments:
+
+	outline 1 #000000; shadow 2 2 #00000080; brightness 20
+
+The built-in steps (FILTER_STEPS) are numpy kernels that work on the raw
+RGBA pixels of a layer and keep its size, so anything they add outside of
+the layer is cut off. They run in a pool of worker processes, so nothing
+in here talks to gimp. Any other step is the name of a gimp procedure
+that's run on the layer with the rest of the arguments, eg
+
+	plug_in_gauss 2 2 0
+"""
+
+from narly_sprite_lib.palette import load_palette, load_color_variants
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def parse_rgba(value):
+	"""
+	@returns the (r, g, b, a) of a "#rrggbb" or "#rrggbbaa" color
+	"""
+	value = str(value).lstrip("#")
+	if len(value) not in (6, 8):
+		raise ValueError("bad color %r, expected #rrggbb or #rrggbbaa" % value)
+	if len(value) == 6:
+		value += "ff"
+	return tuple(int(value[i:i+2], 16) for i in xrange(0, 8, 2))
+
+def _parse_arg(value):
+	for parse in (int, float):
+		try:
+			return parse(value)
+		except ValueError:
+			pass
+	return value
+
+def _to_pixels(numpy, data, width, height):
+	return numpy.frombuffer(str(data), numpy.uint8).reshape(height, width, 4).astype(numpy.float32)
+
+def _from_pixels(numpy, pixels):
+	return (pixels + 0.5).clip(0, 255).astype(numpy.uint8).tostring()
+
+def _shift(numpy, mask, dx, dy):
+	"""
+	@returns the 2d array moved by (dx, dy), filled with zeros
+	"""
+	res = numpy.zeros_like(mask)
+	height, width = mask.shape
+	if abs(dx) >= width or abs(dy) >= height:
+		return res
+	res[max(dy, 0):height+min(dy, 0), max(dx, 0):width+min(dx, 0)] = \
+		mask[max(-dy, 0):height+min(-dy, 0), max(-dx, 0):width+min(-dx, 0)]
+	return res
+
+def _over(numpy, top, bottom):
+	"""
+	@returns the top pixels composited over the bottom ones
+	"""
+	top_a = top[..., 3:4] / 255.0
+	bottom_a = bottom[..., 3:4] / 255.0
+	out_a = top_a + bottom_a*(1.0 - top_a)
+	safe_a = numpy.where(out_a > 0, out_a, 1.0)
+	res = numpy.empty_like(top)
+	res[..., :3] = (top[..., :3]*top_a + bottom[..., :3]*bottom_a*(1.0 - top_a)) / safe_a
+	res[..., 3:4] = out_a * 255.0
+	return res
+
+def outline(numpy, pixels, width=1, color="#000000"):
+	"""
+	Draws a `width` pixel outline around the visible pixels
+	"""
+	color = parse_rgba(color)
+	solid = pixels[..., 3] > 0
+	grown = solid.copy()
+	for _ in xrange(width):
+		step = grown.copy()
+		for dx, dy in ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+			step |= _shift(numpy, grown, dx, dy)
+		grown = step
+
+	border = numpy.zeros_like(pixels)
+	border[grown] = color
+	return _over(numpy, pixels, border)
+
+def shadow(numpy, pixels, dx=2, dy=2, color="#00000080"):
+	"""
+	Puts a copy of the sprite's silhouette in `color` behind it, moved by
+	(dx, dy)
+	"""
+	color = parse_rgba(color)
+	silhouette = numpy.zeros_like(pixels)
+	silhouette[..., :3] = color[:3]
+	silhouette[..., 3] = _shift(numpy, pixels[..., 3], dx, dy) * (color[3] / 255.0)
+	return _over(numpy, pixels, silhouette)
+
+def brightness(numpy, pixels, amount):
+	"""
+	Adds amount (-255 - 255) to every color channel
+	"""
+	res = pixels.copy()
+	res[..., :3] += amount
+	return res
+
+def contrast(numpy, pixels, amount):
+	"""
+	Scales the color channels away from (or towards, for negative amounts)
+	the middle gray by amount percent
+	"""
+	res = pixels.copy()
+	res[..., :3] = (res[..., :3] - 128.0) * (1.0 + amount / 100.0) + 128.0
+	return res
+
+def palette(numpy, pixels, path):
+	"""
+	Replaces every color with the nearest color of a saved palette (see
+	palette.save_palette), keeping the alpha
+	"""
+	colors = numpy.array([color[:3] for color in load_palette(path)[1:]], numpy.float32)
+	if len(colors) == 0:
+		return pixels
+	res = pixels.copy()
+	flat = res.reshape(-1, 4)
+	# a row at a time, to bound the size of the distance matrix
+	for start in xrange(0, len(flat), pixels.shape[1]):
+		rgb = flat[start:start+pixels.shape[1], :3]
+		dist = ((rgb[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+		flat[start:start+pixels.shape[1], :3] = colors[dist.argmin(axis=1)]
+	return res
+
+def recolor(numpy, pixels, path, variant):
+	"""
+	Applies one of the lookup tables of a color variants file (see
+	palette.load_color_variants)
+	"""
+	luts = dict(load_color_variants(path))
+	if variant not in luts:
+		raise ValueError("%s has no variant named %s" % (path, variant))
+	res = pixels.copy()
+	visible = res[..., 3] > 0
+	for src, dest in luts[variant].iteritems():
+		match = visible & (pixels[..., 0] == src[0]) & (pixels[..., 1] == src[1]) & (pixels[..., 2] == src[2])
+		res[match, :3] = dest
+	return res
+
+# name -> (function, number of required arguments, max number of arguments)
+FILTER_STEPS = {
+	"outline": (outline, 0, 2),
+	"shadow": (shadow, 0, 3),
+	"brightness": (brightness, 1, 1),
+	"contrast": (contrast, 1, 1),
+	"palette": (palette, 1, 1),
+	"recolor": (recolor, 2, 2),
+}
+
+def parse_pipeline(text):
+	"""
+	@returns the steps of the pipeline, a list of (name, args, built in)
+	"""
+	res = []
+	for step in text.split(";"):
+		parts = step.split()
+		if len(parts) == 0:
+			continue
+		name = parts[0]
+		args = [_parse_arg(arg) for arg in parts[1:]]
+		builtin = name in FILTER_STEPS
+		if builtin:
+			_, min_args, max_args = FILTER_STEPS[name]
+			if not min_args <= len(args) <= max_args:
+				if min_args == max_args:
+					raise ValueError("%s takes %d arguments" % (name, min_args))
+				raise ValueError("%s takes %d - %d arguments" % (name, min_args, max_args))
+		res.append((name, args, builtin))
+	if len(res) == 0:
+		raise ValueError("the pipeline has no steps")
+	return res
+
+def group_steps(steps):
+	"""
+	Splits the pipeline into runs of consecutive steps that are all built
+	in (which can run in worker processes) or all gimp procedures.
+
+	@returns a list of (built in, [(name, args), ...])
+	"""
+	res = []
+	for name, args, builtin in steps:
+		if len(res) == 0 or res[-1][0] != builtin:
+			res.append((builtin, []))
+		res[-1][1].append((name, args))
+	return res
+
+def has_numpy():
+	return _import_numpy() is not None
+
+def run_filter_steps(job):
+	"""
+	Runs built-in steps on the pixels of a layer, job being (RGBA pixels,
+	width, height, [(name, args), ...]).
+
+	@returns the new RGBA pixels
+	"""
+	data, width, height, steps = job
+	numpy = _import_numpy()
+	pixels = _to_pixels(numpy, data, width, height)
+	for name, args in steps:
+		pixels = FILTER_STEPS[name][0](numpy, pixels, *args).clip(0, 255)
+	return _from_pixels(numpy, pixels)
@@ -0,0 +1,210 @@
+"""
+An on-disk cache of composited frames.
+
+Each cache file holds the composited pixels of up to `slot_count` frames
+of one image, every frame at a fixed offset in the file, and is accessed
+through mmap. Entries are keyed by a fingerprint of the frame's content
+(see get_frame_fingerprint in composite.py), so a frame that hasn't
+changed since it was last composited never has to be composited again.
+When all of the slots are in use the least recently used entry is
+replaced.
+
+Each file's size only depends on its image's size and frame_cache_max_mb,
+so it stays the same however many other images are open. The cache files
+of all images share CACHE_TOTAL_MAX_BYTES of disk space, and the least
+recently used files are deleted to stay under it (see prune_cache_dir).
+
+The index is only read when a cache is opened, so a cache file must only
+ever be open in one process. The export daemon's workers each keep their
+caches in a directory of their own (see batch.serve).
+
+file layout:
+
+	header		CACHE_HEADER
+	index		slot_count * CACHE_ENTRY
+	(padding up to a page boundary)
+	slots		slot_count * (width * height * bpp)
+"""
+
+import os
+import mmap
+import struct
+
+CACHE_MAGIC = "NSFC"
+CACHE_VERSION = 1
+
+# magic, version, reserved, width, height, bpp, slot count, access clock
+CACHE_HEADER = struct.Struct("<4sHHIIIIQ")
+
+# fingerprint (sha1 digest), last access
+CACHE_ENTRY = struct.Struct("<20sQ")
+
+EMPTY_FINGERPRINT = "\x00" * 20
+
+CACHE_SUFFIX = ".cache"
+
+# how much all of the cache files together may take up
+CACHE_TOTAL_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+class FrameCache(object):
+	def __init__(self, path, width, height, bpp, slot_count):
+		self.path = path
+		self.width = width
+		self.height = height
+		self.bpp = bpp
+		self.slot_count = slot_count
+		self.slot_size = width * height * bpp
+
+		index_end = CACHE_HEADER.size + slot_count*CACHE_ENTRY.size
+		self.data_start = (index_end + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+		file_size = self.data_start + slot_count*self.slot_size
+
+		if not self._is_compatible(file_size):
+			self._create(file_size)
+
+		self._file = open(path, "r+b")
+		self._map = mmap.mmap(self._file.fileno(), file_size)
+		# the modification time is when the cache was last used, for
+		# prune_cache_dir
+		os.utime(path, None)
+
+		self._clock = CACHE_HEADER.unpack_from(self._map, 0)[7]
+		self._slots = {}
+		self._last_used = []
+		for slot in xrange(slot_count):
+			fingerprint, last_used = CACHE_ENTRY.unpack_from(self._map, self._entry_offset(slot))
+			if fingerprint != EMPTY_FINGERPRINT:
+				self._slots[fingerprint] = slot
+			self._last_used.append(last_used)
+
+	def _is_compatible(self, file_size):
+		if not os.path.exists(self.path) or os.path.getsize(self.path) != file_size:
+			return False
+		with open(self.path, "rb") as f:
+			header = f.read(CACHE_HEADER.size)
+		if len(header) != CACHE_HEADER.size:
+			return False
+		magic, version, _, width, height, bpp, slot_count, _ = CACHE_HEADER.unpack(header)
+		return (magic, version, width, height, bpp, slot_count) == \
+			(CACHE_MAGIC, CACHE_VERSION, self.width, self.height, self.bpp, self.slot_count)
+
+	def _create(self, file_size):
+		with open(self.path, "wb") as f:
+			f.write(CACHE_HEADER.pack(
+				CACHE_MAGIC,
+				CACHE_VERSION,
+				0,	# reserved
+				self.width,
+				self.height,
+				self.bpp,
+				self.slot_count,
+				0,	# access clock
+			))
+			f.write(CACHE_ENTRY.pack(EMPTY_FINGERPRINT, 0) * self.slot_count)
+			# leave the slots sparse until something is written to them
+			f.truncate(file_size)
+
+	def _entry_offset(self, slot):
+		return CACHE_HEADER.size + slot*CACHE_ENTRY.size
+
+	def _slot_offset(self, slot):
+		return self.data_start + slot*self.slot_size
+
+	def _touch(self, slot, fingerprint):
+		self._clock += 1
+		self._last_used[slot] = self._clock
+		CACHE_ENTRY.pack_into(self._map, self._entry_offset(slot), fingerprint, self._clock)
+
+	def get(self, fingerprint):
+		"""
+		@returns the cached pixels for the fingerprint, or None
+		"""
+		slot = self._slots.get(fingerprint)
+		if slot is None:
+			return None
+		self._touch(slot, fingerprint)
+		offset = self._slot_offset(slot)
+		return self._map[offset:offset+self.slot_size]
+
+	def put(self, fingerprint, data):
+		if len(data) != self.slot_size:
+			raise ValueError("frame is %d bytes, cache slots are %d" % (len(data), self.slot_size))
+
+		slot = self._slots.get(fingerprint)
+		if slot is None:
+			# evict the least recently used entry (empty slots are never used)
+			slot = min(xrange(self.slot_count), key=self._last_used.__getitem__)
+			old_fingerprint = CACHE_ENTRY.unpack_from(self._map, self._entry_offset(slot))[0]
+			self._slots.pop(old_fingerprint, None)
+
+		# invalidate the entry while its pixels are being replaced, so a crash
+		# half way through can't leave a valid entry pointing at bad data
+		CACHE_ENTRY.pack_into(self._map, self._entry_offset(slot), EMPTY_FINGERPRINT, 0)
+		offset = self._slot_offset(slot)
+		self._map[offset:offset+self.slot_size] = data
+		self._touch(slot, fingerprint)
+		self._slots[fingerprint] = slot
+
+	def close(self):
+		if self._map is None:
+			return
+		header = list(CACHE_HEADER.unpack_from(self._map, 0))
+		header[7] = self._clock
+		CACHE_HEADER.pack_into(self._map, 0, *header)
+		self._map.close()
+		self._file.close()
+		self._map = None
+		os.utime(self.path, None)
+
+def open_frame_cache(path, width, height, bpp, max_bytes):
+	"""
+	@returns a FrameCache that uses at most max_bytes for frame data, or
+	None if not even a single frame fits in that budget
+	"""
+	slot_count = max_bytes // (width * height * bpp)
+	if slot_count < 1:
+		return None
+
+	cache_dir = os.path.dirname(path)
+	if cache_dir and not os.path.isdir(cache_dir):
+		os.makedirs(cache_dir)
+	return FrameCache(path, width, height, bpp, slot_count)
+
+def _get_disk_size(path):
+	"""
+	@returns how much disk space the file takes up, which for the sparse
+	cache files is usually much less than their size
+	"""
+	stat = os.stat(path)
+	if hasattr(stat, "st_blocks"):
+		return stat.st_blocks * 512
+	return stat.st_size
+
+def prune_cache_dir(cache_dir, keep, max_bytes):
+	"""
+	Deletes the least recently used cache files in cache_dir (and its sub
+	directories) until the ones that are left, besides the keep file, take
+	up no more than max_bytes of disk.
+	"""
+	files = []
+	for dir_path, _, names in os.walk(cache_dir):
+		for name in names:
+			path = os.path.join(dir_path, name)
+			if not name.endswith(CACHE_SUFFIX) or os.path.abspath(path) == os.path.abspath(keep):
+				continue
+			try:
+				files.append((os.path.getmtime(path), _get_disk_size(path), path))
+			except OSError:
+				# deleted by another gimp in the meantime
+				pass
+
+	total = sum(size for _, size, _ in files)
+	for _, size, path in sorted(files):
+		if total <= max_bytes:
+			break
+		try:
+			# a process that has the file mapped keeps its pages
+			os.remove(path)
+		except OSError:
+			pass
+		total -= size
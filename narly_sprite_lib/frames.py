@@ -0,0 +1,794 @@
+"""
+The procedures that edit frames and layer tracks.
+"""
+
+from gimpfu import *
+
+from narly_sprite_lib.constants import *
+from narly_sprite_lib.core import *
+from narly_sprite_lib.composite import get_covered_tiles, get_tiled_alpha_bounds
+from narly_sprite_lib.sheet import to_rgba
+
+def narly_sprite_toggle_visibility_all_current_layer(img, layer):
+	"""
+	Hides or shows the current layer's track in all frames.
+	"""
+	track_layers = get_track_layers(img, layer)
+
+	# can't perform this operation if a frame layer isn't currently selected
+	# (reading minds will be implemented in v 9.0)
+	if track_layers is None:
+		return
+
+	# don't store these actions in the undo history
+	batch = PropertyBatch(img, BATCH_UNDO_FREEZE)
+
+	# toggle the visibility - this is what we'll set all of the other
+	# frames to as well
+	visible = not layer.visible
+	for track_layer in track_layers:
+		batch.set(track_layer, "visible", visible)
+
+	# make sure we keep the currently selected layer the active one (not sure if
+	# toggling the visibility on other layers changes that)
+	batch.set_active(layer)
+
+	batch.apply()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_set_track_opacity(img, layer, opacity):
+	"""
+	Sets the opacity of the current layer's track in all frames.
+	"""
+	track_layers = get_track_layers(img, layer)
+	if track_layers is not None:
+		batch = PropertyBatch(img, BATCH_UNDO_GROUP)
+		for track_layer in track_layers:
+			batch.set(track_layer, "opacity", opacity)
+		batch.apply()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_delete_track(img, layer):
+	"""
+	Deletes the current layer's track from all frames.
+	"""
+	if get_frame_num(layer) is None or is_frame_root(layer):
+		return
+
+	pdb.gimp_undo_push_group_start(img)
+	track_name = get_track_name(layer)
+	index = LayerTrackIndex.load(img)
+	for track_layer in index.get_layers(track_name):
+		pdb.gimp_image_remove_layer(img, track_layer)
+	index.remove_track(track_name)
+	index.save()
+	pdb.gimp_undo_push_group_end(img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_reorder_track(img, layer, position):
+	"""
+	Moves the current layer's track to the same position (0 = top) in all
+	frames.
+	"""
+	pdb.gimp_undo_push_group_start(img)
+	track_layers = get_track_layers(img, layer)
+	if track_layers is not None:
+		for track_layer in track_layers:
+			# gimp clamps the position to the number of layers in the frame
+			pdb.gimp_image_reorder_item(img, track_layer, track_layer.parent, position)
+	pdb.gimp_undo_push_group_end(img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_set_track(img, layer, track_name):
+	"""
+	Puts the current layer in the named track, regardless of the layer's
+	name. A blank name puts it back in the track of its layer name.
+	"""
+	if get_frame_num(layer) is None or is_frame_root(layer):
+		return
+
+	pdb.gimp_undo_push_group_start(img)
+	set_track_name(layer, track_name)
+	index = get_track_index(img)
+	if index is not None:
+		index.rebuild()
+		index.save()
+	pdb.gimp_undo_push_group_end(img)
+
+def narly_sprite_restore_checkpoint(img, layer):
+	if not restore_checkpoint(img):
+		gimp.message("There's no checkpoint to restore!")
+		return
+
+	goto_frame(img, 0)
+	gimp.displays_flush()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_duplicate_frames(img, layer, start_frame, end_frame, new_frames_insert_method, undo_mode=UNDO_FULL):
+	"""
+	Duplicate frames in the range [start_frame, end_frame] (inclusive of both start and end),
+	optionally appending the frames to the end of the frames list instead of inserting
+	after the end_frame.
+
+	A negative value for end_frame indicates that ALL frames after the start frame are to be
+	duplicated
+	"""
+	if start_frame > end_frame and end_frame >= 0:
+		gimp.message("Start frame must be <= end frame!")
+		return
+	elif start_frame < 0:
+		gimp.message("Start frame value must be >= 0!")
+		return
+	elif end_frame > get_last_frame_num(img):
+		gimp.message("End frame number exceeds current frames!")
+	
+	if end_frame < 0:
+		end_frame = get_last_frame_num(img)
+	
+	end_frame_layer = get_frame_by_number(img, end_frame)
+	dest_frame_idx = 0
+	dest_frame_pos = 0
+	if new_frames_insert_method == INSERT:
+		dest_frame_idx = end_frame + 1
+		dest_frame_pos = pdb.gimp_image_get_layer_position(img, end_frame_layer) + 1
+	elif new_frames_insert_method == APPEND:
+		dest_frame_idx = get_last_frame_num(img) + 1
+		dest_frame_pos = get_last_frame_position(img) + 1
+	else:
+		gimp.message("ERROR! Could not determine destination frame idx!")
+		return
+
+	index = get_track_index(img)
+
+	def duplicate_frames(dest_frame_idx, dest_frame_pos):
+		curr_frame_idx = start_frame
+		while curr_frame_idx <= end_frame:
+			frame = get_frame_by_number(img, curr_frame_idx)
+
+			shift_frames_down(img, dest_frame_idx)
+
+			new_frame_root = pdb.gimp_layer_group_new(img)
+			new_frame_root.name = make_frame_name(dest_frame_idx)
+			pdb.gimp_image_insert_layer(img, new_frame_root, None, dest_frame_pos)
+
+			for child_layer in frame.children:
+				new_layer = child_layer.copy()
+				new_layer.name = child_layer.name
+				pdb.gimp_image_insert_layer(img, new_layer, new_frame_root, len(new_frame_root.children))
+
+			if index is not None:
+				index.add_frame(new_frame_root)
+
+			dest_frame_pos += 1
+			dest_frame_idx += 1
+			curr_frame_idx += 1
+
+			yield float(curr_frame_idx - start_frame) / (end_frame - start_frame + 1)
+
+	# a cancel aborts the bulk edit, anything else ends it (even an error
+	# part way through)
+	cancelled = [False]
+	def on_cancel():
+		cancelled[0] = True
+		abort_bulk_edit(img, undo_mode)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		if run_chunked(img, duplicate_frames(dest_frame_idx, dest_frame_pos), "Duplicating frames", on_cancel):
+			if index is not None:
+				index.save()
+	finally:
+		if not cancelled[0]:
+			end_bulk_edit(img, undo_mode)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_complete_circular_animation(img, layer, horizontal_flip, vertical_flip, include_first, undo_mode=UNDO_FULL):
+	"""
+	Completes the rest of the circular animation by creating new frames
+	from the previous frames in reverse order. Options specify whether
+	the frames should be flipped horizontally, vertically, or both. Should
+	also have an option to include the first frame or not
+
+	Eg (if flip horizontally is selected, and include first frame is not
+	selected):
+
+	Frame 0
+	Frame 1
+	Frame 2
+	Frame 3
+	Frame 4
+	Frame 5 (Frame 3 flipped horizontally)
+	Frame 6 (Frame 2 flipped horizontally)
+	Frame 7 (Frame 1 flipped horizontally)
+	"""
+	last_frame_num = get_last_frame_num(img)
+	last_frame_pos = get_last_frame_position(img)
+	frame_counts = 0
+	index = get_track_index(img)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		# iterate the frames IN REVERSE ORDER
+		for idx in xrange(last_frame_num, -1, -1):
+			if idx == 0 and not include_first:
+				continue
+			# don't repeat the middle frame
+			if idx == last_frame_num:
+				continue
+
+			frame = get_frame_by_number(img, idx)
+			frame_counts += 1
+
+			new_frame_root = pdb.gimp_layer_group_new(img)
+			new_frame_root.name = make_frame_name(last_frame_num + frame_counts)
+			pdb.gimp_image_insert_layer(img, new_frame_root, None, last_frame_pos + frame_counts)
+
+			for frame_layer in frame.children:
+				new_layer = frame_layer.copy()
+				new_layer.name = frame_layer.name
+				pdb.gimp_image_insert_layer(img, new_layer, new_frame_root, len(new_frame_root.children))
+
+				continue
+				print str(horizontal_flip)
+				if horizontal_flip:
+					pdb.gimp_item_transform_flip_simple(
+						new_layer,
+						0, # horizontal
+						True, # automatically center it in the middle
+						0 # FLOAT coord of flip axis
+					)
+			
+				if vertical_flip:
+					pdb.gimp_item_transform_flip_simple(
+						new_layer,
+						1, # vertical
+						True, # automatically center it in the middle
+						0 # FLOAT coord of flip axis
+					)
+
+			if horizontal_flip:
+				pdb.gimp_item_transform_flip_simple(
+					new_frame_root,
+					0, # horizontal
+					True, # automatically center it in the middle
+					0 # FLOAT coord of flip axis
+				)
+
+			if vertical_flip:
+				pdb.gimp_item_transform_flip_simple(
+					new_frame_root,
+					1, # vertical
+					True, # automatically center it in the middle
+					0 # FLOAT coord of flip axis
+				)
+
+			if index is not None:
+				index.add_frame(new_frame_root)
+
+		if index is not None:
+			index.save()
+	finally:
+		end_bulk_edit(img, undo_mode)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_copy_layer_to_all_frames(img, layer, undo_mode=UNDO_FULL):
+	"""
+	Copies the current layer to all frames. If the current layer is in a
+	frame, it will try to copy it to the same position. Otherwise, it
+	is added at the last position.
+	"""
+	dont_copy_to = get_frame_num(layer)
+	frame_pos = -1
+	if dont_copy_to is not None:
+		frame_pos = pdb.gimp_image_get_layer_position(img, layer)
+
+	frames = get_frames(img)
+	index = get_track_index(img)
+
+	def copy_to_frames():
+		curr_count = 0
+		for frame in frames:
+			curr_count += 1
+			frame_num = get_frame_num(frame)
+			if frame_num == dont_copy_to:
+				continue
+			copied_layer = layer.copy()
+			copied_layer.name = layer.name
+			pos_to_insert_at = frame_pos if frame_pos != -1 else len(frame.children)
+			pdb.gimp_image_insert_layer(img, copied_layer, frame, pos_to_insert_at)
+			if index is not None:
+				index.add_layer(copied_layer)
+
+			yield float(curr_count) / len(frames)
+
+	# a cancel aborts the bulk edit, anything else ends it (even an error
+	# part way through)
+	cancelled = [False]
+	def on_cancel():
+		cancelled[0] = True
+		abort_bulk_edit(img, undo_mode)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		if not run_chunked(img, copy_to_frames(), "Copying layer to all frames", on_cancel):
+			return
+
+		if index is not None:
+			index.save()
+
+		# restore focus back to the original layer
+		pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		if not cancelled[0]:
+			end_bulk_edit(img, undo_mode)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# how many track layers are filtered at once (per worker), bounding how
+# many layers' pixels are held in memory
+FILTER_CHUNK_PER_WORKER = 4
+
+def _read_rgba(layer):
+	rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)
+	return to_rgba(rgn[0:layer.width, 0:layer.height], layer.bpp)
+
+def _write_rgba(layer, data):
+	# through the shadow tiles, so the change is undoable
+	rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height, True, True)
+	rgn[0:layer.width, 0:layer.height] = data
+	layer.flush()
+	layer.merge_shadow(True)
+	layer.update(0, 0, layer.width, layer.height)
+
+def narly_sprite_apply_to_all_frames(img, layer, steps, workers, undo_mode=UNDO_FULL):
+	"""
+	Runs a pipeline of filter steps (see narly_sprite_lib/filters.py) over
+	the current layer's track in every frame. The built-in steps of a
+	chunk of layers run in a pool of workers, gimp procedures run on one
+	layer after the other.
+	"""
+	# only imported here, so frame navigation doesn't pay for
+	# multiprocessing and the filters
+	from narly_sprite_lib.sequence import get_worker_count, make_worker_pool
+	from narly_sprite_lib.filters import parse_pipeline, group_steps, has_numpy, run_filter_steps
+
+	if img.base_type != RGB:
+		gimp.message("Filters can only be applied to RGB sprites!")
+		return
+
+	track_layers = get_track_layers(img, layer)
+	if track_layers is None:
+		gimp.message("Select a layer inside of a frame first!")
+		return
+
+	try:
+		pipeline = parse_pipeline(steps)
+	except ValueError as e:
+		gimp.message("Bad filter pipeline: %s" % e)
+		return
+	for name, _, builtin in pipeline:
+		if not builtin and not pdb.gimp_procedural_db_proc_exists(name):
+			gimp.message("There's no filter step or gimp procedure named %s" % name)
+			return
+	runs = group_steps(pipeline)
+	parallel = any(builtin for builtin, _ in runs)
+	if parallel and not has_numpy():
+		gimp.message("The built-in filter steps need numpy")
+		return
+	# catch bad arguments (colors, missing files) before touching any layer
+	try:
+		for builtin, run in runs:
+			if builtin:
+				run_filter_steps(("\x00" * 4, 1, 1, run))
+	except (IOError, ValueError, KeyError, TypeError) as e:
+		gimp.message("Bad filter pipeline: %s" % e)
+		return
+
+	workers = get_worker_count(workers)
+	chunk_size = FILTER_CHUNK_PER_WORKER * workers
+
+	def filter_layers():
+		pool = None
+		if parallel and workers > 1:
+			pool = make_worker_pool(workers)
+		try:
+			curr_count = 0
+			for start in xrange(0, len(track_layers), chunk_size):
+				chunk = track_layers[start:start+chunk_size]
+				for track_layer in chunk:
+					if not track_layer.has_alpha:
+						pdb.gimp_layer_add_alpha(track_layer)
+
+				for builtin, run in runs:
+					if builtin:
+						jobs = [(_read_rgba(l), l.width, l.height, run) for l in chunk]
+						results = pool.map(run_filter_steps, jobs) if pool is not None else map(run_filter_steps, jobs)
+						for track_layer, data in zip(chunk, results):
+							_write_rgba(track_layer, data)
+					else:
+						for track_layer in chunk:
+							for name, args in run:
+								getattr(pdb, name)(img, track_layer, *args)
+
+				curr_count += len(chunk)
+				yield float(curr_count) / len(track_layers)
+		finally:
+			if pool is not None:
+				pool.terminate()
+
+	# a cancel aborts the bulk edit, anything else ends it (even a gimp
+	# procedure step failing part way through)
+	cancelled = [False]
+	def on_cancel():
+		cancelled[0] = True
+		abort_bulk_edit(img, undo_mode)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		if not run_chunked(img, filter_layers(), "Applying filters to all frames", on_cancel):
+			return
+
+		pdb.gimp_image_set_active_layer(img, layer)
+	finally:
+		if not cancelled[0]:
+			end_bulk_edit(img, undo_mode)
+	gimp.displays_flush()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_delete_frame(img, layer):
+	curr_frame_num = get_frame_num(layer)
+	if curr_frame_num is None:
+		return
+	
+	curr_frame_pos = 0
+	if not is_frame_root(layer):
+		curr_frame_pos = pdb.gimp_image_get_layer_position(img, layer)
+	
+	pdb.gimp_undo_push_group_start(img)
+
+	frame_root = get_frame_root(layer)
+	index = get_track_index(img)
+	if index is not None:
+		index.remove_frame(frame_root)
+		index.save()
+	pdb.gimp_image_remove_layer(img, frame_root)
+	shift_frames_up(img, curr_frame_num+1)
+	pdb.gimp_image_undo_freeze(img)
+	if not goto_frame(img, curr_frame_num, curr_frame_pos):
+		goto_frame(img, curr_frame_num-1, curr_frame_pos)
+	pdb.gimp_image_undo_thaw(img)
+
+	pdb.gimp_undo_push_group_end(img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_new_frame(img, layer):
+	last_frame_num = get_last_frame_num(img)
+	curr_frame_num = get_frame_num(layer)
+	if curr_frame_num == -1:
+		frame_num_to_copy = last_frame_num
+	else:
+		frame_num_to_copy = curr_frame_num
+	
+	config = get_config(img)
+
+	# means that we're currently in a valid frame, so
+	# insert a new frame after this one, copying all the layers
+	# and shifting all the subsequent frames down
+	if frame_num_to_copy is not None:
+		pdb.gimp_undo_push_group_start(img)
+
+		frame_root = get_frame_by_number(img, frame_num_to_copy)
+		curr_frame_position = pdb.gimp_image_get_layer_position(img, frame_root)
+
+		new_frame_num = frame_num_to_copy+1
+		new_frame_pos = curr_frame_position+1
+
+		# shift down any frames after the current one so we leave an
+		# opening for the new frame
+		shift_frames_down(img, new_frame_num)
+
+		# make the new frame's folder and add it to the image
+		new_frame_root = pdb.gimp_layer_group_new(img)
+		new_frame_root.name = make_frame_name(new_frame_num)
+		pdb.gimp_image_insert_layer(img, new_frame_root, None, new_frame_pos)
+
+		# copy any layers in the current frame to the
+		# new frame
+		for frame_layer in frame_root.children:
+			new_layer = None
+			if config["new_frame_copy_image_data"]:
+				new_layer = frame_layer.copy()
+				new_layer.name = frame_layer.name
+			else:
+				new_layer = copy_layer_no_data(img, frame_layer)
+			pdb.gimp_image_insert_layer(img, new_layer, new_frame_root, len(new_frame_root.children))
+			if config["compact_new_frames"] and config["new_frame_copy_image_data"]:
+				compact_layer(new_layer, keep_empty=True)
+
+		index = get_track_index(img)
+		if index is not None:
+			index.add_frame(new_frame_root)
+			index.save()
+
+		curr_pos_in_frame = 0
+		if not is_frame_root(layer) and curr_frame_num is not None:
+			curr_pos_in_frame = pdb.gimp_image_get_layer_position(img, layer)
+
+		goto_frame(img, new_frame_num, curr_pos_in_frame)
+
+		pdb.gimp_undo_push_group_end(img)
+
+		if config["always_show_prev_frame"] or config["show_prev_frame_on_new"]:
+			frame_root.opacity = config["prev_frame_alpha"]
+			frame_root.visible = True
+
+		return
+	
+	pdb.gimp_undo_push_group_start(img)
+
+	# making it here means that we're not currently in a valid frame, so
+	# just make the frame folder, add a frame layer, and be done with it
+	# (it automatically adds the frame at the end)
+	last_frame_num = get_last_frame_num(img)
+	new_frame_root = pdb.gimp_layer_group_new(img)
+	new_frame_root.name = make_frame_name(last_frame_num+1)
+	pdb.gimp_image_insert_layer(img, new_frame_root, None, get_last_frame_position(img)+1)
+
+	# add a blank new layer
+	blank_layer = pdb.gimp_layer_new(
+		img,
+		img.width,
+		img.height,
+		img.base_type*2+1,	# RBGA_IMAGE,etc - always include the alpha TODO: change this?
+		"Layer 1",	# layer name
+		100,	# opacity
+		NORMAL_MODE	# layer combination mode
+	)
+	pdb.gimp_image_insert_layer(img, blank_layer, new_frame_root, 0)
+
+	index = get_track_index(img)
+	if index is not None:
+		index.add_frame(new_frame_root)
+		index.save()
+
+	pdb.gimp_image_undo_freeze(img)
+	goto_frame(img, last_frame_num+1)
+	pdb.gimp_image_undo_thaw(img)
+
+	pdb.gimp_undo_push_group_end(img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def get_min_max_coords(layer):
+	"""
+	Finds the non-transparent pixels of the layer (or frame folder) on
+	gimp's tile grid, so only a tile at a time is read, and tiles that no
+	layer overlaps are skipped without reading them.
+
+	@returns (min_x, min_y, max_x, max_y) in image coordinates, or None if
+	the layer is completely transparent
+	"""
+	covered = None
+	if pdb.gimp_item_is_group(layer):
+		x, y = layer.offsets
+		covered = get_covered_tiles(layer.children, x, y, layer.width, layer.height)
+		if len(covered) == 0:
+			return None
+
+	bounds = get_tiled_alpha_bounds(layer, covered)
+	if bounds is None:
+		return None
+
+	offset_x, offset_y = layer.offsets
+	min_x, min_y, max_x, max_y = bounds
+	return (min_x+offset_x, min_y+offset_y, max_x+offset_x, max_y+offset_y)
+
+def narly_sprite_trim(img, layer):
+	# [min_x, min_y, max_x, max_y]
+	bounds = [img.width, img.height, -1, -1]
+
+	frames = get_frames(img)
+
+	def scan_frames():
+		curr_count = 0
+		for frame in frames:
+			frame_bounds = get_min_max_coords(frame)
+			curr_count += 1
+			if frame_bounds is None:
+				yield float(curr_count)/ len(frames)
+				continue
+
+			fminx,fminy,fmaxx,fmaxy = frame_bounds
+			if fminx < bounds[0]:
+				bounds[0] = fminx
+			if fminy < bounds[1]:
+				bounds[1] = fminy
+			if fmaxx > bounds[2]:
+				bounds[2] = fmaxx
+			if fmaxy > bounds[3]:
+				bounds[3] = fmaxy
+
+			yield float(curr_count)/ len(frames)
+
+	if not run_chunked(img, scan_frames(), "Finding sprite bounds"):
+		return
+
+	# layers can stick out of the image
+	min_x = max(bounds[0], 0)
+	min_y = max(bounds[1], 0)
+	max_x = min(bounds[2], img.width-1)
+	max_y = min(bounds[3], img.height-1)
+	# every frame is empty
+	if max_x < min_x or max_y < min_y:
+		return
+
+	pdb.gimp_undo_push_group_start(img)
+
+	pdb.gimp_image_crop(img, max_x - min_x+1, max_y - min_y+1, min_x, min_y)
+
+	pdb.gimp_undo_push_group_end(img)
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def compact_layer(layer, keep_empty=False):
+	"""
+	Crops the layer to its non-transparent pixels, leaving them where they
+	are in the image, or to a single transparent pixel if it has none
+	(unless keep_empty is set, so there's still room to paint on it), so
+	gimp doesn't keep (and save) tiles of nothing. Groups are compacted a
+	child at a time.
+
+	@returns how many bytes of pixels that freed
+	"""
+	if pdb.gimp_item_is_group(layer):
+		return sum(compact_layer(child, keep_empty) for child in layer.children)
+	if not layer.has_alpha:
+		return 0
+
+	bounds = get_tiled_alpha_bounds(layer)
+	if bounds is None and keep_empty:
+		return 0
+	if bounds is None:
+		min_x, min_y, max_x, max_y = 0, 0, 0, 0
+	else:
+		min_x, min_y, max_x, max_y = bounds
+	width = max_x - min_x + 1
+	height = max_y - min_y + 1
+	freed = (layer.width*layer.height - width*height) * layer.bpp
+	if freed <= 0:
+		return 0
+
+	# the negative offsets keep the content in place in the image
+	pdb.gimp_layer_resize(layer, width, height, -min_x, -min_y)
+	return freed
+
+def narly_sprite_compact_frames(img, layer, undo_mode=UNDO_FULL):
+	"""
+	Crops every layer of every frame to its non-transparent pixels (see
+	compact_layer). Layers have to be grown again (Layer > Layer to Image
+	Size) to paint outside of their new bounds.
+	"""
+	frames = get_frames(img)
+	freed = [0]
+
+	def compact_frames():
+		curr_count = 0
+		for frame in frames:
+			curr_count += 1
+			freed[0] += compact_layer(frame)
+			yield float(curr_count) / len(frames)
+
+	# a cancel aborts the bulk edit, anything else ends it (even an error
+	# part way through)
+	cancelled = [False]
+	def on_cancel():
+		cancelled[0] = True
+		abort_bulk_edit(img, undo_mode)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		if not run_chunked(img, compact_frames(), "Compacting frame layers", on_cancel):
+			return
+	finally:
+		if not cancelled[0]:
+			end_bulk_edit(img, undo_mode)
+
+	gimp.message("Freed %.1fMB of frame layer pixels" % (freed[0] / (1024.0*1024.0)))
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_prev_frame(img, layer):
+	curr_frame_num = get_frame_num(layer)
+	if curr_frame_num is None:
+		return
+	
+	# don't know what's happening here
+	if curr_frame_num < 0:
+		return
+	
+	curr_pos_in_frame = 0
+	if not is_frame_root(layer):
+		curr_pos_in_frame = pdb.gimp_image_get_layer_position(img, layer)
+
+	batch = PropertyBatch(img, BATCH_UNDO_FREEZE)
+	goto_frame(img, curr_frame_num-1, curr_pos_in_frame, batch=batch)
+
+	config = get_config(img)
+	if curr_frame_num > 2 and config["always_show_prev_frame"]:
+		make_frame_visible(img, curr_frame_num-2, config["prev_frame_alpha"], batch)
+	batch.apply()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_next_frame(img, layer):
+	curr_frame_num = get_frame_num(layer)
+	if curr_frame_num is None:
+		return
+	
+	last_frame_num = get_last_frame_num(img)
+
+	# don't know what the heck is going on here
+	if curr_frame_num > last_frame_num:
+		return
+	
+	curr_pos_in_frame = 0
+	if not is_frame_root(layer):
+		curr_pos_in_frame = pdb.gimp_image_get_layer_position(img, layer)
+	
+	batch = PropertyBatch(img, BATCH_UNDO_FREEZE)
+	goto_frame(img, curr_frame_num+1, curr_pos_in_frame, batch=batch)
+
+	config = get_config(img)
+	if config["always_show_prev_frame"]:
+		make_frame_visible(img, curr_frame_num, config["prev_frame_alpha"], batch)
+	batch.apply()
+	
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_create(width, height, image_type):
+	img = gimp.Image(width, height, image_type)
+
+	narly_sprite_new_frame(img, None)
+
+	gimp.Display(img)
+	gimp.displays_flush()
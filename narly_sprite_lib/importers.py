@@ -0,0 +1,297 @@
+"""
+The import procedures: slicing sprite sheets and importing image
+sequences or gifs as frames.
+"""
+
+from gimpfu import *
+import os
+import glob
+
+from narly_sprite_lib.constants import *
+from narly_sprite_lib.core import *
+from narly_sprite_lib.composite import *
+from narly_sprite_lib.sheet import *
+from narly_sprite_lib.sequence import natural_sort_key, decode_frame, get_worker_count, make_worker_pool
+
+def get_alpha_profiles(layer):
+	"""
+	@returns (cols, rows) - whether each column and each row of the layer
+	has any pixels that aren't fully transparent
+	"""
+	cols = [False] * layer.width
+	rows = []
+	rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)
+	strip_height = gimp.tile_height()
+	for y in xrange(0, layer.height, strip_height):
+		curr_height = min(strip_height, layer.height - y)
+		strip = rgn[0:layer.width, y:y+curr_height]
+		strip_cols, strip_rows = alpha_profile_strip(strip, layer.width, curr_height, layer.bpp)
+		cols = [a or b for a, b in zip(cols, strip_cols)]
+		rows.extend(strip_rows)
+	return cols, rows
+
+def add_frame_from_pixels(img, frame_num, width, height, data):
+	"""
+	Appends a new frame folder with a single layer holding the raw pixels
+	to the image. The frame number isn't checked against existing frames.
+	"""
+	frame_root = pdb.gimp_layer_group_new(img)
+	frame_root.name = make_frame_name(frame_num)
+	pdb.gimp_image_insert_layer(img, frame_root, None, len(img.layers))
+	new_layer_from_pixels(img, "Layer 1", width, height, data, parent=frame_root)
+	return frame_root
+
+def narly_sprite_import_sprite_sheet(img, layer, cell_width, cell_height, min_gutter):
+	"""
+	Slices the current layer (a sprite sheet) into the frames of a new
+	sprite. Cells are read left to right, top to bottom, and empty cells
+	at the end of the sheet are dropped.
+
+	If the cell width or height is 0, the cells are found from the fully
+	transparent gutters between them.
+	"""
+	if not layer.has_alpha:
+		gimp.message("The sprite sheet layer needs an alpha channel!")
+		return
+
+	if cell_width > 0 and cell_height > 0:
+		cols = [(x, cell_width) for x in xrange(0, layer.width - cell_width + 1, cell_width)]
+		rows = [(y, cell_height) for y in xrange(0, layer.height - cell_height + 1, cell_height)]
+	else:
+		col_profile, row_profile = get_alpha_profiles(layer)
+		cols = find_gutter_cells(col_profile, min_gutter)
+		rows = find_gutter_cells(row_profile, min_gutter)
+
+	if len(cols) == 0 or len(rows) == 0:
+		gimp.message("Couldn't find any frames in the sprite sheet!")
+		return
+
+	frame_width = max(size for _, size in cols)
+	frame_height = max(size for _, size in rows)
+
+	new_img = gimp.Image(frame_width, frame_height, img.base_type)
+	pdb.gimp_image_undo_disable(new_img)
+	if img.base_type == INDEXED:
+		num_bytes, colormap = pdb.gimp_image_get_colormap(img)
+		pdb.gimp_image_set_colormap(new_img, num_bytes, colormap)
+
+	rgn = layer.get_pixel_rgn(0, 0, layer.width, layer.height, False, False)
+	bpp = layer.bpp
+
+	def import_cells():
+		frame_num = 0
+		# empty cells wait here until a cell with something in it shows up,
+		# so the empty cells at the end of the sheet never become frames
+		empty_cells = 0
+		num_cells = len(cols) * len(rows)
+		curr_count = 0
+		for y, height in rows:
+			for x, width in cols:
+				data = rgn[x:x+width, y:y+height]
+				curr_count += 1
+
+				if data[bpp-1::bpp].strip("\x00") == "":
+					empty_cells += 1
+					yield float(curr_count) / num_cells
+					continue
+
+				for i in xrange(empty_cells):
+					add_frame_from_pixels(new_img, frame_num, frame_width, frame_height, "\x00" * (frame_width*frame_height*bpp))
+					frame_num += 1
+				empty_cells = 0
+
+				# cells smaller than the frame go in the top left corner
+				if (width, height) != (frame_width, frame_height):
+					frame_data = bytearray(frame_width * frame_height * bpp)
+					blit_frame(frame_data, frame_width, data, width, height, 0, 0, 0, bpp)
+					data = frame_data
+				add_frame_from_pixels(new_img, frame_num, frame_width, frame_height, data)
+				frame_num += 1
+
+				yield float(curr_count) / num_cells
+
+	if not run_chunked(img, import_cells(), "Importing sprite sheet"):
+		pdb.gimp_image_delete(new_img)
+		return
+
+	if len(new_img.layers) == 0:
+		gimp.message("Couldn't find any frames in the sprite sheet!")
+		pdb.gimp_image_delete(new_img)
+		return
+
+	goto_frame(new_img, 0)
+	pdb.gimp_image_undo_enable(new_img)
+
+	gimp.Display(new_img)
+	gimp.displays_flush()
+
+# how many decoded files can be waiting to become frames at once (per worker)
+IMPORT_BATCH_PER_WORKER = 4
+
+def get_aligned_offsets(img, alignment, x, y, src_width, src_height):
+	"""
+	@returns where on the sprite canvas to put a piece of an image that
+	was at (x, y) in its (src_width, src_height) source image
+	"""
+	if alignment == ALIGN_CENTER:
+		return ((img.width - src_width)//2 + x, (img.height - src_height)//2 + y)
+	elif alignment == ALIGN_BOTTOM:
+		return ((img.width - src_width)//2 + x, img.height - src_height + y)
+	return (x, y)
+
+def _insert_frame_root(img, frame_num, pos):
+	frame_root = pdb.gimp_layer_group_new(img)
+	frame_root.name = make_frame_name(frame_num)
+	pdb.gimp_image_insert_layer(img, frame_root, None, pos)
+	return frame_root
+
+def _import_with_gimp(img, path, alignment, frame_num, frame_pos):
+	"""
+	Loads the file with gimp and adds it as a frame, trimmed to its alpha
+	bounds.
+
+	@returns whether gimp could load it
+	"""
+	try:
+		loaded = pdb.gimp_file_load(path, path)
+	except RuntimeError:
+		return False
+	try:
+		frame_root = _insert_frame_root(img, frame_num, frame_pos)
+		new_layer = pdb.gimp_layer_new_from_visible(loaded, img, "Layer 1")
+		pdb.gimp_image_insert_layer(img, new_layer, frame_root, 0)
+		x, y = get_aligned_offsets(img, alignment, 0, 0, loaded.width, loaded.height)
+		pdb.gimp_layer_set_offsets(new_layer, x, y)
+		pdb.plug_in_autocrop_layer(img, new_layer)
+	finally:
+		pdb.gimp_image_delete(loaded)
+	return True
+
+def _import_png_sequence(img, files, alignment, workers):
+	"""
+	Generator that decodes the files in a pool of workers, a bounded batch
+	at a time, and appends a frame for each one
+	"""
+	frame_num = get_last_frame_num(img) + 1
+	frame_pos = get_last_frame_position(img) + 1
+
+	workers = get_worker_count(workers)
+	pool = make_worker_pool(workers)
+	batch_size = IMPORT_BATCH_PER_WORKER * workers
+	batches = [files[i:i+batch_size] for i in xrange(0, len(files), batch_size)]
+	failed = []
+	try:
+		# decode the next batch while the frames of the current one are made
+		pending = pool.map_async(decode_frame, batches[0])
+		curr_count = 0
+		for idx in xrange(len(batches)):
+			results = pending.get()
+			if idx+1 < len(batches):
+				pending = pool.map_async(decode_frame, batches[idx+1])
+
+			for path, src_width, src_height, bounds, data in results:
+				curr_count += 1
+				if data is None:
+					# not something read_png understands, let gimp load it
+					if _import_with_gimp(img, path, alignment, frame_num, frame_pos):
+						frame_num += 1
+						frame_pos += 1
+					else:
+						failed.append(os.path.basename(path))
+					yield float(curr_count) / len(files)
+					continue
+
+				frame_root = _insert_frame_root(img, frame_num, frame_pos)
+				if bounds is None:
+					new_layer_from_pixels(img, "Layer 1", 1, 1, "\x00" * 4, parent=frame_root)
+				else:
+					x, y = get_aligned_offsets(img, alignment, bounds[0], bounds[1], src_width, src_height)
+					new_layer_from_pixels(img, "Layer 1", bounds[2], bounds[3], data, x, y, frame_root)
+				frame_num += 1
+				frame_pos += 1
+
+				yield float(curr_count) / len(files)
+	finally:
+		pool.terminate()
+
+	if len(failed) > 0:
+		gimp.message("Couldn't load %d of the files, skipped them:\n%s" % (len(failed), "\n".join(failed)))
+
+def _import_gif(img, path, alignment):
+	"""
+	Generator that appends a frame for each frame of the gif, loaded (and
+	composited according to its combine/replace disposal) by gimp
+	"""
+	frame_num = get_last_frame_num(img) + 1
+	frame_pos = get_last_frame_position(img) + 1
+
+	gif = pdb.gimp_file_load(path, path)
+	pdb.gimp_image_undo_disable(gif)
+	try:
+		# the first frame of the gif is the bottom layer
+		gif_layers = list(reversed(gif.layers))
+		for gif_layer in gif_layers:
+			gif_layer.visible = False
+
+		first_visible = 0
+		for idx, gif_layer in enumerate(gif_layers):
+			if "(replace)" in gif_layer.name:
+				for prev_layer in gif_layers[first_visible:idx]:
+					prev_layer.visible = False
+				first_visible = idx
+			gif_layer.visible = True
+
+			frame_root = _insert_frame_root(img, frame_num, frame_pos)
+			new_layer = pdb.gimp_layer_new_from_visible(gif, img, "Layer 1")
+			pdb.gimp_image_insert_layer(img, new_layer, frame_root, 0)
+			x, y = get_aligned_offsets(img, alignment, 0, 0, gif.width, gif.height)
+			pdb.gimp_layer_set_offsets(new_layer, x, y)
+			pdb.plug_in_autocrop_layer(img, new_layer)
+			frame_num += 1
+			frame_pos += 1
+
+			yield float(idx+1) / len(gif_layers)
+	finally:
+		pdb.gimp_image_delete(gif)
+
+def narly_sprite_import_frames(img, layer, path, pattern, alignment, workers, undo_mode=UNDO_FULL):
+	"""
+	Appends a frame for each image in a folder of numbered images (in
+	natural sort order), or for each frame of a gif. Each frame is trimmed
+	to its alpha bounds and aligned on the sprite canvas.
+	"""
+	if img.base_type != RGB:
+		gimp.message("Frames can only be imported into RGB sprites!")
+		return
+
+	if os.path.isdir(path):
+		files = sorted(glob.glob(os.path.join(path, pattern)), key=natural_sort_key)
+		if len(files) == 0:
+			gimp.message("No files matching %s in %s!" % (pattern, path))
+			return
+		steps = _import_png_sequence(img, files, alignment, workers)
+	elif os.path.isfile(path) and path.lower().endswith(".gif"):
+		steps = _import_gif(img, path, alignment)
+	else:
+		gimp.message("%s should be a folder of images or a gif!" % path)
+		return
+
+	# a cancelled import aborts the bulk edit, anything else ends it (even
+	# when an error stops the import part way through)
+	cancelled = [False]
+	def on_cancel():
+		cancelled[0] = True
+		abort_bulk_edit(img, undo_mode)
+
+	begin_bulk_edit(img, undo_mode)
+	try:
+		run_chunked(img, steps, "Importing frames", on_cancel)
+	finally:
+		if not cancelled[0]:
+			end_bulk_edit(img, undo_mode)
+	if cancelled[0]:
+		return
+
+	pdb.gimp_image_undo_freeze(img)
+	goto_frame(img, get_last_frame_num(img))
+	pdb.gimp_image_undo_thaw(img)
@@ -0,0 +1,97 @@
+"""
+Load test for the export daemon (see daemon.py). Sends the same xcf
+files to a running daemon over and over from several client threads and
+reports the throughput and latencies:
+
+	python -m narly_sprite_lib.loadtest walk.xcf run.xcf --jobs 100 --clients 8
+
+Each job writes its sheet to a temporary directory (removed afterwards),
+so the xcf files' own sheets aren't overwritten.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from narly_sprite_lib.daemon import DEFAULT_SOCKET, request, export
+
+def percentile(values, fraction):
+	values = sorted(values)
+	if len(values) == 0:
+		return 0.0
+	return values[min(int(len(values) * fraction), len(values)-1)]
+
+def run_load_test(xcf_paths, num_jobs, num_clients, socket_path, options):
+	"""
+	@returns (seconds, replies) - how long all of the jobs took and the
+	daemon's reply to each
+	"""
+	out_dir = tempfile.mkdtemp(prefix="narly_sprite_loadtest_")
+	replies = []
+	lock = threading.Lock()
+	next_job = [0]
+
+	def client():
+		while True:
+			with lock:
+				job_num = next_job[0]
+				if job_num >= num_jobs:
+					return
+				next_job[0] += 1
+			xcf_path = xcf_paths[job_num % len(xcf_paths)]
+			export_path = os.path.join(out_dir, "job_%d.png" % job_num)
+			reply = export(xcf_path, socket_path, export_path=export_path, **options)
+			with lock:
+				replies.append(reply)
+
+	threads = [threading.Thread(target=client) for _ in xrange(num_clients)]
+	start = time.time()
+	try:
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+	finally:
+		shutil.rmtree(out_dir, True)
+	return time.time() - start, replies
+
+def print_report(seconds, replies, status):
+	ok = [reply for reply in replies if reply["ok"]]
+	print "%d jobs in %.2fs (%.2f jobs/s), %d failed" % (
+		len(replies), seconds, len(replies) / max(seconds, 1e-9), len(replies) - len(ok))
+	for reply in replies:
+		if not reply["ok"]:
+			print "  first failure: %s" % reply["error"]
+			break
+
+	print "%-8s %8s %8s %8s %8s" % ("ms", "p50", "p90", "p99", "max")
+	for key in ("queued", "export", "total"):
+		values = [reply["timing"][key] * 1000 for reply in ok]
+		print "%-8s %8.1f %8.1f %8.1f %8.1f" % (
+			key, percentile(values, 0.5), percentile(values, 0.9), percentile(values, 0.99),
+			max(values) if len(values) > 0 else 0.0)
+
+	for worker in status["workers"]:
+		print "worker %d: %d jobs" % (worker["worker"], worker["jobs"])
+
+def main(argv):
+	parser = argparse.ArgumentParser(prog="python -m narly_sprite_lib.loadtest")
+	parser.add_argument("xcf", nargs="+")
+	parser.add_argument("--jobs", type=int, default=50)
+	parser.add_argument("--clients", type=int, default=4)
+	parser.add_argument("--socket", default=DEFAULT_SOCKET)
+	parser.add_argument("--sheet-type", default="horizontal")
+	args = parser.parse_args(argv[1:])
+
+	xcf_paths = [os.path.abspath(path) for path in args.xcf]
+	seconds, replies = run_load_test(xcf_paths, args.jobs, args.clients, args.socket,
+		{"sheet_type": args.sheet_type, "write_metadata": True})
+	print_report(seconds, replies, request({"cmd": "status"}, args.socket))
+	return 0 if all(reply["ok"] for reply in replies) else 1
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
@@ -0,0 +1,329 @@
+"""
+Palette building and quantization for 8-bit (paletted) sprite sheets.
+
+A palette is a list of (r, g, b, a) tuples. Index 0 is always fully
+transparent, the rest are built by median cut from a sample of the
+pixels (refined with a few rounds of k-means when numpy is available).
+Palettes are saved as json so the same palette can be reused by the
+exports of several sprites.
+
+Palette swapped variants of a sheet (see load_color_variants) are made
+by recoloring the finished sheet, or just its palette.
+"""
+
+import os
+import json
+
+# the most pixels that are looked at when building a palette
+PALETTE_MAX_SAMPLES = 65536
+
+# rounds of k-means refinement after median cut (numpy only)
+PALETTE_KMEANS_ITERATIONS = 4
+
+# pixels mapped to a palette at a time with numpy, bounds the size of the
+# pixels x colors distance matrix
+QUANTIZE_CHUNK = 4096
+
+TRANSPARENT = (0, 0, 0, 0)
+
+# how far (in any channel) a palette entry can be from a variant's source
+# color and still be recolored, for the quantization error of the entry
+RECOLOR_PALETTE_TOLERANCE = 4
+
+# 4x4 bayer matrix for ordered dithering
+BAYER_4X4 = (
+	(0, 8, 2, 10),
+	(12, 4, 14, 6),
+	(3, 11, 1, 9),
+	(15, 7, 13, 5),
+)
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def sample_pixels(data, bpp=4, max_samples=PALETTE_MAX_SAMPLES):
+	"""
+	@returns up to max_samples RGBA tuples spread evenly over the
+	(non-transparent) pixels of data
+	"""
+	data = bytearray(data)
+	num_pixels = len(data) // bpp
+	step = max(num_pixels // max_samples, 1)
+	res = []
+	for i in xrange(0, num_pixels, step):
+		pixel = data[i*bpp:(i+1)*bpp]
+		if pixel[3] != 0:
+			res.append(tuple(pixel))
+	return res
+
+def _get_spreads(box):
+	"""
+	@returns the range of values of each channel in the box
+	"""
+	return [max(pixel[c] for pixel in box) - min(pixel[c] for pixel in box) for c in xrange(4)]
+
+def _median_cut_python(samples, num_colors):
+	boxes = [(samples, _get_spreads(samples))]
+	while len(boxes) < num_colors:
+		# split the box with the largest range in any channel
+		box_idx = max(xrange(len(boxes)), key=lambda i: max(boxes[i][1]))
+		box, spreads = boxes[box_idx]
+		if max(spreads) == 0:
+			break
+
+		channel = spreads.index(max(spreads))
+		box = sorted(box, key=lambda pixel: pixel[channel])
+		half = len(box) // 2
+		boxes.pop(box_idx)
+		boxes.extend([(box[:half], _get_spreads(box[:half])), (box[half:], _get_spreads(box[half:]))])
+
+	res = []
+	for box, _ in boxes:
+		res.append(tuple(int(round(sum(pixel[c] for pixel in box) / float(len(box)))) for c in xrange(4)))
+	return res
+
+def _median_cut_numpy(numpy, samples, num_colors):
+	boxes = [samples]
+	while len(boxes) < num_colors:
+		spreads = [
+			(box.max(axis=0) - box.min(axis=0)) if len(box) > 1 else numpy.zeros(4, numpy.int32)
+			for box in boxes
+		]
+		box_idx = max(xrange(len(boxes)), key=lambda i: spreads[i].max())
+		if spreads[box_idx].max() == 0:
+			break
+
+		channel = spreads[box_idx].argmax()
+		box = boxes.pop(box_idx)
+		box = box[box[:, channel].argsort(kind="mergesort")]
+		half = len(box) // 2
+		boxes.extend([box[:half], box[half:]])
+
+	centers = numpy.array([box.mean(axis=0) for box in boxes], numpy.float32)
+
+	for _ in xrange(PALETTE_KMEANS_ITERATIONS):
+		nearest = _nearest_numpy(numpy, samples.astype(numpy.float32), centers)
+		for i in xrange(len(centers)):
+			members = samples[nearest == i]
+			if len(members) > 0:
+				centers[i] = members.mean(axis=0)
+
+	return [tuple(int(c) for c in center) for center in (centers + 0.5).clip(0, 255).astype(numpy.uint8)]
+
+def build_palette(samples, num_colors):
+	"""
+	@returns a palette of at most num_colors (including the transparent
+	color at index 0) for the RGBA samples
+	"""
+	num_colors = max(min(num_colors, 256), 2)
+	if len(samples) == 0:
+		return [TRANSPARENT]
+
+	numpy = _import_numpy()
+	if numpy is None:
+		colors = _median_cut_python(samples, num_colors-1)
+	else:
+		colors = _median_cut_numpy(numpy, numpy.array(samples, numpy.int32), num_colors-1)
+
+	# median cut on the same colors can give the same center twice
+	res = [TRANSPARENT]
+	for color in colors:
+		if color not in res:
+			res.append(color)
+	return res
+
+def _nearest_numpy(numpy, pixels, colors):
+	"""
+	@returns the index of the nearest color to each pixel
+	"""
+	res = numpy.empty(len(pixels), numpy.int32)
+	for start in xrange(0, len(pixels), QUANTIZE_CHUNK):
+		chunk = pixels[start:start+QUANTIZE_CHUNK]
+		dist = ((chunk[:, None, :] - colors[None, :, :]) ** 2).sum(axis=2)
+		res[start:start+QUANTIZE_CHUNK] = dist.argmin(axis=1)
+	return res
+
+def _get_dither_spread(palette):
+	# roughly the distance between neighbouring palette colors in each channel
+	return 255.0 / max(len(palette) ** (1.0 / 3), 1.0)
+
+def _quantize_numpy(numpy, data, width, height, palette, dither):
+	pixels = numpy.frombuffer(str(data), numpy.uint8).reshape(height, width, 4).astype(numpy.float32)
+	transparent = pixels[..., 3] == 0
+
+	if dither:
+		bayer = (numpy.array(BAYER_4X4, numpy.float32) + 0.5) / 16.0 - 0.5
+		threshold = numpy.tile(bayer, ((height + 3) // 4, (width + 3) // 4))[:height, :width]
+		pixels[..., :3] += threshold[..., None] * _get_dither_spread(palette)
+
+	# never map a visible pixel to the transparent color
+	colors = numpy.array(palette[1:], numpy.float32)
+	res = _nearest_numpy(numpy, pixels.reshape(-1, 4), colors) + 1
+	res[transparent.reshape(-1)] = 0
+	return res.astype(numpy.uint8).tostring()
+
+def _quantize_python(data, width, height, palette, dither):
+	data = bytearray(data)
+	res = bytearray(width * height)
+	colors = palette[1:]
+	spread = _get_dither_spread(palette)
+	# sprites tend to use few colors, so remember the nearest color of each
+	nearest = {}
+	for y in xrange(height):
+		for x in xrange(width):
+			i = (y*width + x) * 4
+			pixel = tuple(data[i:i+4])
+			if pixel[3] == 0:
+				continue
+			if dither:
+				offset = int(((BAYER_4X4[y % 4][x % 4] + 0.5) / 16.0 - 0.5) * spread)
+				pixel = (pixel[0]+offset, pixel[1]+offset, pixel[2]+offset, pixel[3])
+
+			idx = nearest.get(pixel)
+			if idx is None:
+				idx = min(xrange(len(colors)), key=lambda c: sum((a-b)*(a-b) for a, b in zip(pixel, colors[c]))) + 1
+				nearest[pixel] = idx
+			res[y*width + x] = idx
+	return str(res)
+
+def quantize(data, width, height, palette, dither=False):
+	"""
+	Maps the RGBA pixels to the nearest palette colors, optionally with
+	ordered dithering. Fully transparent pixels map to index 0.
+
+	@returns one palette index byte per pixel
+	"""
+	if len(palette) < 2:
+		return "\x00" * (width * height)
+
+	numpy = _import_numpy()
+	if numpy is None:
+		return _quantize_python(data, width, height, palette, dither)
+	return _quantize_numpy(numpy, data, width, height, palette, dither)
+
+def save_palette(path, palette):
+	with open(path, "w") as f:
+		json.dump({"colors": [list(color) for color in palette]}, f)
+
+def load_palette(path):
+	with open(path, "r") as f:
+		return [tuple(color) for color in json.load(f)["colors"]]
+
+def get_shared_palette(palette_path, data, num_colors):
+	"""
+	@returns the palette saved at palette_path if there is one, so that
+	sheets exported with the same palette file all match. Otherwise a new
+	palette is built for the RGBA pixels (and saved to palette_path).
+	"""
+	if palette_path and os.path.exists(palette_path):
+		return load_palette(palette_path)
+
+	palette = build_palette(sample_pixels(data), num_colors)
+	if palette_path:
+		save_palette(palette_path, palette)
+	return palette
+
+def parse_color(value):
+	"""
+	@returns the (r, g, b) of a "#rrggbb" color
+	"""
+	value = value.lstrip("#")
+	if len(value) != 6:
+		raise ValueError("bad color %r, expected #rrggbb" % value)
+	return (int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16))
+
+def load_color_variants(path):
+	"""
+	Loads the color lookup tables of palette swapped variants of a sheet,
+	a json file like:
+
+		{"red": {"#3a7d2c": "#9b2222", "#1f4a18": "#5c1010"},
+		 "blue": {"#3a7d2c": "#2a4d9b"}}
+
+	Colors that aren't in a variant's table stay the way they are, alpha
+	is never changed and fully transparent pixels are left alone.
+
+	@returns a list of (name, {(r, g, b): (r, g, b)}), sorted by name
+	"""
+	with open(path, "r") as f:
+		variants = json.load(f)
+	res = []
+	for name in sorted(variants):
+		lut = dict((parse_color(src), parse_color(dest)) for src, dest in variants[name].iteritems())
+		res.append((name, lut))
+	return res
+
+def recolor_palette(palette, lut):
+	"""
+	Applies a variant's lookup table to a sheet's palette instead of its
+	pixels: each palette entry within RECOLOR_PALETTE_TOLERANCE of a source
+	color (the closest one, if there are several) gets that source's
+	variant color. Source colors that aren't in the palette change
+	nothing, like when recoloring pixels.
+
+	@returns the recolored palette
+	"""
+	res = list(palette)
+	for idx in xrange(1, len(palette)):
+		best = None
+		best_dist = None
+		for src, dest in sorted(lut.iteritems()):
+			dist = max(abs(a - b) for a, b in zip(src, palette[idx][:3]))
+			if dist <= RECOLOR_PALETTE_TOLERANCE and (best is None or dist < best_dist):
+				best = dest
+				best_dist = dist
+		if best is not None:
+			res[idx] = best + (palette[idx][3],)
+	return res
+
+def _iter_recolored_numpy(numpy, data, variants):
+	pixels = numpy.frombuffer(str(data), numpy.uint8).reshape(-1, 4)
+	visible = pixels[:, 3] != 0
+	rgb = pixels[visible, :3].astype(numpy.uint32)
+	keys = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+	# the sheet's colors are only looked up once, each variant then just
+	# indexes its table of those colors
+	colors, inverse = numpy.unique(keys, return_inverse=True)
+	colors_rgb = numpy.stack([(colors >> 16) & 0xff, (colors >> 8) & 0xff, colors & 0xff], axis=1).astype(numpy.uint8)
+	for name, lut in variants:
+		table = colors_rgb.copy()
+		for src, dest in lut.iteritems():
+			key = (src[0] << 16) | (src[1] << 8) | src[2]
+			idx = numpy.searchsorted(colors, key)
+			if idx < len(colors) and colors[idx] == key:
+				table[idx] = dest
+		res = pixels.copy()
+		res[visible, :3] = table[inverse]
+		yield name, res.tostring()
+
+def _iter_recolored_python(data, variants):
+	data = str(data)
+	# where each color that any of the variants changes is
+	offsets = dict((src, []) for _, lut in variants for src in lut)
+	for i in xrange(0, len(data), 4):
+		if data[i+3] == "\x00":
+			continue
+		rgb = (ord(data[i]), ord(data[i+1]), ord(data[i+2]))
+		if rgb in offsets:
+			offsets[rgb].append(i)
+	for name, lut in variants:
+		res = bytearray(data)
+		for src, dest in lut.iteritems():
+			for i in offsets[src]:
+				res[i:i+3] = bytearray(dest)
+		yield name, str(res)
+
+def iter_recolored(data, variants):
+	"""
+	Generates (name, RGBA pixels) of each of the variants (see
+	load_color_variants) of the RGBA pixels. The pixels' colors are
+	worked out once for all of the variants.
+	"""
+	numpy = _import_numpy()
+	if numpy is None:
+		return _iter_recolored_python(data, variants)
+	return _iter_recolored_numpy(numpy, data, variants)
@@ -0,0 +1,544 @@
+"""
+A minimal PNG reader/writer for raw 8-bit pixel buffers, so that images
+can be encoded and decoded outside of gimp (eg by the export worker
+process or the frame import pool).
+"""
+
+import os
+import struct
+import zlib
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+
+# row filters, "adaptive" picks the best one for each row (the smallest
+# sum of absolute differences, like libpng). Filtering is done with numpy
+# if it's available, and is slow in pure python.
+PNG_FILTERS = {
+	"none": 0,
+	"sub": 1,
+	"up": 2,
+	"average": 3,
+	"paeth": 4,
+	"adaptive": None,
+}
+
+# the rows are deflated in independent blocks of about this many bytes,
+# in parallel
+PNG_BLOCK_BYTES = 1 << 20
+
+# bytes per pixel -> png color type
+PNG_COLOR_TYPES = {
+	1: 0,	# grayscale
+	2: 4,	# grayscale + alpha
+	3: 2,	# RGB
+	4: 6,	# RGBA
+}
+
+# png color type -> samples per pixel (palette images have 1, the index)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+def _chunk(chunk_type, data):
+	crc = zlib.crc32(chunk_type)
+	crc = zlib.crc32(data, crc) & 0xffffffff
+	return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def _paeth(a, b, c):
+	p = a + b - c
+	pa = abs(p - a)
+	pb = abs(p - b)
+	pc = abs(p - c)
+	if pa <= pb and pa <= pc:
+		return a
+	elif pb <= pc:
+		return b
+	return c
+
+def _filter_row_python(row, prev, bpp, filter_type):
+	if filter_type == 0:
+		return row
+	res = bytearray(len(row))
+	for i in xrange(len(row)):
+		left = row[i-bpp] if i >= bpp else 0
+		if filter_type == 1:
+			pred = left
+		elif filter_type == 2:
+			pred = prev[i]
+		elif filter_type == 3:
+			pred = (left + prev[i]) >> 1
+		else:
+			pred = _paeth(left, prev[i], prev[i-bpp] if i >= bpp else 0)
+		res[i] = (row[i] - pred) & 0xff
+	return res
+
+def _filter_rows_python(rows, prev, num_rows, row_len, bpp, filter_type):
+	rows = bytearray(rows)
+	prev = bytearray(prev)
+	res = []
+	for y in xrange(num_rows):
+		row = rows[y*row_len:(y+1)*row_len]
+		if filter_type is None:
+			# the filter with the smallest sum of (signed) bytes
+			candidates = [_filter_row_python(row, prev, bpp, f) for f in xrange(5)]
+			costs = [sum(min(b, 256-b) for b in candidate) for candidate in candidates]
+			best = costs.index(min(costs))
+			res.append(chr(best) + str(candidates[best]))
+		else:
+			res.append(chr(filter_type) + str(_filter_row_python(row, prev, bpp, filter_type)))
+		prev = row
+	return "".join(res)
+
+def _filter_rows_numpy(numpy, rows, prev, num_rows, row_len, bpp, filter_type):
+	rows = numpy.frombuffer(rows, numpy.uint8).reshape(num_rows, row_len).astype(numpy.int16)
+	above = numpy.empty_like(rows)
+	above[0] = numpy.frombuffer(prev, numpy.uint8)
+	above[1:] = rows[:-1]
+	left = numpy.zeros_like(rows)
+	left[:, bpp:] = rows[:, :-bpp]
+	upper_left = numpy.zeros_like(rows)
+	upper_left[:, bpp:] = above[:, :-bpp]
+
+	def paeth():
+		p = left + above - upper_left
+		pa = numpy.abs(p - left)
+		pb = numpy.abs(p - above)
+		pc = numpy.abs(p - upper_left)
+		return numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, above, upper_left))
+
+	predictors = [
+		lambda: 0,
+		lambda: left,
+		lambda: above,
+		lambda: (left + above) >> 1,
+		paeth,
+	]
+
+	res = numpy.empty((num_rows, row_len+1), numpy.uint8)
+	if filter_type is not None:
+		res[:, 0] = filter_type
+		res[:, 1:] = (rows - predictors[filter_type]()) & 0xff
+		return res.tostring()
+
+	best_cost = None
+	for f, predictor in enumerate(predictors):
+		filtered = ((rows - predictor()) & 0xff).astype(numpy.uint8)
+		cost = numpy.minimum(filtered, 256 - filtered.astype(numpy.int16)).sum(axis=1)
+		if best_cost is None:
+			better = numpy.ones(num_rows, bool)
+			best_cost = cost
+		else:
+			better = cost < best_cost
+			best_cost = numpy.where(better, cost, best_cost)
+		res[better, 0] = f
+		res[better, 1:] = filtered[better]
+	return res.tostring()
+
+def _filter_rows(rows, prev, num_rows, row_len, bpp, filter_type):
+	"""
+	@returns the rows with the filter type byte and filter applied, prev
+	being the row above the first one
+	"""
+	if filter_type == 0:
+		return "".join("\x00" + rows[y*row_len:(y+1)*row_len] for y in xrange(num_rows))
+	numpy = _import_numpy()
+	if numpy is None:
+		return _filter_rows_python(rows, prev, num_rows, row_len, bpp, filter_type)
+	return _filter_rows_numpy(numpy, rows, prev, num_rows, row_len, bpp, filter_type)
+
+def _encode_block(args):
+	"""
+	Filters and deflates the rows [start, end) as a part of a raw deflate
+	stream. Blocks other than the last end with a sync flush, so that the
+	compressed blocks can be joined into one stream.
+
+	@returns (compressed data, adler32 of the filtered rows, their length)
+	"""
+	data, row_len, bpp, start, end, level, filter_type, last = args
+	rows = str(data[start*row_len:end*row_len])
+	if start > 0:
+		prev = str(data[(start-1)*row_len:start*row_len])
+	else:
+		prev = "\x00" * row_len
+
+	filtered = _filter_rows(rows, prev, end-start, row_len, bpp, filter_type)
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+	compressed = compressor.compress(filtered) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+	return compressed, zlib.adler32(filtered) & 0xffffffff, len(filtered)
+
+def adler32_combine(adler1, adler2, len2):
+	"""
+	@returns the adler32 of two strings joined together, from the adler32
+	of each and the length of the second (same as zlib's)
+	"""
+	base = 65521
+	rem = len2 % base
+	sum1 = adler1 & 0xffff
+	sum2 = (rem * sum1) % base
+	sum1 += (adler2 & 0xffff) + base - 1
+	sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + base - rem
+	if sum1 >= base:
+		sum1 -= base
+	if sum1 >= base:
+		sum1 -= base
+	if sum2 >= base << 1:
+		sum2 -= base << 1
+	if sum2 >= base:
+		sum2 -= base
+	return sum1 | (sum2 << 16)
+
+def _zlib_header(level):
+	cmf = 0x78	# deflate, 32k window
+	if level < 2:
+		flevel = 0
+	elif level < 6:
+		flevel = 1
+	elif level == 6:
+		flevel = 2
+	else:
+		flevel = 3
+	flg = flevel << 6
+	flg |= (31 - (cmf*256 + flg) % 31) % 31
+	return chr(cmf) + chr(flg)
+
+def write_png(path, width, height, data, bpp=4, level=6, palette=None, filter_type="none", threads=0):
+	"""
+	Writes the raw, row-major pixel data (`bpp` bytes per pixel) to path
+	as a non-interlaced 8-bit PNG. If a palette of (r, g, b, a) colors is
+	given, data holds one palette index per pixel.
+
+	The rows are filtered with the named filter (see PNG_FILTERS) and
+	deflated at the given level in blocks of about PNG_BLOCK_BYTES, using
+	`threads` threads (0 = one per CPU). The blocks are joined into a
+	single zlib stream, so the file is a standard PNG.
+	"""
+	if filter_type not in PNG_FILTERS:
+		raise ValueError("unknown png filter %s" % filter_type)
+	if palette is not None:
+		# filtering palette indices doesn't help
+		filter_type = "none"
+
+	row_len = width * bpp
+	block_rows = max(PNG_BLOCK_BYTES // (row_len+1), 1)
+	blocks = [
+		(data, row_len, bpp, start, min(start+block_rows, height), level,
+			PNG_FILTERS[filter_type], start+block_rows >= height)
+		for start in xrange(0, height, block_rows)
+	]
+
+	color_type = PNG_COLOR_TYPES[bpp] if palette is None else 3
+	ihdr = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+
+	with open(path, "wb") as f:
+		f.write(PNG_SIGNATURE)
+		f.write(_chunk("IHDR", ihdr))
+		if palette is not None:
+			f.write(_chunk("PLTE", "".join(struct.pack("BBB", *color[:3]) for color in palette)))
+			# trailing opaque entries can be left out of tRNS
+			alphas = [color[3] for color in palette]
+			while alphas and alphas[-1] == 255:
+				alphas.pop()
+			if alphas:
+				f.write(_chunk("tRNS", struct.pack("%dB" % len(alphas), *alphas)))
+
+		# each block goes into an IDAT chunk of its own as soon as it's
+		# ready, in order
+		pool = None
+		if threads != 1 and len(blocks) > 1:
+			pool = ThreadPool(min(threads or multiprocessing.cpu_count(), len(blocks)))
+			results = pool.imap(_encode_block, blocks)
+		else:
+			results = (_encode_block(block) for block in blocks)
+		try:
+			adler = 1
+			prefix = _zlib_header(level)
+			for compressed, block_adler, length in results:
+				adler = adler32_combine(adler, block_adler, length)
+				f.write(_chunk("IDAT", prefix + compressed))
+				prefix = ""
+			f.write(_chunk("IDAT", prefix + struct.pack(">I", adler)))
+		finally:
+			if pool is not None:
+				pool.close()
+				pool.join()
+		f.write(_chunk("IEND", ""))
+
+class PngWriter(object):
+	"""
+	Writes an 8-bit RGBA (or gray, etc, see PNG_COLOR_TYPES) PNG a few
+	rows at a time, so the whole image never has to be in memory. The rows
+	are deflated as one stream as they come in, without write_png's
+	threads.
+	"""
+	def __init__(self, path, width, height, bpp=4, level=6, filter_type="none"):
+		if filter_type not in PNG_FILTERS:
+			raise ValueError("unknown png filter %s" % filter_type)
+		self.path = path
+		self.width = width
+		self.height = height
+		self.bpp = bpp
+		self.row_len = width * bpp
+		self.rows_written = 0
+		self._filter_type = PNG_FILTERS[filter_type]
+		self._prev = "\x00" * self.row_len
+		self._compressor = zlib.compressobj(level)
+		self._file = open(path, "wb")
+		self._file.write(PNG_SIGNATURE)
+		self._file.write(_chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[bpp], 0, 0, 0)))
+
+	def write_rows(self, data):
+		"""
+		Adds the next rows of raw pixels (any whole number of rows)
+		"""
+		data = str(data)
+		num_rows = len(data) // self.row_len
+		if num_rows == 0:
+			return
+		if num_rows * self.row_len != len(data) or self.rows_written + num_rows > self.height:
+			raise ValueError("%s: bad number of bytes for a %dx%d png" % (self.path, self.width, self.height))
+		compressed = self._compressor.compress(
+			_filter_rows(data, self._prev, num_rows, self.row_len, self.bpp, self._filter_type))
+		if compressed:
+			self._file.write(_chunk("IDAT", compressed))
+		self._prev = data[-self.row_len:]
+		self.rows_written += num_rows
+
+	def close(self):
+		if self.rows_written != self.height:
+			raise ValueError("%s: only %d of %d rows were written" % (self.path, self.rows_written, self.height))
+		self._file.write(_chunk("IDAT", self._compressor.flush()))
+		self._file.write(_chunk("IEND", ""))
+		self._file.close()
+
+	def abort(self):
+		"""
+		Closes and deletes the unfinished file
+		"""
+		self._file.close()
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+# the (x, y, x step, y step) of each pass of an Adam7 interlaced png
+ADAM7_PASSES = (
+	(0, 0, 8, 8),
+	(4, 0, 8, 8),
+	(0, 4, 4, 8),
+	(2, 0, 4, 4),
+	(0, 2, 2, 4),
+	(1, 0, 2, 2),
+	(0, 1, 1, 2),
+)
+
+def _unfilter(raw, pos, row_len, height, bpp):
+	"""
+	Undoes the per-row filters of `height` rows of `row_len` bytes of the
+	(decompressed) image data, starting at pos. bpp is the number of bytes
+	per pixel, rounded up to 1.
+
+	@returns (the unfiltered rows, the position after them)
+	"""
+	res = bytearray(row_len * height)
+	prev = bytearray(row_len)
+	for y in xrange(height):
+		filter_type = ord(raw[pos])
+		row = bytearray(raw[pos+1:pos+1+row_len])
+		pos += row_len + 1
+
+		if filter_type == 1:	# Sub
+			for i in xrange(bpp, row_len):
+				row[i] = (row[i] + row[i-bpp]) & 0xff
+		elif filter_type == 2:	# Up
+			row = bytearray((a + b) & 0xff for a, b in zip(row, prev))
+		elif filter_type == 3:	# Average
+			for i in xrange(row_len):
+				left = row[i-bpp] if i >= bpp else 0
+				row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xff
+		elif filter_type == 4:	# Paeth
+			for i in xrange(row_len):
+				a = row[i-bpp] if i >= bpp else 0
+				b = prev[i]
+				c = prev[i-bpp] if i >= bpp else 0
+				p = a + b - c
+				pa = abs(p - a)
+				pb = abs(p - b)
+				pc = abs(p - c)
+				if pa <= pb and pa <= pc:
+					pred = a
+				elif pb <= pc:
+					pred = b
+				else:
+					pred = c
+				row[i] = (row[i] + pred) & 0xff
+		elif filter_type != 0:
+			raise ValueError("bad png filter type %d" % filter_type)
+
+		res[y*row_len:(y+1)*row_len] = row
+		prev = row
+	return res, pos
+
+def _unpack_samples(row, num_samples, depth):
+	"""
+	@returns the samples of an unfiltered row, at their full bit depth
+	"""
+	if depth == 8:
+		return row[:num_samples]
+	if depth == 16:
+		return [row[i] << 8 | row[i+1] for i in xrange(0, num_samples*2, 2)]
+	per_byte = 8 // depth
+	mask = (1 << depth) - 1
+	return [(row[i // per_byte] >> (8 - depth*(i % per_byte + 1))) & mask for i in xrange(num_samples)]
+
+def _make_rgba_lookup(color_type, depth, palette, trns):
+	"""
+	@returns a function that turns the samples of a pixel (at their full
+	bit depth) into RGBA
+	"""
+	if color_type == 3:
+		lookup = []
+		for i in xrange(len(palette) // 3):
+			alpha = ord(trns[i]) if trns is not None and i < len(trns) else 255
+			lookup.append(tuple(bytearray(palette[i*3:i*3+3])) + (alpha,))
+		return lambda samples: lookup[samples[0]]
+
+	# scale the samples to 8 bits
+	max_value = (1 << depth) - 1
+	if depth == 16:
+		scale = lambda value: value >> 8
+	else:
+		scale = lambda value: value * 255 // max_value
+
+	# tRNS holds the one color (at full depth) that's transparent
+	key = None
+	if trns is not None:
+		key = tuple(struct.unpack(">%dH" % (len(trns) // 2), trns))
+
+	if color_type == 0:
+		return lambda samples: (scale(samples[0]),) * 3 + (0 if tuple(samples) == key else 255,)
+	if color_type == 2:
+		return lambda samples: tuple(scale(s) for s in samples) + (0 if tuple(samples) == key else 255,)
+	if color_type == 4:
+		return lambda samples: (scale(samples[0]),) * 3 + (scale(samples[1]),)
+	return lambda samples: tuple(scale(s) for s in samples)
+
+def _decode_any(raw, width, height, depth, color_type, interlace, palette, trns):
+	"""
+	Decodes images with any bit depth, interlaced or not, a pixel at a
+	time (slowly).
+
+	@returns the RGBA pixels
+	"""
+	channels = PNG_CHANNELS[color_type]
+	bpp = max(channels * depth // 8, 1)
+	to_rgba = _make_rgba_lookup(color_type, depth, palette, trns)
+	passes = ADAM7_PASSES if interlace else ((0, 0, 1, 1),)
+
+	res = bytearray(width * height * 4)
+	pos = 0
+	for start_x, start_y, step_x, step_y in passes:
+		pass_width = (width - start_x + step_x - 1) // step_x
+		pass_height = (height - start_y + step_y - 1) // step_y
+		# empty passes have no data at all, not even the filter bytes
+		if pass_width <= 0 or pass_height <= 0:
+			continue
+		row_len = (pass_width * channels * depth + 7) // 8
+		rows, pos = _unfilter(raw, pos, row_len, pass_height, bpp)
+		for pass_y in xrange(pass_height):
+			samples = _unpack_samples(rows[pass_y*row_len:(pass_y+1)*row_len], pass_width * channels, depth)
+			y = start_y + pass_y*step_y
+			for pass_x in xrange(pass_width):
+				i = ((start_x + pass_x*step_x) + y*width) * 4
+				res[i:i+4] = bytearray(to_rgba(samples[pass_x*channels:(pass_x+1)*channels]))
+	return res
+
+def read_png(path):
+	"""
+	Reads a PNG of any color type and bit depth, interlaced or not. The
+	common non-interlaced 8-bit images take a faster path.
+
+	@returns (width, height, data) with the pixels converted to 8-bit RGBA
+	"""
+	with open(path, "rb") as f:
+		png = f.read()
+	if png[:8] != PNG_SIGNATURE:
+		raise ValueError("%s is not a png" % path)
+
+	pos = 8
+	header = None
+	idat = []
+	palette = None
+	trns = None
+	while pos < len(png):
+		length, chunk_type = struct.unpack(">I4s", png[pos:pos+8])
+		chunk = png[pos+8:pos+8+length]
+		pos += length + 12
+		if chunk_type == "IHDR":
+			header = struct.unpack(">IIBBBBB", chunk)
+		elif chunk_type == "PLTE":
+			palette = chunk
+		elif chunk_type == "tRNS":
+			trns = chunk
+		elif chunk_type == "IDAT":
+			idat.append(chunk)
+		elif chunk_type == "IEND":
+			break
+
+	if header is None:
+		raise ValueError("%s: png has no header" % path)
+	width, height, depth, color_type, _, _, interlace = header
+	if color_type not in PNG_CHANNELS:
+		raise ValueError("%s: bad png color type %d" % (path, color_type))
+	if color_type == 3 and palette is None:
+		raise ValueError("%s: paletted png without a palette" % path)
+
+	raw = zlib.decompress("".join(idat))
+	if depth != 8 or interlace != 0:
+		return width, height, str(_decode_any(raw, width, height, depth, color_type, interlace, palette, trns))
+
+	# palette images have 1 byte per pixel
+	channels = PNG_CHANNELS[color_type]
+	data, _ = _unfilter(raw, 0, width * channels, height, channels)
+	num_pixels = width * height
+
+	res = bytearray(num_pixels * 4)
+	if color_type == 6:
+		res = data
+	elif color_type == 2:
+		res[0::4] = data[0::3]
+		res[1::4] = data[1::3]
+		res[2::4] = data[2::3]
+		res[3::4] = "\xff" * num_pixels
+		if trns is not None:
+			key = str(bytearray(ord(c) for c in trns[1::2]))
+			for i in xrange(num_pixels):
+				if data[i*3:i*3+3] == key:
+					res[i*4+3] = 0
+	elif color_type in (0, 4):
+		gray = data[0::channels]
+		res[0::4] = gray
+		res[1::4] = gray
+		res[2::4] = gray
+		if color_type == 4:
+			res[3::4] = data[1::2]
+		else:
+			res[3::4] = "\xff" * num_pixels
+			if trns is not None:
+				key = ord(trns[1])
+				for i in xrange(num_pixels):
+					if gray[i] == key:
+						res[i*4+3] = 0
+	else:
+		# expand the palette (with its alpha from tRNS) into a lookup table
+		lookup = []
+		for i in xrange(len(palette) // 3):
+			alpha = ord(trns[i]) if trns is not None and i < len(trns) else 255
+			lookup.append(palette[i*3:i*3+3] + chr(alpha))
+		res = bytearray("".join(lookup[i] for i in data))
+
+	return width, height, str(res)
@@ -0,0 +1,160 @@
+"""
+Scaling of raw RGBA pixel buffers for the multi-resolution export, with
+nearest neighbour (for pixel art) or a box filter. Both use numpy if it's
+available.
+"""
+
+from narly_sprite_lib.constants import FILTER_NEAREST, FILTER_BOX
+
+def _import_numpy():
+	try:
+		import numpy
+	except ImportError:
+		return None
+	return numpy
+
+def get_scaled_size(width, height, scale):
+	return (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+
+def _source_ranges(size, new_size):
+	"""
+	@returns the [start, end) range of source pixels that each of the
+	new_size destination pixels covers
+	"""
+	res = []
+	for i in xrange(new_size):
+		start = i * size // new_size
+		end = max((i+1) * size // new_size, start+1)
+		res.append((start, end))
+	return res
+
+def _scale_nearest_python(data, width, height, new_width, new_height):
+	data = str(data)
+	row_len = width * 4
+	src_xs = [(x*width + width//2) // new_width for x in xrange(new_width)]
+	res = []
+	prev_src_y = None
+	row = None
+	for y in xrange(new_height):
+		src_y = (y*height + height//2) // new_height
+		if src_y != prev_src_y:
+			src_row = data[src_y*row_len:(src_y+1)*row_len]
+			row = "".join(src_row[x*4:x*4+4] for x in src_xs)
+			prev_src_y = src_y
+		res.append(row)
+	return "".join(res)
+
+def _scale_box_python(data, width, height, new_width, new_height):
+	data = bytearray(data)
+	res = bytearray(new_width * new_height * 4)
+	x_ranges = _source_ranges(width, new_width)
+	for y, (y0, y1) in enumerate(_source_ranges(height, new_height)):
+		for x, (x0, x1) in enumerate(x_ranges):
+			# average with premultiplied alpha so transparent pixels don't
+			# darken the edges
+			r = g = b = a = 0
+			for sy in xrange(y0, y1):
+				i = (sy*width + x0) * 4
+				for sx in xrange(x0, x1):
+					alpha = data[i+3]
+					r += data[i] * alpha
+					g += data[i+1] * alpha
+					b += data[i+2] * alpha
+					a += alpha
+					i += 4
+			count = (y1 - y0) * (x1 - x0)
+			dest = (y*new_width + x) * 4
+			if a > 0:
+				res[dest] = (r + a//2) // a
+				res[dest+1] = (g + a//2) // a
+				res[dest+2] = (b + a//2) // a
+				res[dest+3] = (a + count//2) // count
+	return str(res)
+
+def _scale_numpy(numpy, data, width, height, new_width, new_height, filter_type):
+	pixels = numpy.frombuffer(str(data), numpy.uint8).reshape(height, width, 4)
+	if filter_type == FILTER_NEAREST:
+		ys = (numpy.arange(new_height)*height + height//2) // new_height
+		xs = (numpy.arange(new_width)*width + width//2) // new_width
+		return pixels[ys][:, xs].tostring()
+
+	# sum each destination pixel's box of source pixels from a summed area
+	# table (premultiplied by alpha)
+	premult = pixels.astype(numpy.float64)
+	premult[..., :3] *= premult[..., 3:4]
+	table = numpy.zeros((height+1, width+1, 4), numpy.float64)
+	table[1:, 1:] = premult.cumsum(axis=0).cumsum(axis=1)
+
+	y_ranges = numpy.array(_source_ranges(height, new_height))
+	x_ranges = numpy.array(_source_ranges(width, new_width))
+	y0, y1 = y_ranges[:, 0][:, None], y_ranges[:, 1][:, None]
+	x0, x1 = x_ranges[:, 0][None, :], x_ranges[:, 1][None, :]
+	sums = table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+	counts = ((y1 - y0) * (x1 - x0))[..., None]
+
+	res = numpy.zeros((new_height, new_width, 4), numpy.float64)
+	alpha = sums[..., 3:4]
+	safe_alpha = numpy.where(alpha > 0, alpha, 1.0)
+	res[..., :3] = numpy.where(alpha > 0, sums[..., :3] / safe_alpha, 0)
+	res[..., 3:4] = alpha / counts
+	return (res + 0.5).clip(0, 255).astype(numpy.uint8).tostring()
+
+def scale_pixels(data, width, height, new_width, new_height, filter_type=FILTER_NEAREST):
+	"""
+	@returns the RGBA pixels scaled to new_width x new_height
+	"""
+	if (new_width, new_height) == (width, height):
+		return str(data)
+
+	numpy = _import_numpy()
+	if numpy is not None:
+		return _scale_numpy(numpy, data, width, height, new_width, new_height, filter_type)
+	if filter_type == FILTER_NEAREST:
+		return _scale_nearest_python(data, width, height, new_width, new_height)
+	return _scale_box_python(data, width, height, new_width, new_height)
+
+def iter_mip_chain(data, width, height):
+	"""
+	Generates (level, width, height, data) for each mip level below the
+	given image, halving the size (with a box filter) down to 1x1. Only
+	one level is held at a time.
+	"""
+	level = 0
+	while width > 1 or height > 1:
+		new_width = max(width // 2, 1)
+		new_height = max(height // 2, 1)
+		data = scale_pixels(data, width, height, new_width, new_height, FILTER_BOX)
+		width, height = new_width, new_height
+		level += 1
+		yield level, width, height, data
+
+class MipStream(object):
+	"""
+	The streaming version of one step of iter_mip_chain: takes the rows
+	of an image as they come in and passes each row of the half size
+	level to write_rows as soon as its source rows are all there.
+	"""
+	def __init__(self, width, height, write_rows):
+		self.width = width
+		self.height = height
+		self.new_width = max(width // 2, 1)
+		self.new_height = max(height // 2, 1)
+		self._write_rows = write_rows
+		self._row_len = width * 4
+		self._ranges = _source_ranges(height, self.new_height)
+		self._next = 0
+		self._buffer = ""
+		# the source row the buffer starts at
+		self._buffer_y = 0
+
+	def write_rows(self, data):
+		self._buffer += str(data)
+		while self._next < len(self._ranges):
+			start, end = self._ranges[self._next]
+			if (end - self._buffer_y) * self._row_len > len(self._buffer):
+				break
+			rows = self._buffer[(start - self._buffer_y)*self._row_len:(end - self._buffer_y)*self._row_len]
+			self._write_rows(scale_pixels(rows, self.width, end - start, self.new_width, 1, FILTER_BOX))
+			self._buffer = self._buffer[(end - self._buffer_y)*self._row_len:]
+			self._buffer_y = end
+			self._next += 1
@@ -0,0 +1,69 @@
+"""
+Decoding of numbered image sequences for the frame importer. The
+functions in here run in a pool of worker processes (or threads), so
+nothing in here talks to gimp.
+"""
+
+import os
+import re
+import zlib
+import struct
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from narly_sprite_lib.png import read_png
+from narly_sprite_lib.sheet import get_rgba_alpha_bounds
+
+def natural_sort_key(path):
+	"""
+	Sorts "walk_2.png" before "walk_10.png"
+	"""
+	parts = re.split(r"(\d+)", os.path.basename(path))
+	return [int(part) if part.isdigit() else part.lower() for part in parts]
+
+def crop_pixels(data, width, x, y, crop_width, crop_height, bpp=4):
+	row_len = width * bpp
+	return "".join(
+		data[row*row_len + x*bpp:row*row_len + (x+crop_width)*bpp]
+		for row in xrange(y, y+crop_height)
+	)
+
+def decode_frame(path):
+	"""
+	Decodes the image and trims it to its alpha bounds.
+
+	@returns (path, width, height, bounds, data) where width and height
+	are the size of the whole image, bounds is (x, y, width, height) of the
+	trimmed RGBA pixels in data, or None if the image is fully transparent.
+	data is None if the file couldn't be decoded (it's not a png, or it's
+	broken), for gimp to have a go at it instead.
+	"""
+	try:
+		width, height, data = read_png(path)
+	except (ValueError, IndexError, struct.error, zlib.error):
+		return (path, 0, 0, None, None)
+
+	bounds = get_rgba_alpha_bounds(data, width, height)
+	if bounds is None:
+		return (path, width, height, None, "")
+
+	if bounds != (0, 0, width, height):
+		data = crop_pixels(data, width, *bounds)
+	return (path, width, height, bounds, data)
+
+def get_worker_count(workers):
+	"""
+	@returns the number of workers to use, where 0 means one per CPU
+	"""
+	if workers > 0:
+		return workers
+	return multiprocessing.cpu_count()
+
+def make_worker_pool(workers):
+	"""
+	@returns a pool of worker processes, or of threads where processes
+	would have to re-import the plugin (windows has no fork)
+	"""
+	if os.name == "nt":
+		return ThreadPool(workers)
+	return multiprocessing.Pool(workers)
@@ -0,0 +1,449 @@
+"""
+Sprite sheet layout and metadata. Nothing in here talks to gimp, so it
+can be used from the export worker process as well as from the plugin.
+"""
+
+import math
+import json
+import struct
+
+# The binary index is a fixed size header followed by one fixed size
+# record per frame (in sheet order), so record i lives at
+# SHEET_INDEX_HEADER.size + i*SHEET_INDEX_RECORD.size and can be read
+# straight out of a memory-mapped file.
+#
+# header: magic, version, record size, frame count, sheet width, sheet height,
+#         frame width, frame height, reserved
+# record: frame num, rect x, rect y, rect w, rect h, source offset x,
+#         source offset y, source w, source h, pivot x, pivot y, flags
+SHEET_INDEX_MAGIC = "NSPI"
+SHEET_INDEX_VERSION = 1
+SHEET_INDEX_HEADER = struct.Struct("<4sHHIIIIII")
+SHEET_INDEX_RECORD = struct.Struct("<iiiiiiiiiffI")
+
+# record flags
+SHEET_FRAME_EMPTY = 0x1
+
+def next_power_of_two(n):
+	res = 1
+	while res < n:
+		res <<= 1
+	return res
+
+def solve_sheet_layout(num_frames, cell_width, cell_height, padding=0, extrude=0,
+		max_width=0, max_height=0, power_of_two=False, fixed_cols=0, fixed_rows=0):
+	"""
+	Searches every row/column count that can hold num_frames cells and
+	returns the one with the smallest (padded) sheet area that satisfies
+	the constraints. A max_width/max_height of 0 means unbounded, as does
+	a fixed_cols/fixed_rows of 0.
+
+	Each cell is the frame size plus `extrude` pixels of repeated edge on
+	every side, and `padding` transparent pixels separate the cells from
+	each other and from the sheet border.
+
+	@returns a layout dict, or None if no layout fits the constraints
+	"""
+	if num_frames <= 0:
+		return None
+
+	stride_x = cell_width + 2*extrude + padding
+	stride_y = cell_height + 2*extrude + padding
+
+	if fixed_cols > 0:
+		col_choices = [fixed_cols]
+	elif fixed_rows > 0:
+		col_choices = [int(math.ceil(float(num_frames) / fixed_rows))]
+	else:
+		col_choices = range(1, num_frames+1)
+
+	best = None
+	best_key = None
+	for num_cols in col_choices:
+		num_rows = int(math.ceil(float(num_frames) / num_cols))
+		if fixed_rows > 0 and num_rows > fixed_rows:
+			continue
+
+		width = num_cols*stride_x + padding
+		height = num_rows*stride_y + padding
+		if power_of_two:
+			width = next_power_of_two(width)
+			height = next_power_of_two(height)
+
+		if max_width > 0 and width > max_width:
+			continue
+		if max_height > 0 and height > max_height:
+			continue
+
+		# smallest area first, then the squarest sheet, then the fewest
+		# empty cells in the last row
+		key = (width*height, abs(width-height), num_cols*num_rows - num_frames)
+		if best_key is None or key < best_key:
+			best_key = key
+			best = {
+				"cols": num_cols,
+				"rows": num_rows,
+				"width": width,
+				"height": height,
+				"cell_width": cell_width,
+				"cell_height": cell_height,
+				"padding": padding,
+				"extrude": extrude,
+			}
+
+	return best
+
+def get_layout_cell_pos(layout, index):
+	"""
+	Returns the (x, y) position in the sheet where the frame at `index`
+	in the frame list should have its top-left pixel (not counting the
+	extruded edges).
+	"""
+	col = index % layout["cols"]
+	row = index // layout["cols"]
+	stride_x = layout["cell_width"] + 2*layout["extrude"] + layout["padding"]
+	stride_y = layout["cell_height"] + 2*layout["extrude"] + layout["padding"]
+	x = layout["padding"] + col*stride_x + layout["extrude"]
+	y = layout["padding"] + row*stride_y + layout["extrude"]
+	return (x, y)
+
+def make_frame_metadata(frame_num, x, y, width, height, bounds):
+	"""
+	Builds the metadata for one frame of a sheet. The pivot is the
+	center of the frame's alpha bounds, normalized to the frame size.
+	"""
+	if bounds is None:
+		bounds = (0, 0, 0, 0)
+		pivot = (0.5, 0.5)
+	else:
+		pivot = (
+			(bounds[0] + bounds[2]/2.0) / width,
+			(bounds[1] + bounds[3]/2.0) / height,
+		)
+
+	return {
+		"frame": frame_num,
+		"rect": {"x": x, "y": y, "w": width, "h": height},
+		"source_offset": {"x": bounds[0], "y": bounds[1]},
+		"source_size": {"w": bounds[2], "h": bounds[3]},
+		"pivot": {"x": pivot[0], "y": pivot[1]},
+	}
+
+def write_sheet_metadata(base_path, sheet_width, sheet_height, frame_width, frame_height, frames, extra=None):
+	"""
+	Writes base_path.json and the binary index base_path.idx for the
+	frame metadata (see make_frame_metadata) of a sheet.
+	"""
+	meta = {
+		"version": SHEET_INDEX_VERSION,
+		"sheet": {"w": sheet_width, "h": sheet_height},
+		"frame_size": {"w": frame_width, "h": frame_height},
+		"frames": frames,
+	}
+	if extra is not None:
+		meta.update(extra)
+
+	with open(base_path + ".json", "w") as f:
+		json.dump(meta, f, indent=1, sort_keys=True)
+
+	with open(base_path + ".idx", "wb") as f:
+		f.write(SHEET_INDEX_HEADER.pack(
+			SHEET_INDEX_MAGIC,
+			SHEET_INDEX_VERSION,
+			SHEET_INDEX_RECORD.size,
+			len(frames),
+			sheet_width,
+			sheet_height,
+			frame_width,
+			frame_height,
+			0,	# reserved
+		))
+		for frame in frames:
+			flags = 0
+			if frame["source_size"]["w"] == 0:
+				flags |= SHEET_FRAME_EMPTY
+			f.write(SHEET_INDEX_RECORD.pack(
+				frame["frame"],
+				frame["rect"]["x"],
+				frame["rect"]["y"],
+				frame["rect"]["w"],
+				frame["rect"]["h"],
+				frame["source_offset"]["x"],
+				frame["source_offset"]["y"],
+				frame["source_size"]["w"],
+				frame["source_size"]["h"],
+				frame["pivot"]["x"],
+				frame["pivot"]["y"],
+				flags,
+			))
+
+def get_variant_base_path(base_path, name):
+	"""
+	@returns the path (without extension) of the sheet of a color variant
+	"""
+	return "%s_%s" % (base_path, name)
+
+def to_rgba(data, bpp):
+	"""
+	Converts raw gray, gray+alpha or RGB pixels to RGBA
+	"""
+	if bpp == 4:
+		return data
+
+	res = bytearray(len(data) // bpp * 4)
+	if bpp == 3:
+		res[0::4] = data[0::3]
+		res[1::4] = data[1::3]
+		res[2::4] = data[2::3]
+		res[3::4] = "\xff" * (len(data) // 3)
+	elif bpp == 2:
+		res[0::4] = data[0::2]
+		res[1::4] = data[0::2]
+		res[2::4] = data[0::2]
+		res[3::4] = data[1::2]
+	else:
+		res[0::4] = data
+		res[1::4] = data
+		res[2::4] = data
+		res[3::4] = "\xff" * len(data)
+	return str(res)
+
+def get_rgba_alpha_bounds(data, width, height, bpp=4):
+	"""
+	Same as the plugin's get_alpha_bounds, but for a raw buffer whose
+	last channel is alpha (RGBA by default).
+
+	@returns (x, y, width, height) or None if every pixel is transparent
+	"""
+	alpha = data[bpp-1::bpp]
+	min_x = width
+	max_x = -1
+	min_y = None
+	max_y = None
+	for y in xrange(height):
+		row = alpha[y*width:(y+1)*width]
+		left = len(row) - len(row.lstrip("\x00"))
+		if left == width:
+			continue
+		right = len(row.rstrip("\x00")) - 1
+		if min_y is None:
+			min_y = y
+		max_y = y
+		min_x = min(min_x, left)
+		max_x = max(max_x, right)
+
+	if min_y is None:
+		return None
+	return (min_x, min_y, max_x - min_x + 1, max_y - min_y + 1)
+
+def blit_frame(sheet, sheet_width, data, width, height, x, y, extrude=0, bpp=4):
+	"""
+	Copies the raw frame `data` into the raw `sheet` bytearray with its
+	top-left pixel at (x, y), repeating its edge pixels `extrude` pixels
+	out on every side (see the plugin's _extrude_layer_edges).
+	"""
+	row_len = width * bpp
+	sheet_row_len = sheet_width * bpp
+
+	def put_row(dest_y, row):
+		if extrude > 0:
+			row = row[:bpp]*extrude + row + row[-bpp:]*extrude
+		start = dest_y*sheet_row_len + (x - extrude)*bpp
+		sheet[start:start+len(row)] = row
+
+	for row_y in xrange(height):
+		put_row(y + row_y, data[row_y*row_len:(row_y+1)*row_len])
+
+	for i in xrange(1, extrude+1):
+		put_row(y - i, data[:row_len])
+		put_row(y + height - 1 + i, data[(height-1)*row_len:height*row_len])
+
+class SheetStream(object):
+	"""
+	Builds a sheet one row of cells at a time, passing each finished band
+	of pixel rows to write_rows (eg. a png.PngWriter's), so only one row
+	of cells is ever held. Frames have to be added in layout order.
+	"""
+	def __init__(self, layout, write_rows, bpp=4):
+		self.layout = layout
+		self.bpp = bpp
+		self._write_rows = write_rows
+		self._row_len = layout["width"] * bpp
+		self._stride_y = layout["cell_height"] + 2*layout["extrude"] + layout["padding"]
+		self._band = bytearray(self._stride_y * self._row_len)
+		self._band_row = 0
+		self._write_blank_rows(layout["padding"])
+
+	def _write_blank_rows(self, num_rows):
+		if num_rows > 0:
+			self._write_rows("\x00" * (num_rows * self._row_len))
+
+	def _flush_band(self):
+		self._write_rows(str(self._band))
+		self._band = bytearray(len(self._band))
+		self._band_row += 1
+
+	def add_frame(self, index, data, width, height):
+		"""
+		Blits the raw frame `data` into the cell at `index` (see
+		get_layout_cell_pos)
+		"""
+		row = index // self.layout["cols"]
+		if row < self._band_row:
+			raise ValueError("frame %d was added after a later row of the sheet" % index)
+		while self._band_row < row:
+			self._flush_band()
+		x, y = get_layout_cell_pos(self.layout, index)
+		band_y = y - self.layout["padding"] - row*self._stride_y
+		blit_frame(self._band, self.layout["width"], data, width, height, x, band_y,
+			self.layout["extrude"], self.bpp)
+
+	def close(self):
+		"""
+		Writes the rest of the sheet, including any empty cells and the
+		power of two padding
+		"""
+		while self._band_row < self.layout["rows"]:
+			self._flush_band()
+		used = self.layout["padding"] + self.layout["rows"]*self._stride_y
+		self._write_blank_rows(self.layout["height"] - used)
+
+def alpha_profile_strip(data, width, height, bpp):
+	"""
+	Projects the alpha channel of a strip of rows of raw pixels onto both
+	axes (using numpy if it's available).
+
+	@returns (cols, rows) - for every column whether any pixel in it isn't
+	fully transparent, and the same for every row
+	"""
+	try:
+		import numpy
+	except ImportError:
+		alpha = data[bpp-1::bpp]
+		rows = [alpha[y*width:(y+1)*width].strip("\x00") != "" for y in xrange(height)]
+		cols = [alpha[x::width].strip("\x00") != "" for x in xrange(width)]
+		return cols, rows
+
+	alpha = numpy.frombuffer(data, numpy.uint8)[bpp-1::bpp].reshape(height, width) != 0
+	return alpha.any(axis=0).tolist(), alpha.any(axis=1).tolist()
+
+def _get_spacing(positions):
+	"""
+	@returns the distance between the positions if they're all a multiple
+	of the smallest one apart (empty cells in between), else None
+	"""
+	diffs = [b - a for a, b in zip(positions, positions[1:])]
+	if len(diffs) == 0 or min(diffs) <= 0:
+		return None
+	pitch = min(diffs)
+	if any(diff % pitch != 0 for diff in diffs):
+		return None
+	return pitch
+
+def _get_run_pitch(runs):
+	"""
+	@returns the pitch of the cells from the distances between the starts
+	of the runs, or between their centres, or None if they disagree
+	"""
+	pitch = _get_spacing([start for start, end in runs])
+	if pitch is not None:
+		return pitch
+	# twice the centres, to stay in whole pixels
+	pitch = _get_spacing([start + end for start, end in runs])
+	if pitch is not None and pitch % 2 == 0:
+		return pitch // 2
+	return None
+
+def _fit_cells(runs, length, pitch, target=None):
+	"""
+	Finds the offset of the first cell that puts each run in a cell of its
+	own. Cells can be empty (a blank row or column of the sheet), but the
+	margin before the first cell has to be smaller than a cell. The offset
+	closest to target wins, or without one, the offset with the fewest
+	cells.
+
+	@returns (offset, number of cells) or None if no offset fits
+	"""
+	best = None
+	best_score = None
+	for offset in xrange(0, min(pitch, runs[0][0]+1)):
+		num_cells = (length - offset) // pitch
+		used = set()
+		fits = True
+		for start, end in runs:
+			idx = (start - offset) // pitch
+			if idx >= num_cells or end > offset + (idx+1)*pitch or idx in used:
+				fits = False
+				break
+			used.add(idx)
+		if not fits:
+			continue
+		if target is None:
+			score = num_cells
+		else:
+			score = min((offset - target) % pitch, (target - offset) % pitch)
+		if best is None or score < best_score:
+			best = (offset, num_cells)
+			best_score = score
+	return best
+
+def find_gutter_cells(profile, min_gutter=1):
+	"""
+	Splits one axis of a sheet into cells, using the fully transparent
+	gutters in its alpha profile (see alpha_profile_strip). Gaps narrower
+	than min_gutter are considered to be part of a cell.
+
+	Equally sized cells are preferred. Their pitch is the distance between
+	the runs of content (or a multiple of it, where a whole row or column
+	of the sheet is blank), with the cell edges as close to the middle of
+	the gutters as they fit. If the runs aren't evenly spaced, the biggest
+	cells that put each run in a cell of its own are used, and if there
+	aren't any, the cells are split down the middle of the gutters.
+
+	@returns a list of (start, size) for each cell
+	"""
+	length = len(profile)
+	runs = []
+	pos = 0
+	while pos < length:
+		if not profile[pos]:
+			pos += 1
+			continue
+		start = pos
+		while pos < length and profile[pos]:
+			pos += 1
+		if len(runs) > 0 and start - runs[-1][1] < min_gutter:
+			runs[-1] = (runs[-1][0], pos)
+		else:
+			runs.append((start, pos))
+
+	if len(runs) == 0:
+		return []
+
+	count = len(runs)
+	longest = max(end - start for start, end in runs)
+	pitch = _get_run_pitch(runs)
+	if pitch is not None and pitch >= longest:
+		# the middle of the first gutter between neighbouring runs
+		target = None
+		for (_, end), (start, _) in zip(runs, runs[1:]):
+			if start - end < pitch:
+				target = (end + start) // 2 % pitch
+				break
+		best = _fit_cells(runs, length, pitch, target)
+		if best is not None:
+			offset, num_cells = best
+			return [(offset + cell*pitch, pitch) for cell in xrange(num_cells)]
+
+	for pitch in xrange(length // count, longest-1, -1):
+		best = _fit_cells(runs, length, pitch)
+		if best is not None:
+			offset, num_cells = best
+			return [(offset + cell*pitch, pitch) for cell in xrange(num_cells)]
+
+	res = []
+	for idx, (start, end) in enumerate(runs):
+		cell_start = 0 if idx == 0 else (runs[idx-1][1] + start) // 2
+		cell_end = length if idx == count-1 else (end + runs[idx+1][0]) // 2
+		res.append((cell_start, cell_end - cell_start))
+	return res
@@ -0,0 +1,207 @@
+"""
+Texture array export: each frame becomes one layer of a 2D texture array
+of uncompressed RGBA8 pixels, so an engine can mmap the file and upload
+it without repacking anything. Two containers:
+
+	KTX2	KTX 2.0 (https://registry.khronos.org/KTX/specs/2.0/) with
+		vkFormat R8G8B8A8_SRGB (or _UNORM), no supercompression. As
+		the spec requires, the mip levels are stored smallest first.
+	raw	RAW_HEADER, a RAW_LEVEL for each mip level, then the levels
+		largest first
+
+Within a level the layers follow each other in frame order, every layer
+a width x height block of pixels, top row first. The offsets of every
+level and layer only depend on the frame size, the number of frames and
+the number of levels, so the header goes out first and each frame (and
+its mips) is written straight to its own slices as it's composited.
+"""
+
+import os
+import struct
+
+from narly_sprite_lib.scale import iter_mip_chain
+
+KTX2_IDENTIFIER = "\xabKTX 20\xbb\r\n\x1a\n"
+
+# vkFormat, typeSize, pixelWidth, pixelHeight, pixelDepth, layerCount,
+# faceCount, levelCount, supercompressionScheme
+KTX2_HEADER = struct.Struct("<12s9I")
+# dfdByteOffset, dfdByteLength, kvdByteOffset, kvdByteLength,
+# sgdByteOffset, sgdByteLength
+KTX2_INDEX = struct.Struct("<4I2Q")
+# byteOffset, byteLength, uncompressedByteLength
+KTX2_LEVEL = struct.Struct("<3Q")
+
+VK_FORMAT_R8G8B8A8_UNORM = 37
+VK_FORMAT_R8G8B8A8_SRGB = 43
+
+# the data format descriptor (a basic block describing RGBA8):
+# vendorId + descriptorType, versionNumber, descriptorBlockSize,
+# colorModel, colorPrimaries, transferFunction, flags,
+# texelBlockDimension0-3, bytesPlane0-7
+DFD_BLOCK = struct.Struct("<IHH4B4B8B")
+# bitOffset, bitLength - 1, channelType, samplePosition0-3, sampleLower,
+# sampleUpper
+DFD_SAMPLE = struct.Struct("<HBB4BII")
+DFD_CHANNELS = (0, 1, 2, 15)	# R, G, B, A
+DFD_QUALIFIER_LINEAR = 0x10
+
+# magic, version, bytes per pixel, width, height, layers, levels
+RAW_HEADER = struct.Struct("<4sHHIIII")
+# offset, length
+RAW_LEVEL = struct.Struct("<QQ")
+RAW_MAGIC = "NSTA"
+RAW_VERSION = 1
+
+def get_level_sizes(width, height, mipmaps):
+	"""
+	@returns the (width, height) of every mip level, down to 1x1 with
+	mipmaps on or just the full size level without
+	"""
+	res = [(width, height)]
+	if mipmaps:
+		while width > 1 or height > 1:
+			width = max(width // 2, 1)
+			height = max(height // 2, 1)
+			res.append((width, height))
+	return res
+
+def _align(offset, alignment):
+	return (offset + alignment - 1) // alignment * alignment
+
+def _make_dfd(srgb):
+	samples = []
+	for idx, channel in enumerate(DFD_CHANNELS):
+		# alpha is linear even in an srgb format
+		if srgb and channel == 15:
+			channel |= DFD_QUALIFIER_LINEAR
+		samples.append(DFD_SAMPLE.pack(idx*8, 7, channel, 0, 0, 0, 0, 0, 255))
+	block_size = DFD_BLOCK.size + len(samples)*DFD_SAMPLE.size
+	block = DFD_BLOCK.pack(
+		0,	# khronos, basic format
+		2,	# version 1.3 of the data format spec
+		block_size,
+		1,	# RGBSDA color model
+		1,	# BT.709 primaries
+		2 if srgb else 1,	# sRGB or linear transfer function
+		0,	# straight alpha
+		0, 0, 0, 0,
+		4, 0, 0, 0, 0, 0, 0, 0
+	)
+	return struct.pack("<I", 4 + block_size) + block + "".join(samples)
+
+def _make_kvd(entries):
+	res = []
+	for key, value in sorted(entries):
+		entry = key + "\x00" + value + "\x00"
+		res.append(struct.pack("<I", len(entry)) + entry)
+		res.append("\x00" * (_align(len(entry), 4) - len(entry)))
+	return "".join(res)
+
+class TextureArrayWriter(object):
+	"""
+	Writes the frames of a texture array (see the module docs) to a file
+	one layer at a time. Only the layer being written and one of its mip
+	levels are held in memory.
+	"""
+	def __init__(self, path, width, height, num_layers, mipmaps=False, ktx2=True, srgb=True, bpp=4):
+		self.path = path
+		self.width = width
+		self.height = height
+		self.num_layers = num_layers
+		self.mipmaps = mipmaps
+		self.bpp = bpp
+		self.levels = get_level_sizes(width, height, mipmaps)
+		# the size of one layer of each level
+		self.slice_sizes = [level_width*level_height*bpp for level_width, level_height in self.levels]
+
+		if ktx2:
+			header, self.level_offsets = self._make_ktx2_header(srgb)
+		else:
+			header, self.level_offsets = self._make_raw_header()
+		file_size = max(offset + size*num_layers for offset, size in zip(self.level_offsets, self.slice_sizes))
+
+		self._file = open(path, "wb")
+		self._file.write(header)
+		# layers can be written in any order, the file is already full size
+		self._file.truncate(file_size)
+
+	def _make_ktx2_header(self, srgb):
+		dfd = _make_dfd(srgb)
+		kvd = _make_kvd([("KTXorientation", "rd"), ("KTXwriter", "narly_sprite")])
+		dfd_offset = KTX2_HEADER.size + KTX2_INDEX.size + len(self.levels)*KTX2_LEVEL.size
+		kvd_offset = dfd_offset + len(dfd)
+		data_start = _align(kvd_offset + len(kvd), self.bpp)
+
+		# the smallest level comes first
+		level_offsets = [0] * len(self.levels)
+		offset = data_start
+		for level in reversed(xrange(len(self.levels))):
+			offset = _align(offset, self.bpp)
+			level_offsets[level] = offset
+			offset += self.slice_sizes[level] * self.num_layers
+
+		header = [
+			KTX2_HEADER.pack(
+				KTX2_IDENTIFIER,
+				VK_FORMAT_R8G8B8A8_SRGB if srgb else VK_FORMAT_R8G8B8A8_UNORM,
+				1,	# type size
+				self.width,
+				self.height,
+				0,	# depth, 0 = a 2d texture
+				self.num_layers,
+				1,	# faces
+				len(self.levels),
+				0	# no supercompression
+			),
+			KTX2_INDEX.pack(dfd_offset, len(dfd), kvd_offset, len(kvd), 0, 0),
+		]
+		for level, offset in enumerate(level_offsets):
+			length = self.slice_sizes[level] * self.num_layers
+			header.append(KTX2_LEVEL.pack(offset, length, length))
+		header.append(dfd)
+		header.append(kvd)
+		return "".join(header), level_offsets
+
+	def _make_raw_header(self):
+		offset = RAW_HEADER.size + len(self.levels)*RAW_LEVEL.size
+		level_offsets = []
+		for slice_size in self.slice_sizes:
+			level_offsets.append(offset)
+			offset += slice_size * self.num_layers
+
+		header = [RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, self.bpp, self.width, self.height,
+			self.num_layers, len(self.levels))]
+		for level_offset, slice_size in zip(level_offsets, self.slice_sizes):
+			header.append(RAW_LEVEL.pack(level_offset, slice_size * self.num_layers))
+		return "".join(header), level_offsets
+
+	def _write_slice(self, level, layer_idx, data):
+		if len(data) != self.slice_sizes[level]:
+			raise ValueError("level %d slices are %d bytes, got %d" % (level, self.slice_sizes[level], len(data)))
+		self._file.seek(self.level_offsets[level] + layer_idx*self.slice_sizes[level])
+		self._file.write(data)
+
+	def write_layer(self, layer_idx, data):
+		"""
+		Writes the frame's pixels as layer layer_idx, and its mip chain if
+		mipmaps are on.
+		"""
+		data = str(data)
+		self._write_slice(0, layer_idx, data)
+		if self.mipmaps:
+			for level, width, height, mip in iter_mip_chain(data, self.width, self.height):
+				self._write_slice(level, layer_idx, mip)
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def abort(self):
+		"""
+		Closes and deletes the unfinished file
+		"""
+		self.close()
+		if os.path.exists(self.path):
+			os.remove(self.path)
@@ -0,0 +1,48 @@
+"""
+The in-memory thumbnail cache of the timeline window.
+
+Thumbnails are keyed by frame (its tattoo) and remember the signature of
+the frame they were made from, so a thumbnail is thrown away as soon as
+its frame changes. When the thumbnails use more than the memory budget,
+the least recently used ones are dropped.
+"""
+
+from collections import OrderedDict
+
+class ThumbnailCache(object):
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.size = 0
+		# frame id -> (signature, thumbnail), least recently used first
+		self._entries = OrderedDict()
+
+	def get(self, frame_id, signature):
+		"""
+		@returns the frame's thumbnail, or None if there isn't one or it
+		was made from a different version of the frame
+		"""
+		entry = self._entries.pop(frame_id, None)
+		if entry is None:
+			return None
+		if entry[0] != signature:
+			self.size -= len(entry[1][2])
+			return None
+		self._entries[frame_id] = entry
+		return entry[1]
+
+	def put(self, frame_id, signature, width, height, data):
+		self.invalidate(frame_id)
+		self._entries[frame_id] = (signature, (width, height, data))
+		self.size += len(data)
+		while self.size > self.max_bytes and len(self._entries) > 1:
+			_, (_, thumb) = self._entries.popitem(last=False)
+			self.size -= len(thumb[2])
+
+	def invalidate(self, frame_id):
+		entry = self._entries.pop(frame_id, None)
+		if entry is not None:
+			self.size -= len(entry[1][2])
+
+	def clear(self):
+		self._entries.clear()
+		self.size = 0
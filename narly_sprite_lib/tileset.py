@@ -0,0 +1,97 @@
+"""
+Tileset + tilemap export. Every frame is cut into fixed size tiles, each
+distinct tile is stored once in a tileset, and each frame becomes a map
+of tile ids, row by row (the same numbering as Tiled):
+
+	0		empty (fully transparent) tile
+	n		the tile at index n-1 of the tileset
+	| TILE_FLIP_X	drawn mirrored left to right
+	| TILE_FLIP_Y	drawn upside down
+
+Tiles at the right and bottom edges of a frame that isn't a multiple of
+the tile size are padded with transparent pixels.
+"""
+
+TILE_FLIP_X = 0x80000000
+TILE_FLIP_Y = 0x40000000
+
+def cut_tiles(data, width, height, tile_size, bpp=4):
+	"""
+	Generates the raw pixels of each tile of the frame, row by row
+	"""
+	data = str(data)
+	row_len = width * bpp
+	tile_row_len = tile_size * bpp
+	for tile_y in xrange(0, height, tile_size):
+		rows = min(tile_size, height - tile_y)
+		for tile_x in xrange(0, width, tile_size):
+			start = tile_y*row_len + tile_x*bpp
+			row_width = min(tile_size, width - tile_x) * bpp
+			tile = [data[start + i*row_len:start + i*row_len + row_width].ljust(tile_row_len, "\x00") for i in xrange(rows)]
+			tile.extend(["\x00" * tile_row_len] * (tile_size - rows))
+			yield "".join(tile)
+
+def flip_tile_x(tile, tile_size, bpp=4):
+	row_len = tile_size * bpp
+	res = []
+	for y in xrange(tile_size):
+		row = tile[y*row_len:(y+1)*row_len]
+		res.append("".join(row[x:x+bpp] for x in xrange(row_len-bpp, -1, -bpp)))
+	return "".join(res)
+
+def flip_tile_y(tile, tile_size, bpp=4):
+	row_len = tile_size * bpp
+	return "".join(tile[y*row_len:(y+1)*row_len] for y in xrange(tile_size-1, -1, -1))
+
+class TilesetBuilder(object):
+	"""
+	Collects the distinct tiles of the frames it's given. With flips on,
+	a tile that's a mirror image of a stored tile reuses it.
+	"""
+	def __init__(self, tile_size, flips=False, bpp=4):
+		self.tile_size = tile_size
+		self.flips = flips
+		self.bpp = bpp
+		self.tiles = []
+		self.num_tiles = 0
+		# tile pixels -> tile id
+		self._ids = {}
+
+	def get_tile_id(self, tile):
+		"""
+		@returns the tile id (see the module docs) of the tile, adding it
+		to the tileset if it's new
+		"""
+		self.num_tiles += 1
+		if tile[self.bpp-1::self.bpp].strip("\x00") == "":
+			return 0
+
+		tile_id = self._ids.get(tile)
+		if tile_id is not None:
+			return tile_id
+
+		if self.flips:
+			flipped_x = flip_tile_x(tile, self.tile_size, self.bpp)
+			flipped_y = flip_tile_y(tile, self.tile_size, self.bpp)
+			flipped_xy = flip_tile_y(flipped_x, self.tile_size, self.bpp)
+			for flipped, flags in ((flipped_x, TILE_FLIP_X), (flipped_y, TILE_FLIP_Y), (flipped_xy, TILE_FLIP_X|TILE_FLIP_Y)):
+				tile_id = self._ids.get(flipped)
+				if tile_id is not None:
+					return tile_id | flags
+
+		self.tiles.append(tile)
+		tile_id = len(self.tiles)
+		self._ids[tile] = tile_id
+		return tile_id
+
+	def add_frame(self, data, width, height):
+		"""
+		@returns the frame's tilemap, a list of tile ids row by row
+		"""
+		return [self.get_tile_id(tile) for tile in cut_tiles(data, width, height, self.tile_size, self.bpp)]
+
+def get_map_size(width, height, tile_size):
+	"""
+	@returns the (columns, rows) of the tilemap of a frame
+	"""
+	return ((width + tile_size - 1) // tile_size, (height + tile_size - 1) // tile_size)
@@ -0,0 +1,411 @@
+"""
+The procedures with windows of their own (settings, timeline, player).
+gtk is only imported once one of the windows is opened.
+"""
+
+from gimpfu import *
+
+from narly_sprite_lib.core import *
+from narly_sprite_lib.sheet import to_rgba
+from narly_sprite_lib.thumbs import ThumbnailCache
+
+def narly_sprite_play_animation(img, layer):
+	return
+	# last_frame_num = get_last_frame_num(img)
+# 
+	# anim_window = AnimationWindow(img)
+	# gtk.main()
+
+# from gobject import timeout_add
+# 
+# class AnimationWindow(gtk.Window):
+	# def __init__ (self, img, *args):
+		# self.img = img
+		# self._currFrameNum = 0
+		# self._frameDelay = 100
+# 
+		# # Create the dialog
+		# win = gtk.Window.__init__(self, *args)
+# 
+		# # Obey the window manager quit signal:
+		# self.connect("destroy", gtk.main_quit)
+# 
+		# # Make the UI
+		# self.set_border_width(10)
+		# vbox = gtk.VBox(spacing=10, homogeneous=False)
+		# self.add(vbox)
+		# label = gtk.Label("Narly Sprite Animator")
+		# vbox.add(label)
+		# label.show()
+# 
+		# table = gtk.Table(rows=2, columns=2, homogeneous=False)
+		# table.set_col_spacings(10)
+		# vbox.add(table)
+# 
+		# # Delay Changer
+		# label = gtk.Label("Delay")
+		# label.set_alignment(xalign=0.0, yalign=1.0)
+		# table.attach(label, 0, 1, 0, 1, xoptions=gtk.FILL, yoptions=0)
+		# label.show()
+		# delay_adj = gtk.Adjustment(value=100, lower=0, upper=5000, step_incr=10)
+		# delay_adj.connect("value_changed", self.delay_changed_cb)
+		# delay_input = gtk.SpinButton(delay_adj, climb_rate=10, digits=0)
+		# table.attach(delay_input, 1, 2, 0, 1)
+		# delay_input.show()
+# 
+		# table.show()
+# 
+		# hbox = gtk.HBox(spacing=20)
+		# play_btn = gtk.Button(stock=gtk.STOCK_MEDIA_PLAY)
+		# play_btn.set_use_stock(True)
+		# hbox.add(play_btn)
+		# play_btn.connect("clicked", self.play_animation)
+		# play_btn.show()
+# 
+		# vbox.add(hbox)
+		# hbox.show()
+# 
+		# # Make the dialog button box
+		# hbox = gtk.HBox(spacing=20)
+# 
+		# btn = gtk.Button("Close")
+		# hbox.add(btn)
+		# btn.show()
+		# btn.connect("clicked", gtk.main_quit)
+# 
+		# vbox.add(hbox)
+		# hbox.show()
+		# vbox.show()
+		# self.show()
+# 
+		# timeout_add(300, self.update, self)	
+		# return win
+# 
+	# def play_animation(self):
+		# pass
+# 
+	# def delay_changed_cb(self, val):
+		# self._frameDelay = val
+# 
+	# def update(self, *args):
+		# pdb.gimp_displays_flush()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+# milliseconds between checks of the image for changes
+TIMELINE_POLL_INTERVAL = 500
+
+# thumbnails are made for the frames that are scrolled into view, plus
+# this many frames on either side of them
+TIMELINE_PRELOAD = 4
+
+def get_frame_signature(frame):
+	"""
+	@returns a cheap summary of the frame's layers that changes when a
+	layer is added, removed, moved, hidden, etc. Painting on a layer
+	doesn't change it.
+	"""
+	res = []
+	for child in frame.children:
+		res.append((
+			pdb.gimp_item_get_tattoo(child),
+			child.visible,
+			child.opacity,
+			child.mode,
+			child.offsets,
+			child.width,
+			child.height,
+		))
+	return tuple(res)
+
+def narly_sprite_timeline(img, layer):
+	"""
+	Opens a strip of frame thumbnails, click one to go to that frame.
+	"""
+	import gtk
+	import gobject
+
+	config = get_config(img)
+	thumb_size = config["timeline_thumb_size"]
+
+	class TimelineWindow(gtk.Window):
+		def __init__(self, img, *args):
+			gtk.Window.__init__(self, *args)
+			self.img = img
+			self.cache = ThumbnailCache(config["timeline_cache_max_mb"] * 1024 * 1024)
+			self.frames = []
+			self.frame_ids = []
+			self.buttons = []
+			self.images = []
+			# the thumbnail each image is showing
+			self.shown = []
+			self.active_frame_id = None
+
+			self.set_title("Narly Sprite Timeline")
+			self.set_type_hint(gtk.gdk.WINDOW_TYPE_HINT_UTILITY)
+			self.set_keep_above(True)
+			self.set_default_size(640, thumb_size + 60)
+			self.set_border_width(4)
+			self.connect("destroy", gtk.main_quit)
+
+			self.scroller = gtk.ScrolledWindow()
+			self.scroller.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_NEVER)
+			self.scroller.get_hadjustment().connect("value-changed", self.update_thumbnails)
+			self.scroller.connect("size-allocate", self.update_thumbnails)
+			self.add(self.scroller)
+
+			self.strip = gtk.HBox(spacing=2)
+			self.scroller.add_with_viewport(self.strip)
+
+			self.rebuild()
+			self.show_all()
+			gobject.timeout_add(TIMELINE_POLL_INTERVAL, self.poll)
+
+		def rebuild(self):
+			for button in self.buttons:
+				self.strip.remove(button)
+
+			self.frames = get_frames(self.img)
+			self.frame_ids = [pdb.gimp_item_get_tattoo(frame) for frame in self.frames]
+			self.buttons = []
+			self.images = []
+			self.shown = []
+			for idx, frame in enumerate(self.frames):
+				vbox = gtk.VBox(spacing=2)
+				image = gtk.Image()
+				image.set_size_request(thumb_size, thumb_size)
+				vbox.pack_start(image)
+				vbox.pack_start(gtk.Label(frame.name))
+
+				button = gtk.Button()
+				button.set_relief(gtk.RELIEF_NONE)
+				button.add(vbox)
+				button.connect("clicked", self.frame_clicked, idx)
+				button.show_all()
+				self.strip.pack_start(button, expand=False)
+
+				self.buttons.append(button)
+				self.images.append(image)
+				self.shown.append(None)
+
+		def get_visible_range(self):
+			"""
+			@returns the [start, end) range of frames that need thumbnails
+			"""
+			if len(self.buttons) == 0:
+				return (0, 0)
+			adj = self.scroller.get_hadjustment()
+			cell_width = max(self.buttons[0].allocation.width, thumb_size) + self.strip.get_spacing()
+			start = int(adj.value // cell_width) - TIMELINE_PRELOAD
+			end = int((adj.value + adj.page_size) // cell_width) + 1 + TIMELINE_PRELOAD
+			return (max(start, 0), min(end, len(self.frames)))
+
+		def get_thumbnail(self, idx):
+			frame = self.frames[idx]
+			frame_id = self.frame_ids[idx]
+			signature = get_frame_signature(frame)
+			thumb = self.cache.get(frame_id, signature)
+			if thumb is None:
+				# the thumbnail of the frame folder is its projection, ie
+				# what the frame looks like
+				width, height, bpp, _, data = pdb.gimp_drawable_thumbnail(frame, thumb_size, thumb_size)
+				data = to_rgba(str(bytearray(data)), bpp)
+				self.cache.put(frame_id, signature, width, height, data)
+				thumb = self.cache.get(frame_id, signature)
+			return thumb
+
+		def update_thumbnails(self, *args):
+			start, end = self.get_visible_range()
+			for idx in xrange(len(self.frames)):
+				if idx < start or idx >= end:
+					# don't hold on to the pixels of frames that are out of view
+					if self.shown[idx] is not None:
+						self.images[idx].clear()
+						self.shown[idx] = None
+					continue
+
+				thumb = self.get_thumbnail(idx)
+				if thumb is self.shown[idx]:
+					continue
+				width, height, data = thumb
+				pixbuf = gtk.gdk.pixbuf_new_from_data(
+					data,
+					gtk.gdk.COLORSPACE_RGB,
+					True,	# has alpha
+					8,	# bits per sample
+					width,
+					height,
+					width * 4	# row stride
+				)
+				self.images[idx].set_from_pixbuf(pixbuf)
+				self.shown[idx] = thumb
+
+		def poll(self):
+			if not pdb.gimp_image_is_valid(self.img):
+				self.destroy()
+				return False
+
+			frame_ids = [pdb.gimp_item_get_tattoo(frame) for frame in get_frames(self.img)]
+			if frame_ids != self.frame_ids:
+				self.rebuild()
+
+			# painting doesn't change a frame's signature, so the thumbnail of
+			# the frame being edited is always remade, as is the thumbnail of
+			# the frame that was being edited before
+			active = pdb.gimp_image_get_active_layer(self.img)
+			active_frame_id = None
+			if get_frame_num(active) is not None:
+				active_frame_id = pdb.gimp_item_get_tattoo(get_frame_root(active))
+			if self.active_frame_id is not None:
+				self.cache.invalidate(self.active_frame_id)
+			self.active_frame_id = active_frame_id
+			if active_frame_id is not None:
+				self.cache.invalidate(active_frame_id)
+
+			for frame_id, button in zip(self.frame_ids, self.buttons):
+				if frame_id == active_frame_id:
+					button.set_relief(gtk.RELIEF_NORMAL)
+				else:
+					button.set_relief(gtk.RELIEF_NONE)
+
+			self.update_thumbnails()
+			return True
+
+		def frame_clicked(self, widget, idx):
+			frame = self.frames[idx]
+			if not pdb.gimp_item_is_valid(frame):
+				return
+
+			# keep the same layer selected, if the frame has one there
+			layer_pos = 0
+			active = pdb.gimp_image_get_active_layer(self.img)
+			if get_frame_num(active) is not None and not is_frame_root(active):
+				layer_pos = pdb.gimp_image_get_layer_position(self.img, active)
+				if layer_pos >= len(frame.children):
+					layer_pos = 0
+
+			pdb.gimp_image_undo_freeze(self.img)
+			goto_frame(self.img, get_frame_num(frame), layer_pos)
+			pdb.gimp_image_undo_thaw(self.img)
+			gimp.displays_flush()
+			self.poll()
+
+	timeline_window = TimelineWindow(img)
+	gtk.main()
+
+# -----------------------------------------------
+# -----------------------------------------------
+# -----------------------------------------------
+
+def narly_sprite_settings(img, layer):
+	import gtk
+	class NarlySettingsDialog(gtk.Window):
+		def __init__(self, img, *args):
+			self.img = img
+			self.config = get_config(img)
+
+			win = gtk.Window.__init__(self, *args)
+			self.connect("destroy", gtk.main_quit)
+			self.set_border_width(10)
+
+			# add the main vbox and the title label
+			vbox = gtk.VBox(spacing=10, homogeneous=False)
+			self.add(vbox)
+			label = gtk.Label("Narly Sprite Settings")
+			vbox.add(label)
+			label.show()
+
+			# for new_frame_copy_image_data
+			new_frame_copy = gtk.CheckButton("Copy Pixels to New Frame")
+			new_frame_copy.set_active(self.config["new_frame_copy_image_data"])
+			new_frame_copy.connect("toggled", self.new_frame_copy_toggled, new_frame_copy)
+			vbox.add(new_frame_copy)
+			new_frame_copy.show()
+
+			compact_new_frames = gtk.CheckButton("Shrink Copied Pixels in New Frames to Their Bounds")
+			compact_new_frames.set_active(self.config["compact_new_frames"])
+			compact_new_frames.connect("toggled", self.compact_new_frames_toggled, compact_new_frames)
+			vbox.add(compact_new_frames)
+			compact_new_frames.show()
+
+			sep = gtk.HSeparator()
+			vbox.add(sep)
+			sep.show()
+
+			# for new_frame_copy_image_data
+			always_show_prev_frame = gtk.CheckButton("Always Show Prev Frame")
+			always_show_prev_frame.set_active(self.config["always_show_prev_frame"])
+			always_show_prev_frame.connect("toggled", self.always_show_prev_frame_toggled, always_show_prev_frame)
+			vbox.add(always_show_prev_frame)
+			always_show_prev_frame.show()
+
+			show_prev_frame_on_new = gtk.CheckButton("Show Prev Frame on New")
+			show_prev_frame_on_new.set_active(self.config["show_prev_frame_on_new"])
+			show_prev_frame_on_new.connect("toggled", self.show_prev_frame_on_new_toggled, show_prev_frame_on_new)
+			vbox.add(show_prev_frame_on_new)
+			show_prev_frame_on_new.show()
+
+			hbox = gtk.HBox()
+			label = gtk.Label("Prev Frame Alpha")
+			hbox.add(label)
+			label.show()
+			adj = gtk.Adjustment(
+				value=self.config["prev_frame_alpha"],
+				lower=0.0,
+				upper=100.0,
+				step_incr=1.0,
+				page_incr=10.0,
+			)
+			prev_frame_alpha = gtk.SpinButton(adjustment=adj, climb_rate=0.5, digits=2)
+			adj.connect("value_changed", self.prev_frame_alpha_changed, prev_frame_alpha)
+			hbox.add(prev_frame_alpha)
+			prev_frame_alpha.show()
+			vbox.add(hbox)
+			hbox.show()
+
+			# for always_show_prev_frame
+
+			# for show_prev_frame_on_new
+
+			# for prev_frame_alpha
+
+			# add the exit buttons
+			hbox = gtk.HBox(spacing=20)
+			close_btn = gtk.Button("OK")
+			hbox.add(close_btn)
+			close_btn.show()
+			close_btn.connect("clicked", self.ok_btn_clicked)
+			vbox.add(hbox)
+			hbox.show()
+			vbox.show()
+
+			self.show()
+
+		def prev_frame_alpha_changed(self, widget, spin_btn):
+			self.config["prev_frame_alpha"] = spin_btn.get_value()
+			save_config(self.img, self.config)
+
+		def show_prev_frame_on_new_toggled(self, widget, check_btn):
+			self.config["show_prev_frame_on_new"] = not not widget.get_active()
+			save_config(self.img, self.config)
+
+		def always_show_prev_frame_toggled(self, widget, check_btn):
+			self.config["always_show_prev_frame"] = not not widget.get_active()
+			save_config(self.img, self.config)
+
+		def new_frame_copy_toggled(self, widget, check_btn):
+			self.config["new_frame_copy_image_data"] = not not widget.get_active()
+			save_config(self.img, self.config)
+
+		def compact_new_frames_toggled(self, widget, check_btn):
+			self.config["compact_new_frames"] = not not widget.get_active()
+			save_config(self.img, self.config)
+
+		def ok_btn_clicked(self, *args):
+			save_config(self.img, self.config)
+			gtk.main_quit()
+	
+	settings_dialog = NarlySettingsDialog(img)
+	gtk.main()
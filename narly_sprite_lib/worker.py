@@ -0,0 +1,238 @@
+"""
+Background sprite sheet export.
+
+The plugin dumps the raw pixels of every layer in every frame into a
+snapshot directory (see snapshot_frames in narly_sprite.py) and starts
+this module in a separate process:
+
+	python -m narly_sprite_lib.worker SNAPSHOT_DIR
+
+The worker composites the frames (in several processes, with numpy),
+lays out the sheet, encodes the PNG and writes the metadata, reporting
+back to the plugin on stdout one line at a time:
+
+	progress 0.25
+	done /path/to/sheet.png
+	error some message
+"""
+
+import os
+import sys
+import json
+import mmap
+import itertools
+import multiprocessing
+
+from narly_sprite_lib.sheet import (
+	get_layout_cell_pos,
+	make_frame_metadata,
+	write_sheet_metadata,
+	get_rgba_alpha_bounds,
+	blit_frame,
+	to_rgba,
+	get_variant_base_path,
+)
+from narly_sprite_lib.png import write_png
+from narly_sprite_lib.palette import get_shared_palette, quantize, load_color_variants, recolor_palette, iter_recolored
+from narly_sprite_lib.collision import make_collision_shapes
+from narly_sprite_lib.blend import can_composite, composite_layers
+
+SNAPSHOT_JOB_FILE = "job.json"
+SNAPSHOT_PIXELS_FILE = "pixels.raw"
+
+def open_snapshot(snapshot_dir):
+	"""
+	@returns the job description and the (memory-mapped) raw pixel data
+	of a snapshot
+	"""
+	with open(os.path.join(snapshot_dir, SNAPSHOT_JOB_FILE), "r") as f:
+		job = json.load(f)
+
+	pixels_path = os.path.join(snapshot_dir, SNAPSHOT_PIXELS_FILE)
+	if os.path.getsize(pixels_path) == 0:
+		return job, ""
+	with open(pixels_path, "rb") as f:
+		blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	return job, blob
+
+def _clip_layer(layer, width, height):
+	"""
+	@returns the (x0, y0, x1, y1) part of the canvas the layer covers, or
+	None if it's entirely outside of it
+	"""
+	x0 = max(layer["x"], 0)
+	y0 = max(layer["y"], 0)
+	x1 = min(layer["x"] + layer["width"], width)
+	y1 = min(layer["y"] + layer["height"], height)
+	if x1 <= x0 or y1 <= y0:
+		return None
+	return (x0, y0, x1, y1)
+
+def _composite_python(width, height, layers, blob):
+	canvas = bytearray(width * height * 4)
+
+	# gimp lists the top layer first
+	for layer in reversed(layers):
+		if not layer["visible"]:
+			continue
+		clip = _clip_layer(layer, width, height)
+		if clip is None:
+			continue
+		x0, y0, x1, y1 = clip
+
+		data = bytearray(to_rgba(blob[layer["offset"]:layer["offset"]+layer["length"]], layer["bpp"]))
+		opacity = layer["opacity"] / 100.0
+		for y in xrange(y0, y1):
+			src_i = ((y - layer["y"])*layer["width"] + (x0 - layer["x"])) * 4
+			dest_i = (y*width + x0) * 4
+			for x in xrange(x0, x1):
+				src_a = data[src_i+3] * opacity / 255.0
+				if src_a > 0:
+					dest_a = canvas[dest_i+3] / 255.0
+					out_a = src_a + dest_a*(1.0 - src_a)
+					for c in xrange(3):
+						canvas[dest_i+c] = int((data[src_i+c]*src_a + canvas[dest_i+c]*dest_a*(1.0 - src_a)) / out_a + 0.5)
+					canvas[dest_i+3] = int(out_a*255.0 + 0.5)
+				src_i += 4
+				dest_i += 4
+
+	return str(canvas)
+
+def composite_frame(width, height, layers, blob):
+	"""
+	Composites the layers of a frame from the snapshot with numpy (see
+	blend.py), or without it if they're all plain layers in normal mode.
+
+	@returns the raw RGBA pixels of the frame
+	"""
+	if not can_composite(layers):
+		return _composite_python(width, height, layers, blob)
+
+	def read(layer):
+		data = to_rgba(blob[layer["offset"]:layer["offset"]+layer["length"]], layer["bpp"])
+		mask = None
+		if "mask_offset" in layer:
+			mask = blob[layer["mask_offset"]:layer["mask_offset"]+layer["mask_length"]]
+		return data, mask
+	return composite_layers(width, height, layers, read)
+
+# the snapshot of a compositing process (see iter_composited_frames)
+_pool_snapshot = None
+
+def _init_pool(snapshot_dir):
+	global _pool_snapshot
+	_pool_snapshot = open_snapshot(snapshot_dir)
+
+def _composite_pool_frame(idx):
+	job, blob = _pool_snapshot
+	return composite_frame(job["width"], job["height"], job["frames"][idx]["layers"], blob)
+
+def iter_composited_frames(snapshot_dir, job, blob):
+	"""
+	Generates the composited pixels of each frame of the snapshot in
+	order. The frames are composited by job["workers"] processes (0 = one
+	per CPU), each of which maps the snapshot's pixels itself.
+	"""
+	frames = job["frames"]
+	num_workers = job["workers"] or multiprocessing.cpu_count()
+	num_workers = min(num_workers, len(frames))
+	if num_workers <= 1:
+		for frame in frames:
+			yield composite_frame(job["width"], job["height"], frame["layers"], blob)
+		return
+
+	pool = multiprocessing.Pool(num_workers, _init_pool, (snapshot_dir,))
+	try:
+		for data in pool.imap(_composite_pool_frame, xrange(len(frames))):
+			yield data
+	finally:
+		pool.terminate()
+		pool.join()
+
+def write_sheet_variants(export_base, width, height, variants, sheet, palette, indices, png_options):
+	"""
+	Writes the sheet of each color variant (see load_color_variants). For
+	paletted sheets (palette and indices set) only the palette changes,
+	otherwise the RGBA sheet is recolored.
+
+	@returns {variant name: path of its sheet}
+	"""
+	res = {}
+	if palette is not None:
+		for name, lut in variants:
+			res[name] = get_variant_base_path(export_base, name) + ".png"
+			write_png(res[name], width, height, indices, bpp=1, palette=recolor_palette(palette, lut), **png_options)
+	else:
+		for name, data in iter_recolored(sheet, variants):
+			res[name] = get_variant_base_path(export_base, name) + ".png"
+			write_png(res[name], width, height, data, **png_options)
+	return res
+
+def run_job(snapshot_dir, report):
+	job, blob = open_snapshot(snapshot_dir)
+	layout = job["layout"]
+	width = job["width"]
+	height = job["height"]
+	frames = job["frames"]
+
+	sheet = bytearray(layout["width"] * layout["height"] * 4)
+	frames_meta = []
+	composited = iter_composited_frames(snapshot_dir, job, blob)
+	for idx, (frame, data) in enumerate(itertools.izip(frames, composited)):
+		x, y = get_layout_cell_pos(layout, idx)
+		blit_frame(sheet, layout["width"], data, width, height, x, y, layout["extrude"])
+		bounds = get_rgba_alpha_bounds(data, width, height)
+		frames_meta.append(make_frame_metadata(frame["frame"], x, y, width, height, bounds))
+		if job["collision"]:
+			frames_meta[-1]["collision"] = make_collision_shapes(data, width, height)
+
+		report("progress", float(idx+1) / len(frames))
+
+	png_path = job["export_base"] + ".png"
+	extra = dict(job["extra"], layout=layout)
+	palette = None
+	indices = None
+	if job["palette_colors"] > 0:
+		palette = get_shared_palette(job["palette_file"], sheet, job["palette_colors"])
+		indices = quantize(sheet, layout["width"], layout["height"], palette, job["dither"])
+		write_png(png_path, layout["width"], layout["height"], indices, bpp=1, palette=palette, **job["png"])
+		extra["palette"] = [list(color) for color in palette]
+	else:
+		write_png(png_path, layout["width"], layout["height"], sheet, **job["png"])
+
+	if job["variants_file"]:
+		variant_paths = write_sheet_variants(job["export_base"], layout["width"], layout["height"],
+			load_color_variants(job["variants_file"]), sheet, palette, indices, job["png"])
+		extra["variants"] = dict((name, os.path.basename(path)) for name, path in variant_paths.iteritems())
+
+	if job["write_metadata"]:
+		write_sheet_metadata(
+			job["export_base"],
+			layout["width"],
+			layout["height"],
+			width,
+			height,
+			frames_meta,
+			extra
+		)
+
+	report("done", png_path)
+
+def _report(kind, value):
+	sys.stdout.write("%s %s\n" % (kind, value))
+	sys.stdout.flush()
+
+def main(argv):
+	if len(argv) != 2:
+		sys.stderr.write("usage: %s SNAPSHOT_DIR\n" % argv[0])
+		return 2
+
+	try:
+		run_job(argv[1], _report)
+	except Exception as e:
+		_report("error", str(e).replace("\n", " "))
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv))
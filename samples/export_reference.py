@@ -0,0 +1,35 @@
+"""
+Exports sample_frames.png, the reference the tests composite
+sample.xcf against: each frame (a top level group) shown alone,
+flattened by gimp and placed side by side. Run it from the repository
+with gimp 2.8:
+
+	gimp -idf --batch-interpreter python-fu-eval -b "execfile('samples/export_reference.py')" -b "pdb.gimp_quit(1)"
+"""
+
+import os
+
+from gimpfu import *
+
+SAMPLES_DIR = os.path.join(os.getcwd(), "samples")
+
+def export_reference():
+	img = pdb.gimp_file_load(os.path.join(SAMPLES_DIR, "sample.xcf"), "sample.xcf")
+	frames = img.layers
+	strip = gimp.Image(img.width * len(frames), img.height, RGB)
+
+	for idx, frame in enumerate(frames):
+		for other in frames:
+			other.visible = other == frame
+		layer = pdb.gimp_layer_new_from_visible(img, strip, frame.name)
+		pdb.gimp_image_insert_layer(strip, layer, None, 0)
+		layer.set_offsets(idx * img.width, 0)
+
+	layer = pdb.gimp_image_merge_visible_layers(strip, CLIP_TO_IMAGE)
+	path = os.path.join(SAMPLES_DIR, "sample_frames.png")
+	# keep the color of transparent pixels, like the xcf
+	pdb.file_png_save2(strip, layer, path, path, 0, 9, 0, 0, 0, 0, 0, 0, 1)
+	gimp.delete(strip)
+	gimp.delete(img)
+
+export_reference()
@@ -0,0 +1,158 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from narly_sprite_lib import blend
+from narly_sprite_lib.blend import has_numpy, composite_layers, compare_pixels
+from narly_sprite_lib.worker import _composite_python
+
+# gimp 2.8's 8-bit layer mode math (paint-funcs and gimp-composite-generic),
+# used to build the reference pixels
+
+def int_mult(a, b):
+	t = a*b + 0x80
+	return ((t >> 8) + t) >> 8
+
+def int_mult3(a, b, c):
+	t = a*b*c + 0x7F5B
+	return ((t >> 7) + t) >> 16
+
+def _hardlight(a, b):
+	if b > 128:
+		return 255 - min((255 - a) * (255 - ((b - 128) << 1)) >> 8, 255)
+	return min(a * (b << 1) >> 8, 255)
+
+def _softlight(a, b):
+	multiply = int_mult(a, b)
+	screen = 255 - int_mult(255 - a, 255 - b)
+	return int_mult(255 - a, multiply) + int_mult(a, screen)
+
+REFERENCE_BLENDS = {
+	blend.MULTIPLY: int_mult,
+	blend.SCREEN: lambda a, b: 255 - int_mult(255 - a, 255 - b),
+	blend.OVERLAY: lambda a, b: int_mult(a, a + int_mult(2*b, 255 - a)),
+	blend.DIFFERENCE: lambda a, b: abs(a - b),
+	blend.ADDITION: lambda a, b: min(a + b, 255),
+	blend.SUBTRACT: lambda a, b: max(a - b, 0),
+	blend.DARKEN_ONLY: min,
+	blend.LIGHTEN_ONLY: max,
+	blend.DIVIDE: lambda a, b: min(a * 256 // (b + 1), 255),
+	blend.DODGE: lambda a, b: min(a * 256 // (256 - b), 255),
+	blend.BURN: lambda a, b: 255 - min((255 - a) * 256 // (b + 1), 255),
+	blend.HARDLIGHT: _hardlight,
+	blend.SOFTLIGHT: _softlight,
+	blend.GRAIN_EXTRACT: lambda a, b: min(max(a - b + 128, 0), 255),
+	blend.GRAIN_MERGE: lambda a, b: min(max(a + b - 128, 0), 255),
+}
+
+def reference_composite(base, top, mode, opacity, mask=None):
+	"""
+	gimp 2.8's combine_inten_a_and_inten_a_pixels, with the layer mode
+	applied to top first
+	"""
+	base = bytearray(base)
+	top = bytearray(top)
+	if mask is not None:
+		mask = bytearray(mask)
+	res = bytearray(len(base))
+	opacity = int(round(opacity * 255 / 100.0))
+	for i in xrange(0, len(base), 4):
+		color = top[i:i+3]
+		src_a = top[i+3]
+		if mode != blend.NORMAL:
+			color = [REFERENCE_BLENDS[mode](base[i+c], top[i+c]) for c in xrange(3)]
+			src_a = min(src_a, base[i+3])
+		src_a = int_mult3(src_a, 255 if mask is None else mask[i//4], opacity)
+
+		new_a = base[i+3] + int_mult(255 - base[i+3], src_a)
+		if new_a:
+			ratio = float(src_a) / new_a
+			for c in xrange(3):
+				res[i+c] = int(color[c]*ratio + base[i+c]*(1.0 - ratio) + 0.0001)
+		else:
+			res[i:i+3] = base[i:i+3]
+		res[i+3] = new_a
+	return str(res)
+
+# channel values around the edge cases of the formulas
+VALUES = [0, 1, 2, 17, 64, 127, 128, 129, 200, 253, 254, 255]
+SIZE = len(VALUES)
+
+def make_pixels(func):
+	res = bytearray()
+	for y in xrange(SIZE):
+		for x in xrange(SIZE):
+			res.extend(func(x, y))
+	return str(res)
+
+# every pair of values meets in the red and green channels
+BASE = make_pixels(lambda x, y: (VALUES[x], VALUES[y], VALUES[(x+y) % SIZE], 255))
+TOP = make_pixels(lambda x, y: (VALUES[y], VALUES[x], VALUES[(5*x+y) % SIZE], 255))
+# the color of a nearly transparent pixel is mostly rounding error in 8
+# bits, so the alphas are either 0 or big enough to compare colors
+ALPHAS = [0, 51, 102, 153, 204, 255]
+BASE_ALPHA = make_pixels(lambda x, y: (VALUES[x], VALUES[(x+y) % SIZE], VALUES[y], ALPHAS[(x+2*y) % len(ALPHAS)]))
+TOP_ALPHA = make_pixels(lambda x, y: (VALUES[y], VALUES[x], VALUES[(5*x+y) % SIZE], ALPHAS[(3*x+y) % len(ALPHAS)]))
+MASK = str(bytearray(ALPHAS[(x*5 + y) % len(ALPHAS)] for y in xrange(SIZE) for x in xrange(SIZE)))
+
+def assert_pixels_close(test, res, expected, what=""):
+	max_diff, num_over = compare_pixels(res, expected, 2)
+	test.assertEqual(num_over, 0, "%s%d pixels off by up to %d" % (what, num_over, max_diff))
+
+def make_layer(mode=blend.NORMAL, opacity=100):
+	return {
+		"x": 0, "y": 0, "width": SIZE, "height": SIZE,
+		"visible": True, "opacity": opacity, "mode": mode,
+	}
+
+@unittest.skipIf(not has_numpy(), "numpy isn't installed")
+class BlendModesTest(unittest.TestCase):
+	def composite(self, base, top, mode, opacity=100, mask=None):
+		top_layer = make_layer(mode, opacity)
+		pixels = {id(top_layer): (top, mask)}
+		base_layer = make_layer()
+		pixels[id(base_layer)] = (base, None)
+		return composite_layers(SIZE, SIZE, [top_layer, base_layer], lambda layer: pixels[id(layer)])
+
+	def test_modes(self):
+		for mode in sorted(REFERENCE_BLENDS):
+			res = self.composite(BASE, TOP, mode)
+			assert_pixels_close(self, res, reference_composite(BASE, TOP, mode, 100), "mode %d: " % mode)
+
+	def test_modes_with_alpha(self):
+		for mode in sorted(REFERENCE_BLENDS):
+			res = self.composite(BASE_ALPHA, TOP_ALPHA, mode, 60)
+			assert_pixels_close(self, res, reference_composite(BASE_ALPHA, TOP_ALPHA, mode, 60), "mode %d: " % mode)
+
+	def test_normal(self):
+		res = self.composite(BASE_ALPHA, TOP_ALPHA, blend.NORMAL)
+		assert_pixels_close(self, res, reference_composite(BASE_ALPHA, TOP_ALPHA, blend.NORMAL, 100))
+
+	def test_normal_opacity_and_mask(self):
+		res = self.composite(BASE_ALPHA, TOP_ALPHA, blend.NORMAL, 35, MASK)
+		assert_pixels_close(self, res, reference_composite(BASE_ALPHA, TOP_ALPHA, blend.NORMAL, 35, MASK))
+
+	def test_group(self):
+		# a group of one normal layer blends like the layer itself
+		top_layer = make_layer()
+		group = make_layer(blend.MULTIPLY, 80)
+		group["children"] = [top_layer]
+		base_layer = make_layer()
+		pixels = {id(top_layer): (TOP, None), id(base_layer): (BASE_ALPHA, None)}
+		res = composite_layers(SIZE, SIZE, [group, base_layer], lambda layer: pixels[id(layer)])
+		assert_pixels_close(self, res, reference_composite(BASE_ALPHA, TOP, blend.MULTIPLY, 80))
+
+class CompositePythonTest(unittest.TestCase):
+	def test_normal(self):
+		# the worker's fallback for plain layers when numpy is missing
+		blob = TOP_ALPHA + BASE_ALPHA
+		layers = [make_layer(opacity=70), make_layer()]
+		for idx, layer in enumerate(layers):
+			layer.update(offset=idx*len(TOP_ALPHA), length=len(TOP_ALPHA), bpp=4)
+		res = _composite_python(SIZE, SIZE, layers, blob)
+		assert_pixels_close(self, res, reference_composite(BASE_ALPHA, TOP_ALPHA, blend.NORMAL, 70))
+
+if __name__ == "__main__":
+	unittest.main()
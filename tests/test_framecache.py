@@ -0,0 +1,55 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from narly_sprite_lib.framecache import open_frame_cache, prune_cache_dir, _get_disk_size, CACHE_SUFFIX
+
+class FrameCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def make_cache_file(self, name, mtime, size=4096):
+		path = os.path.join(self.dir, name + CACHE_SUFFIX)
+		if not os.path.isdir(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, "wb") as f:
+			f.write("x" * size)
+		os.utime(path, (mtime, mtime))
+		return path
+
+	def test_reopen_keeps_frames(self):
+		path = os.path.join(self.dir, "a" + CACHE_SUFFIX)
+		cache = open_frame_cache(path, 4, 4, 4, 4*4*4*3)
+		cache.put("f" * 20, "p" * 64)
+		cache.close()
+
+		cache = open_frame_cache(path, 4, 4, 4, 4*4*4*3)
+		self.assertEqual(cache.get("f" * 20), "p" * 64)
+		cache.close()
+
+	def test_prune_least_recently_used(self):
+		old = self.make_cache_file("old", 1000)
+		newer = self.make_cache_file("newer", 2000)
+		kept = self.make_cache_file("kept", 500)
+		# the caches of daemon workers are in sub directories
+		newest = self.make_cache_file(os.path.join("worker", "newest"), 3000)
+
+		# room for two of the three other files
+		prune_cache_dir(self.dir, kept, 2*_get_disk_size(newer))
+		self.assertFalse(os.path.exists(old))
+		self.assertTrue(os.path.exists(newer))
+		self.assertTrue(os.path.exists(newest))
+		self.assertTrue(os.path.exists(kept))
+
+		prune_cache_dir(self.dir, kept, 0)
+		self.assertEqual([os.path.exists(path) for path in (newer, newest, kept)], [False, False, True])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from narly_sprite_lib.palette import recolor_palette, TRANSPARENT
+
+PALETTE = [TRANSPARENT, (200, 150, 120, 255), (10, 10, 10, 128), (100, 200, 100, 255)]
+
+class RecolorPaletteTest(unittest.TestCase):
+	def test_exact_match(self):
+		res = recolor_palette(PALETTE, {(100, 200, 100): (0, 0, 255)})
+		self.assertEqual(res, [TRANSPARENT, (200, 150, 120, 255), (10, 10, 10, 128), (0, 0, 255, 255)])
+
+	def test_quantization_error(self):
+		# entries a little off from the source color still match, and keep
+		# their alpha
+		res = recolor_palette(PALETTE, {(12, 9, 10): (50, 0, 0)})
+		self.assertEqual(res[2], (50, 0, 0, 128))
+
+	def test_unused_colors_change_nothing(self):
+		# not in the sheet, even though it's close to an entry
+		res = recolor_palette(PALETTE, {(220, 170, 140): (0, 0, 0), (0, 0, 0): (255, 0, 0)})
+		self.assertEqual(res, PALETTE)
+
+	def test_closest_source_wins(self):
+		res = recolor_palette(PALETTE, {(203, 150, 120): (1, 1, 1), (201, 149, 120): (2, 2, 2)})
+		self.assertEqual(res[1], (2, 2, 2, 255))
+
+if __name__ == "__main__":
+	unittest.main()
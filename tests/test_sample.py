@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+from narly_sprite_lib.blend import has_numpy, composite_layers, compare_pixels
+from narly_sprite_lib.png import read_png
+from narly_sprite_lib.worker import composite_frame
+from xcf import read_xcf
+
+SAMPLES_DIR = os.path.join(os.path.dirname(TESTS_DIR), "samples")
+
+# the same tolerance as the blend mode tests
+TOLERANCE = 2
+
+class SampleTest(unittest.TestCase):
+	"""
+	Composites the frames of samples/sample.xcf and compares them with
+	samples/sample_frames.png (see samples/export_reference.py)
+	"""
+	@classmethod
+	def setUpClass(cls):
+		cls.width, cls.height, cls.frames = read_xcf(os.path.join(SAMPLES_DIR, "sample.xcf"))
+		strip_width, strip_height, strip = read_png(os.path.join(SAMPLES_DIR, "sample_frames.png"))
+		assert strip_width == cls.width * len(cls.frames) and strip_height == cls.height
+
+		row_len = cls.width * 4
+		cls.expected = []
+		for idx in xrange(len(cls.frames)):
+			rows = [strip[(y*strip_width + idx*cls.width)*4:][:row_len] for y in xrange(cls.height)]
+			cls.expected.append(str("".join(str(row) for row in rows)))
+
+	def assert_frame(self, idx, res):
+		max_diff, num_over = compare_pixels(res, self.expected[idx], TOLERANCE)
+		self.assertEqual(num_over, 0, "frame %d: %d pixels off by up to %d" % (idx, num_over, max_diff))
+
+	def test_worker_frames(self):
+		# the frame's layers as they are in a worker snapshot
+		for idx, frame in enumerate(self.frames):
+			blob = ""
+			layers = []
+			for child in frame["children"]:
+				layer = dict(child, offset=len(blob), length=len(child["pixels"]), bpp=4)
+				del layer["pixels"]
+				layers.append(layer)
+				blob += child["pixels"]
+			self.assert_frame(idx, composite_frame(self.width, self.height, layers, blob))
+
+	@unittest.skipIf(not has_numpy(), "numpy isn't installed")
+	def test_groups(self):
+		for idx, frame in enumerate(self.frames):
+			layers = [dict(other, visible=other is frame) for other in self.frames]
+			res = composite_layers(self.width, self.height, layers, lambda layer: (layer["pixels"], None))
+			self.assert_frame(idx, res)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from narly_sprite_lib.sheet import find_gutter_cells
+
+def make_profile(length, runs):
+	profile = [False] * length
+	for start, end in runs:
+		profile[start:end] = [True] * (end - start)
+	return profile
+
+class FindGutterCellsTest(unittest.TestCase):
+	def test_equal_cells(self):
+		profile = make_profile(128, [(2, 30), (34, 62), (66, 94), (98, 126)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 32), (32, 32), (64, 32), (96, 32)])
+
+	def test_blank_row_of_cells(self):
+		# the second row of cells is completely empty
+		profile = make_profile(128, [(2, 30), (66, 94), (98, 126)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 32), (32, 32), (64, 32), (96, 32)])
+
+	def test_two_blank_rows_of_cells(self):
+		profile = make_profile(160, [(2, 30), (98, 126), (130, 158)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 32), (32, 32), (64, 32), (96, 32), (128, 32)])
+
+	def test_pitch_from_spacing(self):
+		# the cells are 30 pixels apart, not the 33 that would fill the strip
+		profile = make_profile(100, [(6, 20), (36, 50), (66, 80)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 30), (30, 30), (60, 30)])
+
+	def test_leading_margin(self):
+		profile = make_profile(110, [(14, 38), (46, 70), (78, 102)])
+		self.assertEqual(find_gutter_cells(profile), [(10, 32), (42, 32), (74, 32)])
+
+	def test_pitch_from_centres(self):
+		# sprites of different widths centred in 40 pixel cells
+		profile = make_profile(120, [(10, 30), (45, 75), (92, 108)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 40), (40, 40), (80, 40)])
+
+	def test_small_gaps_join_runs(self):
+		profile = make_profile(64, [(2, 10), (11, 30), (34, 62)])
+		self.assertEqual(find_gutter_cells(profile, min_gutter=2), [(0, 32), (32, 32)])
+
+	def test_unequal_cells(self):
+		profile = make_profile(100, [(0, 50), (52, 70), (72, 100)])
+		self.assertEqual(find_gutter_cells(profile), [(0, 51), (51, 20), (71, 29)])
+
+	def test_empty(self):
+		self.assertEqual(find_gutter_cells([False] * 10), [])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,164 @@
+"""
+A minimal reader for the xcf files gimp 2.8 saves (version 3, RGB
+images with RLE compressed tiles and layer groups), enough to composite
+samples/sample.xcf outside of gimp in the tests.
+"""
+
+import struct
+
+XCF_SIGNATURE = "gimp xcf v003\x00"
+XCF_TILE_SIZE = 64
+
+PROP_END = 0
+PROP_OPACITY = 6
+PROP_MODE = 7
+PROP_VISIBLE = 8
+PROP_OFFSETS = 15
+PROP_COMPRESSION = 17
+PROP_GROUP_ITEM = 29
+PROP_ITEM_PATH = 30
+
+COMPRESS_NONE = 0
+COMPRESS_RLE = 1
+
+class _Reader(object):
+	def __init__(self, data):
+		self.data = data
+
+	def uint32(self, pos):
+		return struct.unpack(">I", self.data[pos:pos+4])[0]
+
+	def offsets(self, pos):
+		res = []
+		while True:
+			offset = self.uint32(pos)
+			pos += 4
+			if offset == 0:
+				return res, pos
+			res.append(offset)
+
+	def properties(self, pos):
+		res = {}
+		while True:
+			prop_type, length = struct.unpack(">II", self.data[pos:pos+8])
+			pos += 8
+			if prop_type == PROP_END:
+				return res, pos
+			res[prop_type] = self.data[pos:pos+length]
+			pos += length
+
+def _decode_rle(data, pos, length):
+	res = bytearray()
+	while len(res) < length:
+		n = ord(data[pos])
+		pos += 1
+		if n >= 128:
+			# literal bytes
+			if n == 128:
+				count = struct.unpack(">H", data[pos:pos+2])[0]
+				pos += 2
+			else:
+				count = 256 - n
+			res.extend(data[pos:pos+count])
+			pos += count
+		else:
+			# a repeated byte
+			if n == 127:
+				count = struct.unpack(">H", data[pos:pos+2])[0]
+				pos += 2
+			else:
+				count = n + 1
+			res.extend(data[pos] * count)
+			pos += 1
+	return res, pos
+
+def _read_pixels(reader, pos, compression):
+	width, height, bpp = struct.unpack(">III", reader.data[pos:pos+12])
+	# only the first level is used, the others are unused mipmaps
+	level = reader.uint32(pos + 12)
+	tiles, _ = reader.offsets(level + 8)
+
+	res = bytearray(width * height * bpp)
+	tiles_x = (width + XCF_TILE_SIZE - 1) // XCF_TILE_SIZE
+	for idx, tile_pos in enumerate(tiles):
+		x0 = (idx % tiles_x) * XCF_TILE_SIZE
+		y0 = (idx // tiles_x) * XCF_TILE_SIZE
+		tile_width = min(XCF_TILE_SIZE, width - x0)
+		tile_height = min(XCF_TILE_SIZE, height - y0)
+		num_pixels = tile_width * tile_height
+
+		if compression == COMPRESS_RLE:
+			# one channel after the other
+			channels = []
+			for _ in xrange(bpp):
+				channel, tile_pos = _decode_rle(reader.data, tile_pos, num_pixels)
+				channels.append(channel)
+		elif compression == COMPRESS_NONE:
+			tile = bytearray(reader.data[tile_pos:tile_pos + num_pixels*bpp])
+			channels = [tile[c::bpp] for c in xrange(bpp)]
+		else:
+			raise ValueError("unsupported xcf compression %d" % compression)
+
+		for y in xrange(tile_height):
+			row = ((y0 + y)*width + x0) * bpp
+			for c in xrange(bpp):
+				res[row+c:row+tile_width*bpp:bpp] = channels[c][y*tile_width:(y+1)*tile_width]
+	return str(res), bpp
+
+def read_xcf(path):
+	"""
+	Reads the layers of an RGB xcf file, without masks or channels.
+
+	@returns (width, height, layers), with the layers as dicts like the
+	ones blend.composite_layers takes (top layer first) and the RGBA pixels
+	of each layer in "pixels"
+	"""
+	with open(path, "rb") as f:
+		reader = _Reader(f.read())
+	if reader.data[:len(XCF_SIGNATURE)] != XCF_SIGNATURE:
+		raise ValueError("%s is not a gimp 2.8 xcf file" % path)
+
+	pos = len(XCF_SIGNATURE)
+	width, height, base_type = struct.unpack(">III", reader.data[pos:pos+12])
+	if base_type != 0:
+		raise ValueError("%s: only RGB xcf files are supported" % path)
+	props, pos = reader.properties(pos + 12)
+	compression = ord(props.get(PROP_COMPRESSION, chr(COMPRESS_NONE)))
+	layer_offsets, _ = reader.offsets(pos)
+
+	layers = []
+	for layer_pos in layer_offsets:
+		layer_width, layer_height, _, name_len = struct.unpack(">IIII", reader.data[layer_pos:layer_pos+16])
+		pos = layer_pos + 16
+		name = reader.data[pos:pos+name_len-1]
+		props, pos = reader.properties(pos + name_len)
+		x, y = struct.unpack(">ii", props.get(PROP_OFFSETS, "\0" * 8))
+		layer = {
+			"name": name,
+			"x": x,
+			"y": y,
+			"width": layer_width,
+			"height": layer_height,
+			"visible": struct.unpack(">I", props[PROP_VISIBLE])[0] != 0,
+			"opacity": struct.unpack(">I", props[PROP_OPACITY])[0] * 100.0 / 255,
+			"mode": struct.unpack(">I", props[PROP_MODE])[0],
+		}
+		if PROP_GROUP_ITEM in props:
+			layer["children"] = []
+		else:
+			pixels, bpp = _read_pixels(reader, reader.uint32(pos), compression)
+			if bpp != 4:
+				raise ValueError("%s: layer %s has no alpha" % (path, name))
+			layer["pixels"] = pixels
+
+		# children are saved after their group, with the path of indices
+		# from the top level
+		path_idx = props.get(PROP_ITEM_PATH)
+		siblings = layers
+		if path_idx:
+			indices = struct.unpack(">%dI" % (len(path_idx) // 4), path_idx)
+			for idx in indices[:-1]:
+				siblings = siblings[idx]["children"]
+		siblings.append(layer)
+
+	return width, height, layers